@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Build or update an SQLite catalog of the guider frames under dataRoot.
+
+Reads only the primary header of each gimg-* file, in a pool of processes, and
+skips files whose size and mtime are unchanged since the last run, e.g.:
+
+    gcameraCatalog.py /data/gcam --first-mjd 57000
+
+    sqlite3 /data/gcam/catalog.sqlite \\
+        "select path from frames where imagetyp='dark' and exptime > 10"
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from gcameraICC import catalog
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataRoot', help='directory holding the MJD directories, e.g. /data/gcam')
+    parser.add_argument('--db', help='catalog file (default: dataRoot/catalog.sqlite)')
+    parser.add_argument('--first-mjd', type=int, help='first MJD to scan')
+    parser.add_argument('--last-mjd', type=int, help='last MJD to scan')
+    parser.add_argument('-j', '--processes', type=int, help='header-reading processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    dbPath = args.db or os.path.join(args.dataRoot, 'catalog.sqlite')
+    db = catalog.connect(dbPath)
+    start = time.time()
+    log = lambda msg: sys.stderr.write(msg + '\n')
+    counts = catalog.update(db, args.dataRoot, args.first_mjd, args.last_mjd,
+                            processes=args.processes, log=log)
+    db.close()
+    print('%s: read %d, unchanged %d, removed %d, failed %d, in %0.1fs' %
+          (dbPath, counts['read'], counts['skipped'], counts['removed'], counts['failed'],
+           time.time() - start))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
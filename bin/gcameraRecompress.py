@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Re-encode past nights under dataRoot from gzipped to tile-compressed FITS.
+
+Each gimg-NNNN.fits.gz becomes a RICE-compressed gimg-NNNN.fits.fz, with
+identical pixels (checked by MD5 before anything is replaced). A night is
+converted all-or-nothing, and its calibration notes, header references and
+manifest are updated to the new names. The workers run at idle CPU and I/O
+priority, and --max-mbps limits how fast they go, e.g.:
+
+    gcameraRecompress.py /data/gcam --first-mjd 57000 --last-mjd 57100 -j 2 --max-mbps 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from gcameraICC import durableWrite
+from gcameraICC import recompress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataRoot', help='directory holding the MJD directories, e.g. /data/gcam')
+    parser.add_argument('--first-mjd', type=int, help='first MJD to convert')
+    parser.add_argument('--last-mjd', type=int, help='last MJD to convert')
+    parser.add_argument('--min-age', type=float, default=1.,
+                        help='skip nights with a file modified less than this many days ago (default: %(default)s)')
+    parser.add_argument('-j', '--processes', type=int, default=1, help='worker processes (default: %(default)s)')
+    parser.add_argument('--max-mbps', type=float,
+                        help='maximum MB/s read plus written, per worker (default: unlimited)')
+    parser.add_argument('--fsync', default='frame', choices=durableWrite.policies,
+                        help='fsync policy for the rewritten notes and manifests (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true', help='convert and verify, but replace nothing')
+    args = parser.parse_args(argv)
+
+    log = lambda msg: sys.stderr.write(msg + '\n')
+    maxBytesPerSec = args.max_mbps*1e6 if args.max_mbps else None
+    pool = multiprocessing.Pool(args.processes, recompress.init_worker, (maxBytesPerSec,))
+    writer = durableWrite.DurableWriter(args.fsync)
+    nFiles, nFailed = 0, 0
+    start = time.time()
+    try:
+        for mjdDir in sorted(os.listdir(args.dataRoot)):
+            if not mjdDir.isdigit():
+                continue
+            mjd = int(mjdDir)
+            if ((args.first_mjd is not None and mjd < args.first_mjd) or
+                    (args.last_mjd is not None and mjd > args.last_mjd)):
+                continue
+            dirname = os.path.join(args.dataRoot, mjdDir)
+            newest = max([os.path.getmtime(os.path.join(dirname, name)) for name in os.listdir(dirname)] or [0])
+            if time.time() - newest < args.min_age*86400:
+                log('%s: skipped, still being written' % (dirname))
+                continue
+
+            converted, failures = recompress.recompress_directory(dirname, pool, writer,
+                                                                  dryRun=args.dry_run)
+            for path, error in failures:
+                log('%s: %s' % (path, error))
+            if failures:
+                log('%s: left unchanged, %d files failed' % (dirname, len(failures)))
+            elif converted:
+                log('%s: %s %d files' % (dirname, 'verified' if args.dry_run else 'converted', converted))
+            nFiles += converted
+            nFailed += len(failures)
+    finally:
+        pool.close()
+        pool.join()
+        writer.sync()
+    print('%s %d files, %d failed, in %0.1fs' %
+          ('verified' if args.dry_run else 'converted', nFiles, nFailed, time.time() - start))
+    return 1 if nFailed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,23 @@
 #!/usr/bin/env python
 """
 Start the gcameraICC to operate the APO or LCO guider.
+
+With no arguments, starts either gcamera or ecamera, depending on our name.
+To drive several cameras from one process (and one SDK), pass one
+name[:index] argument per camera, where index is the camera's handle index
+on this host, e.g.:
+
+    lcoGcameraICC_main.py gcamera:0 ecamera:1
+
+Each camera is advertised as its own actor, using that actor's config file.
+
+--profile-startup FILE writes a cProfile of creating the actors (loading the
+command sets and reading the configuration) to FILE, for python -m pstats.
+The startupProfile command reports how long each step of starting took.
 """
 
+import argparse
+import cProfile
 import os
 import sys
 
@@ -19,20 +34,50 @@ def pick_gcamera():
         return ecamera()
 
 
-def gcamera():
+def gcamera(cameraIndex=None):
     # LCOHACK: default location should be APO.
-    return GcameraICC.GcameraICC.newActor('gcamera', location='lco', doConnect=True)
+    return GcameraICC.GcameraICC.newActor('gcamera', location='lco', doConnect=True,
+                                          cameraIndex=cameraIndex)
 
 
-def ecamera():
+def ecamera(cameraIndex=None):
     # LCOHACK: default location should be APO.
-    return GcameraICC.GcameraICC.newActor('ecamera', location='lco', doConnect=True)
+    return GcameraICC.GcameraICC.newActor('ecamera', location='lco', doConnect=True,
+                                          cameraIndex=cameraIndex)
+
+
+def parse_cameras(args):
+    """Return a list of (name, cameraIndex) from name[:index] arguments."""
+    cameras = []
+    for arg in args:
+        name, _, index = arg.partition(':')
+        cameras.append((name, int(index) if index else None))
+    return cameras
 
 
 def main():
-    gcamera = pick_gcamera()
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cameras', nargs='*', help='name[:index] of each camera to drive')
+    parser.add_argument('--profile-startup', metavar='FILE',
+                        help='write a profile of creating the actors to FILE')
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    cameras = parse_cameras(args.cameras)
+    if cameras:
+        gcameras = [GcameraICC.GcameraICC.newActor(name, location='lco', doConnect=True,
+                                                   cameraIndex=index)
+                    for name, index in cameras]
+    else:
+        gcameras = [pick_gcamera()]
+    if args.profile_startup:
+        profiler.disable()
+        profiler.dump_stats(args.profile_startup)
     try:
-        gcamera.run()
+        GcameraICC.runActors(gcameras)
     finally:
         # Makes sure we have shutdown the camera before exiting.
         # This is useful when the gcamera process dies dramatically without the
@@ -40,8 +85,10 @@ def main():
         # force the cooler to switch off but at least will improve our chances
         # of reconnecting to the camera later on. This is specially critical
         # for AndorCam, which is pretty sensitive about not shutting it down.
-        print('Shutting down the camera ... ')
-        gcamera.cam._shutdown()
+        for gcamera in gcameras:
+            if gcamera.cam is not None:
+                print('Shutting down the %s camera ... ' % gcamera.name)
+                gcamera.cam._shutdown()
 
 
 if __name__ == "__main__":
@@ -6,20 +6,24 @@ import glob
 import math
 import os
 import re
+import threading
 import time
 
-import pyfits
 import numpy as np
 
+from twisted.internet import reactor
+
 import opscore.protocols.keys as opsKeys
 import opscore.protocols.types as types
 
-import RO.Astro.Tm.MJDFromPyTuple as astroMJD
-
 from opscore.utility.qstr import qstr
 
-import actorcore.utility.fits as actorFits
-import actorcore.utility.svn
+# Only what a warm start needs is imported here. pyfits, actorcore.utility.fits
+# and the frame processing helpers are imported by the command or step that
+# first uses them, and their rings, pools and threads are made then, so that a
+# restarted actor is ready to take the camera back quickly.
+from gcameraICC import durableWrite
+from gcameraICC import stateSnapshot
 
 class CameraCmd(object):
     """ Wrap camera commands.  """
@@ -51,7 +55,92 @@ class CameraCmd(object):
         self.simRoot = None
         self.simSeqno = 1
 
-        self.resync(actor.bcast, doFinish=False)
+        # Held while a new frame number is chosen and its file written, so that
+        # buildMaster (which runs in the background) and expose can't collide.
+        self.seqnoLock = threading.RLock()
+
+        # buildMaster: size of the process pool (0 for one per CPU), and the
+        # memory for one tile of all the frames, per process.
+        self.masterProcesses = self.actor.getCameraConfig('masterProcesses', 0, type=int) or None
+        self.masterTileBytes = int(self.actor.getCameraConfig('masterTileMB', 64.)*1024**2)
+
+        # the most coolerHistory bins we will send for one command.
+        self.maxHistoryBins = 1000
+
+        # Optionally make a calibrated float32 copy of each guide frame:
+        # 'off', 'hdu' (a CALIBRATED extension), or 'file' (a separate gcal-NNNN file).
+        self.calibratedFrame = self.actor.getCameraConfig('calibratedFrame', 'off', type=str)
+        self.calibCacheBytes = self.actor.getCameraConfig('calibCacheMB', 256.)*1024**2
+        self._calibrator = None
+
+        # Bad pixels in calibrated frames: 'off', 'replace' (median of the good
+        # neighbours) or 'flag' (NaN), from the badPixels command's mask for the
+        # frame's format, kept in badPixelDir.
+        self.badPixelMode = self.actor.getCameraConfig('badPixelMode', 'replace', type=str)
+        self.badPixelDir = self.actor.getCameraConfig('badPixelDir', None, type=str) or self.dataRoot
+        self.badPixelMasks = {}
+
+        # Overscan: 'off', 'measure' (biasLevel keyword and header cards only),
+        # or 'subtract' (also remove the row-to-row bias structure).
+        # If trimOverscan, the overscan columns are not written to the file.
+        self.overscan = self.actor.getCameraConfig('overscan', 'off', type=str)
+        self.trimOverscan = bool(self.actor.getCameraConfig('trimOverscan', 0, type=int))
+
+        # Stacked exposures are combined with 'median', 'mean', or 'clip' (a
+        # stackClipSigma sigma-clipped mean); only 'mean' is combined as they arrive.
+        self.stackCombine = self.actor.getCameraConfig('stackCombine', 'median', type=str)
+        self.stackClipSigma = self.actor.getCameraConfig('stackClipSigma', 3.)
+
+        # Guide stars (x, y) to centroid in a centroidWindow pixel window right
+        # after each readout, set by the centroidStars command.
+        self.centroidStars = []
+        self.centroidWindow = self.actor.getCameraConfig('centroidWindow', 15, type=int)
+        self.centroidSigma = self.actor.getCameraConfig('centroidSigma', 3.)
+
+        # pixels at or above this level count as saturated in imageStats.
+        self.saturation = self.actor.getCameraConfig('saturation', 65535, type=int)
+
+        # Quick-look previews (gprev-NNNN): 'off', 'png' or 'fits', at most previewSize pixels on a side.
+        self.previewFormat = self.actor.getCameraConfig('preview', 'off', type=str)
+        self.previewSize = self.actor.getCameraConfig('previewSize', 256, type=int)
+        self._previewer = None
+
+        # Optional whole-frame seeing metrics of each exposure (the seeing keyword,
+        # and SEE* cards if they are ready when the frame is written), measured
+        # in seeingWorkers threads.
+        self.measureSeeing = bool(self.actor.getCameraConfig('seeing', 0, type=int))
+        self._seeingMeter = None
+
+        # Frames and notes are written atomically, synced to disk per the fsync
+        # policy: 'none', 'frame', or 'batch' (every fsyncBatchFrames frames or fsyncBatchSeconds).
+        self.writer = durableWrite.DurableWriter(self.actor.getCameraConfig('fsync', 'none', type=str),
+                                                 batchFrames=self.actor.getCameraConfig('fsyncBatchFrames', 10, type=int),
+                                                 batchSeconds=self.actor.getCameraConfig('fsyncBatchSeconds', 5.))
+
+        # Each frame can also be published to same-host consumers in a shared
+        # memory ring of frameRingSlots frames (0: off).
+        self.frameRingSlots = self.actor.getCameraConfig('frameRingSlots', 0, type=int)
+        self._frameRing = None
+        self._frameRingOpened = False
+
+        # Post-readout stages (imageStats, seeing, preview) named in pipelineStages
+        # run in pipelineProcesses worker processes on the frame in the ring,
+        # instead of in this process, once runActors has forked the workers.
+        self.pipeline = self.openPipeline()
+
+        # Gain and read noise measured by measureGain ... save (in detectorFile,
+        # read on first use), which writeFITS uses instead of the configured
+        # (specification) ccdGain and readNoise.
+        self.detectorFile = self.actor.getCameraConfig('detectorFile', None, type=str)
+        self._detector = None
+        self._detectorLoaded = False
+
+        # What we last wrote to the state snapshot, and the next frame number it records.
+        self.stateFile = self.actor.stateFilePath()
+        self.savedState = None
+        self.nextSeqno = None
+
+        self.warmStart(actor.bcast)
 
         self.keys = opsKeys.KeysDictionary("gcamera_camera", (1, 1),
                                            opsKeys.Key("time", types.Float(), help="exposure time."),
@@ -64,12 +153,28 @@ class CameraCmd(object):
                                            opsKeys.Key("stack", types.Int(), help="number of exposures to take and stack."),
                                            opsKeys.Key("temp", types.Float(), help="camera temperature setpoint."),
                                            opsKeys.Key("n", types.Int(), help="number of times to loop status queries."),
+                                           opsKeys.Key("since", types.Float(), help="how far back to go, in seconds."),
+                                           opsKeys.Key("step", types.Float(), help="width of each history bin, in seconds."),
+                                           opsKeys.Key("first", types.Int(), help="first frame number to combine."),
+                                           opsKeys.Key("last", types.Int(), help="last frame number to combine."),
+                                           opsKeys.Key("nsigma", types.Float(), help="sigma-clipping threshold."),
+                                           opsKeys.Key("hotSigma", types.Float(),
+                                                       help="dark current this many sigma above the median is hot."),
+                                           opsKeys.Key("deadFraction", types.Float(),
+                                                       help="flat response below this fraction of the median is dead."),
+                                           opsKeys.Key("stars", types.Float()*(2, 400),
+                                                       help="x1,y1,x2,y2,...: 0-based column and row of each guide star."),
+                                           opsKeys.Key("window", types.Int(),
+                                                       help="side of the window around each guide star, in pixels."),
+                                           opsKeys.Key("times", types.Float()*(2, 20),
+                                                       help="flat exposure times for the photon transfer curve."),
                                            )
 
         self.vocab = [
             ('ping', '', self.pingCmd),
             ('status', '', self.status),
             ('deathStatus', '<n>', self.deathStatus),
+            ('coolerHistory', '[<since>] [<step>]', self.coolerHistory),
             ('setBOSSFormat', '', self.setBOSSFormat),
             ('setFlatFormat', '', self.setFlatFormat),
             ('simulate', '(off)', self.simulateOff),
@@ -79,9 +184,16 @@ class CameraCmd(object):
             ('bias', '[<stack>]', self.expose),
             ('dark', '<time> [<filename>] [<stack>]', self.expose),
             ('flat', '<time> [<cartridge>] [<filename>] [<stack>]', self.expose),
+            ('buildMaster', '(bias|dark) <first> <last> [<nsigma>]', self.buildMaster),
+            ('measureGain', '<times> [save]', self.measureGain),
+            ('badPixels', '[<hotSigma>] [<deadFraction>]', self.buildBadPixelMask),
+            ('centroidStars', '(clear)', self.clearCentroidStars),
+            ('centroidStars', '<stars> [<window>]', self.setCentroidStars),
             ('reconnect', '', self.reconnect),
+            ('startupProfile', '', self.startupProfile),
             ('aph', '', self.reconnect),
             ('resync', '', self.resync),
+            ('shutdown', '(abort)', self.shutdownAbort),
             ('shutdown', '[force]', self.shutdown)
             ]
 
@@ -90,6 +202,10 @@ class CameraCmd(object):
 
         cmd.finish('text="Pong."')
 
+    def startupProfile(self, cmd):
+        """Report how long each step of starting the actor took."""
+        cmd.finish(self.actor.formatStartupTimes())
+
     def resync(self, cmd, doFinish=True):
         """Resynchronize with the current guider frame numbers.
 
@@ -98,8 +214,9 @@ class CameraCmd(object):
         """
 
         try:
-            dirname, filename = self.genNextRealPath(cmd)
+            dirname, filename = self.genNextRealPath(cmd, rescan=True)
             self.findBiasAndDarkAndFlat(dirname, self.seqno)
+            self.nextSeqno = self.seqno
         except Exception, ee:
             cmd.fail('text="failed to set directory, '
                      'or bias, dark, and flat names: %s' % (ee))
@@ -107,8 +224,58 @@ class CameraCmd(object):
         cmd.respond('text="set bias, dark, flat to %s, %s, '
                     'cart=%d"' % (self.darkFile, self.flatFile,
                                   self.flatCartridge))
+        if doFinish:
+            self.saveState(cmd)
         self.status(cmd, doFinish=doFinish)
 
+    def warmStart(self, cmd):
+        """
+        Take the night directory, next frame number and calibrations from the
+        state snapshot, if it still agrees with tonight's directory; otherwise
+        rescan the directory, as resync does.
+
+        Returns True if the snapshot was used.
+        """
+        state = stateSnapshot.read(self.stateFile)
+        if state is None:
+            reason = 'no usable state snapshot in %s' % (self.stateFile)
+        else:
+            reason = stateSnapshot.check_frames(state, self.tonightDir())
+        if reason:
+            cmd.inform('text=%s' % (qstr("rescanning the night's frames: %s" % (reason))))
+            self.resync(cmd, doFinish=False)
+            return False
+
+        self.dataDir = state['dataDir']
+        self.seqno = self.nextSeqno = state['seqno']
+        for field in ('biasFile', 'biasTemp', 'darkFile', 'darkTemp', 'flatFile', 'flatCartridge'):
+            setattr(self, field, state[field])
+        self.savedState = dict((field, state[field]) for field in stateSnapshot.fields)
+        cmd.inform('text=%s' % (qstr("restored state from %s: next frame %d, bias=%s dark=%s flat=%s" %
+                                     (self.stateFile, self.seqno, self.biasFile, self.darkFile, self.flatFile))))
+        self.status(cmd, doFinish=False)
+        return True
+
+    def saveState(self, cmd):
+        """Rewrite the state snapshot, if anything in it has changed."""
+        if self.nextSeqno is None:
+            return
+        cam = self.actor.cam
+        state = {'dataDir': self.dataDir, 'seqno': self.nextSeqno,
+                 'biasFile': self.biasFile, 'biasTemp': self.biasTemp,
+                 'darkFile': self.darkFile, 'darkTemp': self.darkTemp,
+                 'flatFile': self.flatFile, 'flatCartridge': self.flatCartridge,
+                 'cameraFormat': self.actor.cameraFormat, 'coolerSetpoint': self.actor.coolerSetpoint,
+                 'readTime': cam.read_time if cam else self.actor.readTime}
+        if state == self.savedState:
+            return
+        try:
+            self.writer.write_text(self.stateFile, stateSnapshot.dumps(state, time.time()))
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not write the state snapshot %s: %s" % (self.stateFile, e))))
+            return
+        self.savedState = state
+
     def status(self, cmd, doFinish=True):
         """ Generate all status keywords. """
 
@@ -120,9 +287,11 @@ class CameraCmd(object):
             cam = None
         cmd.respond("stack=1")
         if cam:
-            cmd.respond('cameraConnected=%s' % (cam != None))
+            # a camera we shut down is still there, but no longer connected.
+            cmd.respond('cameraConnected=%s' % (not cam.isShutDown))
             cmd.respond('binning=%d,%d' % (cam.m_pvtRoiBinningV, cam.m_pvtRoiBinningH))
             cmd.respond('dataDir=%s; nextSeqno=%d' % (self.dataDir, self.seqno))
+            cmd.respond(self.writer.format_latency())
             cmd.respond('flatCartridge=%s; biasFile=%s; darkFile=%s; flatFile=%s' % \
                             (self.flatCartridge, self.biasFile,
                              self.darkFile, self.flatFile))
@@ -135,24 +304,88 @@ class CameraCmd(object):
         if doFinish:
             cmd.finish()
 
-    def deathStatus(self, cmd, doFinish=True):
-        """ Generate some status keywords, n times (default=1). Useful for continuously monitoring the state of the gcamera. """
+    def deathStatus(self, cmd):
+        """
+        Generate the cooler keyword n times, once per telemetry period. Useful for
+        continuously monitoring the state of the gcamera.
+
+        The values come from the telemetry loop's cache, so this does not talk
+        to the camera itself.
+        """
 
         cmdKeys = cmd.cmd.keywords
         nloops = cmdKeys['n'].values[0]
 
         self.actor.sendVersionKey(cmd)
 
+        if not self.actor.cam or nloops <= 0:
+            cmd.warn('cameraConnected=%s' % (self.actor.cam != None))
+            cmd.finish()
+            return
+
+        reactor.callFromThread(self._deathStatusLoop, cmd, nloops)
+
+    def _deathStatusLoop(self, cmd, nloops):
+        """Send one cached cooler keyword, then reschedule ourselves (reactor thread)."""
+
         cam = self.actor.cam
-        if cam and nloops > 0:
-            self.coolerStatus(cmd, doFinish=False)
-            self.actor.callCommand("deathStatus n=%d" % (nloops-1))
-        else:
-            cmd.warn('cameraConnected=%s' % (cam != None))
+        if not cam:
+            cmd.warn('cameraConnected=False')
+            cmd.finish()
+            return
 
-        if doFinish:
+        cmd.respond(cam.cached_cooler_status())
+        if nloops > 1:
+            reactor.callLater(self.actor.telemetryPeriod, self._deathStatusLoop, cmd, nloops-1)
+        else:
             cmd.finish()
 
+    def coolerHistory(self, cmd):
+        """
+        Report the recorded cooler history, decimated into bins.
+
+        Each non-empty bin gives one coolerHistory keyword: bin start (unix time), number of
+        samples, min/mean/max of the CCD temperature, heatsink temperature and
+        cooler drive, then the last setpoint, fan and status in the bin.
+
+        Args:
+            [since=SEC]  - how far back to go (default 3600s).
+            [step=SEC]   - width of each bin (default 60s).
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        since = cmdKeys['since'].values[0] if 'since' in cmdKeys else 3600.
+        step = cmdKeys['step'].values[0] if 'step' in cmdKeys else 60.
+
+        history = self.actor.coolerHistory
+        if history is None:
+            cmd.fail('text="no cooler history is being recorded."')
+            return
+        if step <= 0 or since <= 0:
+            cmd.fail('text="since and step must be positive."')
+            return
+        if since / step > self.maxHistoryBins:
+            step = float(since) / self.maxHistoryBins
+            cmd.warn('text="too many history bins: using step=%g"' % (step))
+
+        t0 = time.time() - since
+        bins = history.aggregate(t0, step)
+        if bins is None:
+            cmd.finish('text="no cooler history in the last %gs."' % (since))
+            return
+
+        from gcameraICC.Controllers.coolerHistory import aggregateFields, status_text
+        statusNames = self.actor.cam.coolerStatusNames if self.actor.cam else ()
+        for i in range(len(bins['n'])):
+            cmd.respond('coolerHistory=%.1f,%d,%s,%s,%s,%s' %
+                        (bins['time'][i], bins['n'][i],
+                         ','.join('%.2f,%.2f,%.2f' % (bins[field+'Min'][i], bins[field+'Mean'][i],
+                                                      bins[field+'Max'][i])
+                                  for field in aggregateFields),
+                         bins['setpoint'][i], bins['fan'][i],
+                         status_text(bins['status'][i], statusNames)))
+        cmd.finish()
+
     def findFileMatch(self, files, seqno):
         """ Return the filename in the list whose sequence is closest below the given seqno. """
 
@@ -177,8 +410,14 @@ class CameraCmd(object):
         """
         Find most recent dark and flats images in the given directory.
         Set .biasFile, .darkFile, .flatFile, .flatCartridge
+
+        Uses the night's manifest if it lists every frame before forSeqno,
+        otherwise the bias/dark/flat notes.
         """
 
+        if self.findCalibrationsInManifest(dirname, forSeqno):
+            return
+
         darkFiles = glob.glob(os.path.join(dirname, 'dark-*'))
         darkNote = self.findFileMatch(darkFiles, forSeqno)
         if darkNote:
@@ -226,28 +465,28 @@ class CameraCmd(object):
         """ Configure the camera for guiding images. """
 
         self.actor.cam.setBOSSFormat()
+        self.actor.cameraFormat = 'BOSS'
         self.status(cmd, doFinish=False)
 
         if doFinish:
+            self.saveState(cmd)
             cmd.finish()
 
     def setFlatFormat(self, cmd, doFinish=True):
         """ Configure the camera for flat images. """
 
         self.actor.cam.setFlatFormat()
+        self.actor.cameraFormat = 'flat'
         self.status(cmd, doFinish=False)
 
         if doFinish:
+            self.saveState(cmd)
             cmd.finish()
 
-    def reconnect(self, cmd, doFinish=True):
-        """ (re-)connect to the camera, and print status. """
-
-        self.actor.connectCamera()
-        self.status(cmd, doFinish=False)
+    def reconnect(self, cmd):
+        """ (re-)connect to the camera in the background; finishes once connected. """
 
-        if doFinish:
-            cmd.finish()
+        self.actor.connectCamera(cmd=cmd)
 
     def sendSimulatingKey(self, cmdFunc):
         state = 'On' if self.simRoot else 'Off'
@@ -287,27 +526,66 @@ class CameraCmd(object):
 
         self.sendSimulatingKey(cmd.finish)
 
+    def findCalibrationsInManifest(self, dirname, forSeqno):
+        """
+        Set .biasFile, .darkFile, .flatFile, .flatCartridge from the night's
+        manifest, and return True, if the manifest lists every frame before forSeqno.
+        """
+        from gcameraICC import manifest
+        try:
+            entries = manifest.read(manifest.manifest_path(dirname))
+        except Exception:
+            return False
+        listed = set(entry.seqno for entry in entries if entry.seqno < forSeqno)
+        if not entries or len(listed) < forSeqno - 1:
+            return False
+
+        latest = manifest.latest_calibrations(entries, forSeqno)
+        def calibFile(entry):
+            return os.path.join(dirname, 'gimg-%04d.fits%s' % (entry.seqno, self.ext)) if entry else None
+        self.biasFile = calibFile(latest['bias'])
+        self.darkFile = calibFile(latest['dark'])
+        self.flatFile = calibFile(latest['flat'])
+        self.flatCartridge = latest['flat'].flatCartridge if latest['flat'] else -1
+        return True
+
     def genFilename(self, seqno):
         return '%s-%04d.fits' % (self.filePrefix, seqno)
 
-    def genNextRealPath(self, cmd):
-        """ Return the next filename to use. Exposures are numbered from 1 for each night. """
+    def tonightDir(self):
+        """Return the directory for tonight's frames (which may not exist yet)."""
 
-        gimgPattern = '^gimg-(\d{4})\.fits*'
-
-        mjd = astroMJD.mjdFromPyTuple(time.gmtime())
+        # the Unix epoch is MJD 40587.
+        mjd = time.time()/86400. + 40587
 
         if self.actor.location == 'LCO':
             fmjd = str(int(mjd + 0.4))
         else:
             fmjd = str(int(mjd + 0.3))
 
-        dataDir = os.path.join(self.dataRoot, fmjd)
+        return os.path.join(self.dataRoot, fmjd)
+
+    def genNextRealPath(self, cmd, rescan=False):
+        """ Return the next filename to use. Exposures are numbered from 1 for each night.
+
+        The next frame number is the one we last wrote (or restored from the
+        state snapshot) plus one, unless the night has rolled over or rescan is
+        set: then it follows the last frame in tonight's directory.
+        """
+
+        gimgPattern = '^gimg-(\d{4})\.fits*'
+
+        dataDir = self.tonightDir()
         if not os.path.isdir(dataDir):
             cmd.respond('text="creating new directory %s"' % (dataDir))
             os.mkdir(dataDir,0775)
+        sameNight = (dataDir == getattr(self, 'dataDir', None))
         self.dataDir = dataDir
 
+        if sameNight and self.nextSeqno is not None and not rescan:
+            self.seqno = self.nextSeqno
+            return dataDir, self.genFilename(self.seqno)
+
         imgFiles = glob.glob(os.path.join(dataDir, 'gimg-*.fits*'))
         imgFiles.sort()
         if len(imgFiles) == 0:
@@ -322,7 +600,8 @@ class CameraCmd(object):
             else:
                 seqno = int(m.group(1)) + 1
 
-        self.seqno = seqno
+        # the scan is the truth now, also after the night rolls over.
+        self.seqno = self.nextSeqno = seqno
         return dataDir, self.genFilename(seqno)
 
     def genNextSimPath(self, cmd):
@@ -349,7 +628,11 @@ class CameraCmd(object):
             return self.genNextRealPath(cmd)
 
     def exposeStack(self, itime, stack, cmd, expType='expose'):
-        """ Return a single exposure dict median-combined from stack * itime integrations.
+        """ Return a single exposure dict combined from stack * itime integrations.
+
+        Each integration is folded into the combination (see stackCombine) in
+        a worker thread while the camera takes the next one; a median or
+        clipped mean is still computed in full after the last one.
 
         Note the unwarranted chumminess with the camera data, compounded by not wanting to push
         non-u2 data up to the guider. So we pretend that we took a single itime exposure, and
@@ -367,18 +650,33 @@ class CameraCmd(object):
         else:
             raise ValueError('Invalid gcamera exposure type in exposeStack: %s'%expType)
 
+        start = time.time()
         imDict = exposeCmd(itime, cmd)
 
         if stack > 1:
-            imList = [imDict['data'],]
-            for i in range(2, stack+1):
-                cmd.inform('text="taking stacked integration %d of %d"' % (i, stack))
-                imDict1 = exposeCmd(itime, cmd)
-                imList.append(imDict1['data'])
-            imData = np.median(imList,axis=0).astype('u2')
-            imDict['data'] = imData
+            from gcameraICC import stacking
+            accumulator = stacking.StackAccumulator(stack, method=self.stackCombine,
+                                                    nsigma=self.stackClipSigma)
+            try:
+                accumulator.add(imDict['data'])
+                for i in range(2, stack+1):
+                    cmd.inform('text="taking stacked integration %d of %d"' % (i, stack))
+                    imDict1 = exposeCmd(itime, cmd)
+                    accumulator.add(imDict1['data'])
+                lastReadout = time.time()
+                imDict['data'] = accumulator.finish()
+            finally:
+                accumulator.close()
             imDict['stack'] = stack
             imDict['exptimen'] = itime*stack
+            imDict.setdefault('cards', []).append(('STACKCMB', self.stackCombine,
+                                                   'how the stacked integrations were combined'))
+
+            elapsed = time.time() - start
+            cmd.diag('text="stack of %d x %gs took %0.2fs: %0.2fs per integration beyond its exposure time, '
+                     '%0.3fs folding in frames, %0.3fs combining after the last one"' %
+                     (stack, itime, elapsed, (elapsed - stack*itime)/stack, accumulator.foldTime,
+                      time.time() - lastReadout))
 
         return imDict
 
@@ -396,9 +694,20 @@ class CameraCmd(object):
             [stack=N]           - stack this many exposures (total time: stack*time).
         """
 
+        with self.seqnoLock:
+            self._expose(cmd, doFinish=doFinish)
+
+    def _expose(self, cmd, doFinish=True):
+        """Take an exposure, holding seqnoLock. See expose()."""
+
         expType = cmd.cmd.name
         cmdKeys = cmd.cmd.keywords
 
+        if self.actor.cam and self.actor.cam.isShuttingDown:
+            cmd.fail('exposureState="failed",0.0,0.0; '
+                     'text="the camera is shutting down: no exposures allowed."')
+            return
+
         if expType == 'bias':
             itime = 0.
         else:
@@ -478,6 +787,14 @@ class CameraCmd(object):
                 cmd.fail('text=%s' % (qstr("exposure failed: %s" % e)))
                 return
 
+            self.applyOverscan(imDict, cmd)
+            if expType == 'expose':
+                self.sendCentroids(imDict, cmd)
+                if not self.inPipeline('seeing'):
+                    self.queueSeeing(imDict, cmd)
+            if not self.inPipeline('imageStats'):
+                self.sendImageStats(imDict, cmd)
+
             imDict['type'] = 'object' if (expType == 'expose') else expType
             imDict['filename'] = pathname
             imDict['ccdTemp'] = self.actor.cam.ccdTemp
@@ -492,44 +809,600 @@ class CameraCmd(object):
                                       if ('cartridge' in cmdKeys) else 0)
 
             self.writeFITS(imDict, cmd)
+            if not self.inPipeline('preview'):
+                self.queuePreview(imDict, cmd)
+            slot = self.publishFrame(imDict, cmd)
+            self.runPipeline(imDict, slot, cmd)
 
         if expType == 'bias':
             self.biasFile = pathname + self.ext
             self.biasTemp = self.actor.cam.ccdTemp
             if not self.simRoot:
-                biasnote = open(os.path.join(dirname, 'bias-%04d.dat' % (self.seqno)), 'w+')
-                biasnote.write('filename=%s\n' % (self.biasFile))
-                biasnote.write('temp=%0.2f\n' % (self.biasTemp))
-                biasnote.close()
+                self.writeNote(dirname, 'bias-%04d.dat' % (self.seqno),
+                               ['filename=%s' % (self.biasFile),
+                                'temp=%0.2f' % (self.biasTemp)])
                 cmd.respond('text="setting bias file for %0.1fC: %s"' % (self.biasTemp, self.biasFile))
 
         if expType == 'dark':
             self.darkFile = pathname + self.ext
             self.darkTemp = self.actor.cam.ccdTemp
             if not self.simRoot:
-                darknote = open(os.path.join(dirname, 'dark-%04d.dat' % (self.seqno)), 'w+')
-                darknote.write('filename=%s\n' % (self.darkFile))
-                darknote.write('temp=%0.2f\n' % (self.darkTemp))
-                darknote.close()
+                self.writeNote(dirname, 'dark-%04d.dat' % (self.seqno),
+                               ['filename=%s' % (self.darkFile),
+                                'temp=%0.2f' % (self.darkTemp)])
                 cmd.respond('text="setting dark file for %0.1fC: %s"' % (self.darkTemp, self.darkFile))
 
         elif expType == 'flat':
             self.flatFile = pathname + self.ext
             self.setBOSSFormat(cmd, doFinish=False)
             if not self.simRoot:
-                flatnote = open(os.path.join(dirname, 'flat-%04d-%02d.dat' % (self.seqno, self.flatCartridge)), 'w+')
-                flatnote.write('filename=%s\n' % (self.flatFile))
-                flatnote.write('cartridge=%d\n' % (self.flatCartridge))
-                flatnote.close()
+                self.writeNote(dirname, 'flat-%04d-%02d.dat' % (self.seqno, self.flatCartridge),
+                               ['filename=%s' % (self.flatFile),
+                                'cartridge=%d' % (self.flatCartridge)])
                 cmd.respond('text="setting flat file for cartridge %d: %s"' % (self.flatCartridge, self.flatFile))
 
-        cmd.finish('exposureState="done",0.0,0.0; filename=%s' % (os.path.join(dirname, filename+self.ext)))
+        if not self.simRoot and 'filename' not in cmdKeys:
+            self.appendManifest(imDict, dirname, cmd)
+            self.nextSeqno = self.seqno + 1
+        if not self.simRoot:
+            self.saveState(cmd)
+
+        if self.simRoot:
+            slot = -1
+        cmd.finish('exposureState="done",0.0,0.0; %s' % (self.filenameKey(pathname+self.ext, slot)))
+
+    def applyOverscan(self, imDict, cmd):
+        """
+        Measure the overscan of the frame in imDict, and subtract and trim it if
+        we are configured to. Sends biasLevel and adds the matching header cards.
+        """
+        if self.overscan == 'off':
+            return
+        from gcameraICC import overscan
+        cam = self.actor.cam
+        data = imDict['data']
+        nover = overscan.overscan_width(data.shape[1], cam.ow, imDict.get('binx', cam.binning))
+        if not nover:
+            return
+
+        data, info = overscan.correct(data, nover, subtract=(self.overscan == 'subtract'),
+                                      trim=self.trimOverscan)
+        imDict['data'] = data
+
+        cards = imDict.setdefault('cards', [])
+        cards.append(('BIASLEV', round(info['level'], 2), 'median overscan level [ADU]'))
+        cards.append(('BIASSIG', round(info['sigma'], 2), 'scatter of the per-row overscan level [ADU]'))
+        cards.append(('OVERSUB', self.overscan == 'subtract', 'per-row overscan structure subtracted?'))
+        if self.trimOverscan:
+            cards.append(('TRIMSEC', info['datasec'], 'section of the raw frame kept'))
+        else:
+            imDict['overscanCols'] = nover
+            cards.append(('BIASSEC', info['biassec'], 'overscan section'))
+            cards.append(('DATASEC', info['datasec'], 'imaging section'))
+        cmd.inform('biasLevel=%0.2f,%0.2f' % (info['level'], info['sigma']))
+
+    def sendImageStats(self, imDict, cmd):
+        """Send the imageStats keyword for the imaging section of the frame in imDict."""
+        from gcameraICC import imageStats
+        data = imDict['data']
+        nover = imDict.get('overscanCols', 0)
+        if nover:
+            data = data[:, :-nover]
+        try:
+            stats = imageStats.frame_stats(data, saturation=self.saturation)
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not compute image statistics: %s" % e)))
+            return
+        cmd.inform(imageStats.format_stats(stats))
+
+    def setCentroidStars(self, cmd):
+        """
+        Set the guide stars to centroid after each exposure.
+
+        Args:
+            stars=X1,Y1,X2,Y2,...  - the 0-based column and row of each star.
+            [window=N]             - side of the window measured around each star (pixels).
+        """
+        cmdKeys = cmd.cmd.keywords
+        values = cmdKeys['stars'].values
+        if len(values) % 2:
+            cmd.fail('text="stars must be x,y pairs."')
+            return
+        if 'window' in cmdKeys:
+            window = cmdKeys['window'].values[0]
+            if window < 5:
+                cmd.fail('text="the centroid window must be at least 5 pixels."')
+                return
+            self.centroidWindow = window
+        self.centroidStars = [(float(values[i]), float(values[i+1])) for i in range(0, len(values), 2)]
+        cmd.finish('centroidStars=%d,%d' % (len(self.centroidStars), self.centroidWindow))
+
+    def clearCentroidStars(self, cmd):
+        """Stop centroiding guide stars."""
+        self.centroidStars = []
+        cmd.finish('centroidStars=0,%d' % (self.centroidWindow))
+
+    def sendCentroids(self, imDict, cmd):
+        """Send a centroid keyword for each of the guide stars in the frame in imDict."""
+        if not self.centroidStars:
+            return
+        from gcameraICC import centroids
+        data = imDict['data']
+        start = time.time()
+        try:
+            bad = None
+            if self.badPixelMode != 'off':
+                cam = self.actor.cam
+                mask = self.badPixelMask(data.shape, (imDict.get('binx', cam.binning), imDict.get('biny', cam.binning)))
+                bad = mask.bad() if mask is not None else None
+            results = centroids.measure(data, self.centroidStars, window=self.centroidWindow,
+                                        detectSigma=self.centroidSigma, bad=bad)
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not centroid the guide stars: %s" % e)))
+            return
+        for i, result in enumerate(results):
+            cmd.inform(centroids.format_centroid(i, result))
+        cmd.diag('text="centroided %d stars in %0.1f ms"' % (len(results), (time.time() - start)*1000))
+
+    def announce(self, msg):
+        """Send msg to everyone, from any thread."""
+        reactor.callFromThread(self.actor.bcast.inform, msg)
+
+    @property
+    def seeingMeter(self):
+        """Our SeeingMeter, made on first use, or None if we don't measure the seeing."""
+        if self._seeingMeter is None and self.measureSeeing:
+            from gcameraICC import seeing
+            self._seeingMeter = seeing.SeeingMeter(self.announce,
+                                                   workers=self.actor.getCameraConfig('seeingWorkers', 2, type=int),
+                                                   binFactor=self.actor.getCameraConfig('seeingBin', 4, type=int),
+                                                   nsigma=self.actor.getCameraConfig('seeingSigma', 5.),
+                                                   maxSources=self.actor.getCameraConfig('seeingMaxSources', 100, type=int),
+                                                   saturation=self.saturation)
+        return self._seeingMeter
+
+    def queueSeeing(self, imDict, cmd):
+        """Start measuring the seeing of the frame in imDict; writeFITS picks up the result."""
+        if not self.measureSeeing:
+            return
+        data = imDict['data']
+        nover = imDict.get('overscanCols', 0)
+        if nover:
+            data = data[:, :-nover]
+        imDict['seeing'] = self.seeingMeter.submit(data)
+        if imDict['seeing'] is None:
+            cmd.warn('text="seeing workers are behind: skipped the seeing of this frame"')
+
+    def addSeeingCards(self, hdr, imDict, cmd):
+        """
+        Add the SEE* cards to hdr, if the frame's seeing has already been
+        measured: the frame is never held back for it, and the seeing keyword
+        is sent when it is ready either way.
+        """
+        pending = imDict.get('seeing')
+        if pending is None:
+            return
+        if not pending.ready():
+            cmd.diag('text="seeing not measured yet: no SEE* cards"')
+            return
+        from gcameraICC import seeing
+        result = pending.get()
+        if result is not None:
+            for key, value, comment in seeing.seeing_cards(result):
+                hdr.update(key, value, comment)
+
+    @property
+    def frameRing(self):
+        """Our shared memory frame ring, opened on first use, or None if it is off or could not be opened."""
+        if not self._frameRingOpened:
+            self._frameRing = self.openFrameRing()
+            self._frameRingOpened = True
+        return self._frameRing
+
+    def openFrameRing(self):
+        """Open (creating if needed) our shared memory frame ring, or return None."""
+        nslots = self.frameRingSlots
+        if nslots <= 0:
+            return None
+        from gcameraICC import frameRing
+        directory = self.actor.getCameraConfig('frameRingDir', '/dev/shm', type=str)
+        slotBytes = int(self.actor.getCameraConfig('frameRingSlotMB', 4.)*1024**2)
+        filename = frameRing.ring_path(self.actor.name, directory)
+        try:
+            return frameRing.FrameRing(filename, nslots=nslots, dataBytes=slotBytes)
+        except Exception as e:
+            self.actor.logger.warn('could not open the frame ring %s: %s' % (filename, e))
+            return None
+
+    def publishFrame(self, imDict, cmd):
+        """
+        Publish the frame in imDict to the shared memory ring and the frame
+        server's subscribers. Return its ring slot, or -1.
+        """
+        if self.frameRing is None and self.actor.frameServer is None:
+            return -1
+        meta = dict((key, imDict.get(key)) for key in ('type', 'iTime', 'startTime', 'ccdTemp',
+                                                        'binx', 'biny', 'stack', 'biasFile',
+                                                        'darkFile', 'flatFile', 'overscanCols'))
+        meta['filename'] = imDict['filename'] + self.ext
+        meta['seqno'] = self.seqno
+        meta['flatCartridge'] = self.flatCartridge
+        meta['cards'] = dict((key, value) for key, value, comment in imDict.get('cards', []))
+
+        if self.actor.frameServer is not None:
+            reactor.callFromThread(self.actor.frameServer.broadcast, imDict['data'], meta)
+        if self.frameRing is None:
+            return -1
+        try:
+            return self.frameRing.publish(imDict['data'], meta, seqno=self.seqno)
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not publish frame to the ring: %s" % e)))
+            return -1
+
+    def filenameKey(self, path, slot=-1):
+        """
+        Return the filename keyword for path: with its frame ring slot (-1 if
+        it isn't in the ring) only if the ring is turned on, so consumers of
+        the plain filename see no change otherwise.
+        """
+        if self.frameRingSlots <= 0:
+            return 'filename=%s' % (path)
+        return 'filename=%s,%d' % (path, slot)
+
+    def openPipeline(self):
+        """
+        Return the Pipeline of the configured post-readout stages, or None if
+        there are none. Its workers are forked (with every other actor's in
+        this process) by runActors, before any threads start; until then the
+        stages run here.
+        """
+        names = [name.strip() for name in
+                 self.actor.getCameraConfig('pipelineStages', '', type=str).split(',') if name.strip()]
+        if not names:
+            return None
+        from gcameraICC import pipeline
+        if self.frameRing is None:
+            self.actor.bcast.warn('text="pipelineStages need the frame ring (frameRingSlots > 0): not running them"')
+            return None
+        warn = lambda msg: reactor.callFromThread(self.actor.bcast.warn, 'text=%s' % (qstr(msg)))
+        options = {'saturation': self.saturation,
+                   'filePrefix': self.filePrefix,
+                   'previewFormat': self.previewFormat,
+                   'previewSize': self.previewSize,
+                   'seeing': {'binFactor': self.actor.getCameraConfig('seeingBin', 4, type=int),
+                              'nsigma': self.actor.getCameraConfig('seeingSigma', 5.),
+                              'maxSources': self.actor.getCameraConfig('seeingMaxSources', 100, type=int)}}
+        try:
+            return pipeline.Pipeline(self.frameRing.filename, names, self.announce, warn,
+                                     processes=self.actor.getCameraConfig('pipelineProcesses', 0, type=int) or None,
+                                     options=options)
+        except ValueError as e:
+            self.actor.bcast.warn('text=%s' % (qstr(str(e))))
+            return None
+
+    def inPipeline(self, name):
+        """True if the stage name runs in the post-readout pipeline (instead of here)."""
+        return self.pipeline is not None and self.pipeline.running and name in self.pipeline
+
+    def runPipeline(self, imDict, slot, cmd):
+        """Queue the post-readout stages for the frame just published to ring slot."""
+        if self.pipeline is None or not self.pipeline.running or slot < 0:
+            return
+        # only exposures are measured for seeing.
+        names = [name for name in self.pipeline.names if name != 'seeing' or imDict['type'] == 'object']
+        if not self.pipeline.submit(slot, self.frameRing.written - 1, names=names):
+            cmd.warn('text="pipeline workers are behind: skipped the stages of %s"' % (imDict['filename']))
+
+    @property
+    def previewer(self):
+        """Our PreviewWriter, made on first use."""
+        if self._previewer is None:
+            from gcameraICC import preview
+            self._previewer = preview.PreviewWriter(self.announce, format=self.previewFormat,
+                                                    size=self.previewSize)
+        return self._previewer
+
+    def queuePreview(self, imDict, cmd):
+        """Queue a quick-look preview of the frame in imDict, announced later with the preview keyword."""
+        if self.previewFormat == 'off':
+            return
+        directory, basename = os.path.split(imDict['filename'])
+        prevBasename = os.path.splitext(basename.replace(self.filePrefix, 'gprev', 1))[0]
+        if not self.previewer.submit(imDict['data'], os.path.join(directory, prevBasename)):
+            cmd.warn('text="preview writer is behind: skipped the preview of %s"' % (basename))
+
+    def appendManifest(self, imDict, dirname, cmd):
+        """Append the frame just written from imDict to the night's manifest."""
+        from gcameraICC import manifest
+        filename = imDict['filename'] + self.ext
+        basename = lambda path: os.path.basename(path) if path else None
+        try:
+            line = manifest.format_entry(seqno=self.seqno, type=imDict['type'],
+                                         exptime=imDict['iTime'], stack=imDict.get('stack', 1),
+                                         ccdTemp=imDict.get('ccdTemp'),
+                                         binx=imDict.get('binx', self.actor.cam.binning),
+                                         biny=imDict.get('biny', self.actor.cam.binning),
+                                         biasFile=basename(imDict.get('biasFile')),
+                                         darkFile=basename(imDict.get('darkFile')),
+                                         flatFile=basename(imDict.get('flatFile')),
+                                         flatCartridge=(self.flatCartridge if imDict['type'] in ('flat', 'object')
+                                                        else None),
+                                         writeTime=time.time(), size=os.path.getsize(filename),
+                                         compression='gzip' if self.doCompress else 'none')
+            self.writer.append_text(manifest.manifest_path(dirname), line, header=manifest.header_line())
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not add %s to the manifest: %s" % (filename, e))))
+
+    def writeNote(self, dirname, notename, lines):
+        """Write a calibration note (e.g. bias-NNNN.dat), which findBiasAndDarkAndFlat looks for."""
+        self.writer.write_text(os.path.join(dirname, notename), ''.join('%s\n' % (line) for line in lines))
+
+    def buildMaster(self, cmd):
+        """
+        buildMaster bias|dark - combine tonight's raw frames into a master bias or dark.
+
+        The frames are sigma-clip averaged tile by tile in a process pool, and
+        the result written as the next frame, in a worker thread: the reactor
+        never waits for the combination, the write, or an exposure in progress.
+        A note written with the master makes it the active bias or dark.
+
+        Args:
+            first=N      - first frame number to combine.
+            last=N       - last frame number to combine.
+            [nsigma=F]   - clipping threshold, in standard deviations (default 3).
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        expType = 'bias' if 'bias' in cmdKeys else 'dark'
+        first = cmdKeys['first'].values[0]
+        last = cmdKeys['last'].values[0]
+        nsigma = cmdKeys['nsigma'].values[0] if 'nsigma' in cmdKeys else 3.
+
+        if self.simRoot:
+            cmd.fail('text="cannot build masters while simulating."')
+            return
+        if last - first < 2 or first < 1:
+            cmd.fail('text="need at least 3 frames to build a master: got %d-%d."' % (first, last))
+            return
+        if nsigma <= 0:
+            cmd.fail('text="nsigma must be positive."')
+            return
+
+        dirname = self.tonightDir()
+        paths = [os.path.join(dirname, 'gimg-%04d.fits%s' % (seqno, self.ext))
+                 for seqno in range(first, last+1)]
+
+        cmd.inform('text="combining %d %s frames, %d-%d, in the background"' %
+                   (len(paths), expType, first, last))
+        from twisted.internet import threads
+        d = threads.deferToThread(self._buildMasterInThread, cmd, expType, paths, dirname, first, last, nsigma)
+        d.addCallbacks(self._masterWritten, self._buildMasterFailed,
+                       callbackArgs=(cmd, expType), errbackArgs=(cmd, expType))
+
+    def _buildMasterInThread(self, cmd, expType, paths, dirname, first, last, nsigma):
+        """Combine the frames in paths and write the master (in a worker thread)."""
+        imDict = self._combineMaster(expType, paths, nsigma)
+        return self._writeMaster(imDict, cmd, expType, dirname, first, last, nsigma)
+
+    def _combineMaster(self, expType, paths, nsigma):
+        """
+        Check the frames in paths and combine them (in a worker thread).
+
+        Returns the master imDict, without a filename.
+        """
+        import pyfits
+        from gcameraICC import masters
+
+        headers = []
+        for path in paths:
+            if not os.path.exists(path):
+                raise RuntimeError('%s does not exist' % (path))
+            header = pyfits.getheader(path)
+            if header.get('IMAGETYP') != expType:
+                raise RuntimeError('%s is a %s, not a %s' % (path, header.get('IMAGETYP'), expType))
+            headers.append(header)
+
+        exptimes = set(header.get('EXPTIME') for header in headers)
+        if expType == 'dark' and len(exptimes) > 1:
+            raise RuntimeError('darks have different exposure times: %s' % (sorted(exptimes)))
+
+        # in a new interpreter: this process has threads, which a forked pool could deadlock on.
+        master = masters.combine_subprocess(paths, (headers[0]['NAXIS2'], headers[0]['NAXIS1']),
+                                            nsigma=nsigma, processes=self.masterProcesses,
+                                            maxTileBytes=self.masterTileBytes)
+        # Keep the guider's u2 frames.
+        data = np.clip(np.round(master), 0, 65535).astype('u2')
+
+        ccdTemps = [header['CCDTEMP'] for header in headers if 'CCDTEMP' in header]
+        return {'data': data,
+                'type': expType,
+                'iTime': headers[0].get('EXPTIME', 0.),
+                'startTime': time.time(),
+                'ccdTemp': np.mean(ccdTemps) if ccdTemps else 999.0,
+                'begx': headers[0].get('BEGX', 0),
+                'begy': headers[0].get('BEGY', 0),
+                'binx': headers[0].get('BINX', 1),
+                'biny': headers[0].get('BINY', 1),
+                'cards': [('NCOMBINE', len(paths), 'number of frames combined'),
+                          ('COMBINED', '%s to %s' % (os.path.basename(paths[0]).split('.')[0],
+                                                     os.path.basename(paths[-1]).split('.')[0]),
+                           'first and last frames combined'),
+                          ('CLIPSIG', nsigma, 'sigma-clipping threshold')]}
+
+    def _writeMaster(self, imDict, cmd, expType, dirname, first, last, nsigma):
+        """
+        Write the combined master as the next frame, with its note (in a worker
+        thread, waiting for any exposure in progress).
+
+        Returns the master's file and CCD temperature.
+        """
+        with self.seqnoLock:
+            nextDir, filename = self.genNextRealPath(cmd)
+            if nextDir != dirname:
+                raise RuntimeError('the night rolled over to %s' % (nextDir))
+            pathname = os.path.join(dirname, filename)
+            imDict['filename'] = pathname
+            if expType == 'dark':
+                imDict['biasFile'] = self.biasFile
+            self.writeFITS(imDict, cmd)
+
+            masterFile = pathname + self.ext
+            lines = ['filename=%s' % (masterFile),
+                     'temp=%0.2f' % (imDict['ccdTemp']),
+                     'combined=%d-%d' % (first, last),
+                     'nsigma=%g' % (nsigma)]
+            self.writeNote(dirname, '%s-%04d.dat' % (expType, self.seqno), lines)
+            self.appendManifest(imDict, dirname, cmd)
+            self.nextSeqno = self.seqno + 1
+        return masterFile, imDict['ccdTemp']
+
+    def _masterWritten(self, result, cmd, expType):
+        """Make the master just written the active bias or dark (reactor thread)."""
+        masterFile, ccdTemp = result
+        if expType == 'bias':
+            self.biasFile = masterFile
+            self.biasTemp = ccdTemp
+        else:
+            self.darkFile = masterFile
+            self.darkTemp = ccdTemp
+        self.saveState(cmd)
+        cmd.respond('text="setting %s file for %0.1fC: %s"' % (expType, ccdTemp, masterFile))
+        cmd.finish(self.filenameKey(masterFile))
+
+    def _buildMasterFailed(self, failure, cmd, expType):
+        cmd.fail('text=%s' % (qstr("could not build master %s: %s" % (expType, failure.getErrorMessage()))))
+
+    def buildBadPixelMask(self, cmd):
+        """
+        Make the bad pixel mask for the current dark's format from the current
+        dark and flat, and use it for calibrated frames from now on.
+
+        Args:
+            [hotSigma=F]      - dark current this many robust sigma above the median is hot (default 5).
+            [deadFraction=F]  - flat response below this fraction of the median is dead (default 0.5).
+        """
+        cmdKeys = cmd.cmd.keywords
+        hotSigma = cmdKeys['hotSigma'].values[0] if 'hotSigma' in cmdKeys else 5.
+        deadFraction = cmdKeys['deadFraction'].values[0] if 'deadFraction' in cmdKeys else 0.5
+        if not self.darkFile:
+            cmd.fail('text="no current dark frame to find bad pixels in."')
+            return
+        from gcameraICC import badPixels
+
+        try:
+            dark, header = self.calibrator.cache.get(self.darkFile)
+            shape = dark.shape
+            binning = (header.get('BINX', 1), header.get('BINY', 1))
+            darkRate = self.calibrator.darkRate(self.darkFile, self.biasFile, shape)
+            flatNorm = self.calibrator.flatNorm(self.flatFile, self.biasFile, shape)
+            if darkRate is None:
+                raise RuntimeError('%s has no exposure time' % (self.darkFile))
+            if flatNorm is None:
+                cmd.warn('text=%s' % (qstr("no usable flat (%s): finding hot pixels only" % (self.flatFile))))
+            indices, counts = badPixels.find_defects(darkRate, flatNorm, hotSigma=hotSigma,
+                                                     deadFraction=deadFraction)
+            path = badPixels.mask_path(self.badPixelDir, self.actor.name, shape, binning)
+            badPixels.save(path, indices, shape, binning, darkFile=self.darkFile, flatFile=self.flatFile)
+        except Exception as e:
+            cmd.fail('text=%s' % (qstr("could not make the bad pixel mask: %s" % e)))
+            return
+
+        self.badPixelMasks.pop(path, None)
+        cmd.finish('badPixelMask=%s,%d,%d,%d,%d' % (qstr(path), len(indices),
+                                                    counts['hot'], counts['dead'], counts['columns']))
+
+    def badPixelMask(self, shape, binning):
+        """Return the BadPixelMask for frames of shape and binning, or None if there is none."""
+        from gcameraICC import badPixels
+        path = badPixels.mask_path(self.badPixelDir, self.actor.name, shape, binning)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self.badPixelMasks.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, badPixels.load(path))
+            self.badPixelMasks[path] = cached
+        return cached[1]
+
+    def measureGain(self, cmd):
+        """
+        Measure the gain, read noise and full well from a photon transfer curve.
+
+        Takes a pair of biases, then a pair of flats at each exposure time (the
+        flat lamps must be on). Nothing is written to the night's directory.
+
+        Args:
+            times=T1,T2,...  - flat exposure times, reaching into saturation to find the full well.
+            [save]           - use the results in the headers of new frames.
+        """
+        from gcameraICC import ptc
+        cmdKeys = cmd.cmd.keywords
+        times = sorted(cmdKeys['times'].values)
+        if not self.actor.cam or self.simRoot:
+            cmd.fail('text="measureGain needs a connected camera, and not simulating."')
+            return
+
+        try:
+            self.setBOSSFormat(cmd, doFinish=False)
+            bias1 = self.gainFrame(0., cmd, 'bias')
+            bias2 = self.gainFrame(0., cmd, 'bias')
+            readNoise = ptc.read_noise(bias1, bias2)
+            bias = (bias1 + bias2.astype(np.float64))/2
+            levels = []
+            for itime in times:
+                flat1 = self.gainFrame(itime, cmd, 'expose')
+                flat2 = self.gainFrame(itime, cmd, 'expose')
+                level = ptc.pair_level(itime, flat1, flat2, bias)
+                cmd.inform('ptcLevel=%g,%0.1f,%0.2f' % level)
+                levels.append(level)
+            result = ptc.fit(levels, readNoise)
+        except Exception as e:
+            cmd.fail('text=%s' % (qstr("could not measure the gain: %s" % e)))
+            return
+
+        if 'save' in cmdKeys:
+            path = self.detectorPath()
+            try:
+                self.writer.write_text(path, ptc.dumps(result, time.time()))
+            except Exception as e:
+                cmd.fail('text=%s' % (qstr("could not write %s: %s" % (path, e))))
+                return
+            self._detectorLoaded = False
+            cmd.inform('text=%s' % (qstr("saved to %s: new frames will use this gain and read noise" % (path))))
+        cmd.finish(ptc.format_result(result))
+
+    def detectorPath(self):
+        """Return the file measureGain ... save keeps the detector properties in."""
+        from gcameraICC import ptc
+        return self.detectorFile or ptc.detector_path(self.dataRoot, self.actor.name)
+
+    @property
+    def detector(self):
+        """The detector properties saved by measureGain (read on first use), or None."""
+        if not self._detectorLoaded:
+            from gcameraICC import ptc
+            self._detector = ptc.load(self.detectorPath())
+            self._detectorLoaded = True
+        return self._detector
+
+    def gainFrame(self, itime, cmd, expType):
+        """Take one frame for measureGain, and return its pixels without the overscan."""
+        from gcameraICC import overscan
+        data = self.exposeStack(itime, 1, cmd, expType=expType)['data']
+        nover = overscan.overscan_width(data.shape[1], self.actor.cam.ow, self.actor.cam.binning)
+        return data[:, :data.shape[1]-nover]
 
     def coolerStatus(self, cmd, doFinish=True):
         """ Generate gcamera cooler status keywords. Does NOT finish the command. """
 
-        if self.actor.cam:
-            coolerStatus = self.actor.cam.cooler_status()
+        cam = self.actor.cam
+        if cam and cam.isShutDown:
+            # the SDK handle is gone: report the shutdown and the last values read.
+            cmd.respond(self._shutdownState('done', cam))
+            cmd.respond(cam.cached_cooler_status())
+        elif cam:
+            coolerStatus = cam.cooler_status()
             cmd.respond(coolerStatus)
 
         if doFinish:
@@ -547,6 +1420,8 @@ class CameraCmd(object):
         cmd.inform('text="setting camera cooler setpoint to %0.1f degC"' % (temp))
 
         self.actor.cam.set_cooler(temp)
+        self.actor.coolerSetpoint = temp
+        self.saveState(cmd)
         self.coolerStatus(cmd, doFinish=doFinish)
 
     def ping(self, cmd):
@@ -555,13 +1430,70 @@ class CameraCmd(object):
         cmd.finish('text="Pong."')
 
     def shutdown(self, cmd):
-        """"Shutdown the camera connection safely (letting it warm up slowly): you must supply force."""
+        """
+        Shutdown the camera connection safely (letting it warm up slowly): you must supply force.
+
+        The warm-up runs in the background, reporting shutdownState as it goes,
+        and this command finishes once the camera is off. The actor stays
+        responsive meanwhile, but refuses exposures; "shutdown abort" stops it.
+        """
         if 'force' not in cmd.cmd.keywords:
             cmd.fail("text='You must specify force when attempting to shut down the guide camera.'")
             return
 
-        self.actor.cam.shutdown(cmd)
-        self.status(cmd, doFinish=True)
+        cam = self.actor.cam
+        if not cam:
+            cmd.fail('text="no camera connected."')
+            return
+
+        try:
+            cam.start_shutdown()
+        except Exception as e:
+            cmd.fail('text=%s' % (qstr("cannot shut down: %s" % e)))
+            return
+
+        cmd.inform(self._shutdownState('warming', cam))
+        reactor.callFromThread(self._shutdownTick, cmd, cam)
+
+    def _shutdownState(self, state, cam):
+        return 'shutdownState="%s",%0.1f,%0.1f' % (state, cam.ccdTemp, cam.safe_temp)
+
+    def _shutdownTick(self, cmd, cam):
+        """Run one shutdown step in a worker thread (reactor thread)."""
+        from twisted.internet import threads
+        d = threads.deferToThread(cam.shutdown_step, cmd)
+        d.addCallbacks(self._shutdownStepDone, self._shutdownFailed,
+                       callbackArgs=(cmd, cam), errbackArgs=(cmd, cam))
+
+    def _shutdownStepDone(self, done, cmd, cam):
+        if done is None:
+            cmd.fail(self._shutdownState('aborted', cam) + '; text="shutdown aborted."')
+        elif done:
+            cmd.finish(self._shutdownState('done', cam))
+        else:
+            cmd.inform(self._shutdownState('warming', cam))
+            reactor.callLater(cam.shutdown_wait, self._shutdownTick, cmd, cam)
+
+    def _shutdownFailed(self, failure, cmd, cam):
+        # Don't leave the camera refusing exposures forever.
+        try:
+            cam.abort_shutdown()
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not restore the cooler: %s" % e)))
+        cmd.fail(self._shutdownState('failed', cam) + '; text=%s' %
+                 (qstr("shutdown failed: %s" % failure.getErrorMessage())))
+
+    def shutdownAbort(self, cmd):
+        """Abort a shutdown in progress, restoring the cooler setpoint."""
+
+        cam = self.actor.cam
+        if not cam or not cam.isShuttingDown:
+            cmd.fail('text="no shutdown in progress."')
+            return
+
+        cam.abort_shutdown()
+        self.coolerStatus(cmd, doFinish=False)
+        cmd.finish(self._shutdownState('aborted', cam))
 
     def getTS(self, t=None, format="%Y-%m-%d %H:%M:%S", zone="Z"):
         """ Return a proper ISO timestamp for t, or now if t==None. """
@@ -588,6 +1520,9 @@ class CameraCmd(object):
 
     def writeFITS(self, imDict, cmd):
         """ Write the FITS frame for the current image. """
+        import pyfits
+        import actorcore.utility.fits as actorFits
+
         filename = imDict['filename']
         directory,basename = os.path.split(filename)
         biasFile = imDict.get('biasFile', "")
@@ -629,16 +1564,24 @@ class CameraCmd(object):
         hdr.update('BINX', imDict.get('binx', self.actor.cam.binning))
         hdr.update('BINY', imDict.get('biny', self.actor.cam.binning))
 
-        hdr.update('GAIN',
-                   self.actor.config.getfloat('camera', 'ccdGain'),
-                   'The CCD gain.')
-        hdr.update('READNOIS',
-                   self.actor.config.getfloat('camera', 'readNoise'),
-                   'The CCD read noise [ADUs].')
+        if self.detector:
+            gain, readNoise = self.detector['gain'], self.detector['readNoise']
+        else:
+            gain = self.actor.config.getfloat('camera', 'ccdGain')
+            readNoise = self.actor.config.getfloat('camera', 'readNoise')
+        hdr.update('GAIN', gain, 'The CCD gain.')
+        hdr.update('READNOIS', readNoise, 'The CCD read noise [ADUs].')
+        if self.detector:
+            hdr.update('GAINDATE', self.getTS(self.detector.get('measured')),
+                       'when GAIN and READNOIS were measured')
         hdr.update('PIXELSC',
                    self.actor.config.getfloat('camera', 'pixelScale'),
                    'The scale of an unbinned pixel on the sky [arcsec]')
 
+        for key, value, comment in imDict.get('cards', []):
+            hdr.update(key, value, comment)
+        self.addSeeingCards(hdr, imDict, cmd)
+
         self.addPixelWcs(hdr)
 
         if self.actor.location == "LCO":
@@ -652,7 +1595,66 @@ class CameraCmd(object):
             mcpCards = actorFits.mcpCards(self.actor.models, cmd=cmd)
             actorFits.extendHeader(cmd, hdr, mcpCards)
 
-        actorFits.writeFits(cmd,hdu,directory,basename,doCompress=self.doCompress)
+        calHdu = None
+        if imDict['type'] == 'object' and self.calibratedFrame != 'off':
+            calHdu = self.makeCalibratedHDU(imDict, cmd)
+
+        if calHdu is not None and self.calibratedFrame == 'hdu':
+            self.writeHDUs(cmd, pyfits.HDUList([hdu, calHdu]), directory, basename)
+        else:
+            self.writeHDUs(cmd, hdu, directory, basename)
+
+        if calHdu is not None and self.calibratedFrame == 'file':
+            calBasename = basename.replace(self.filePrefix, 'gcal', 1)
+            calPrimary = pyfits.PrimaryHDU(calHdu.data, header=hdr.copy())
+            calPrimary.header.update('CALSTEPS', calHdu.header['CALSTEPS'], calHdu.header.comments['CALSTEPS'])
+            self.writeHDUs(cmd, calPrimary, directory, calBasename)
+            cmd.inform('calibratedFile=%s' % (os.path.join(directory, calBasename+self.ext)))
 
         del hdu
         del hdr
+
+    def writeHDUs(self, cmd, hdus, directory, basename):
+        """Write hdus to directory/basename (gzipped if we compress), atomically."""
+        path = os.path.join(directory, basename + self.ext)
+        try:
+            self.writer.write_fits(hdus, path, compress=self.doCompress)
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("failed to write %s: %s" % (path, e))))
+            raise
+        cmd.inform('text="wrote %s"' % (path))
+
+    @property
+    def calibrator(self):
+        """Our Calibrator, with its cache of calibration frames, made on first use."""
+        if self._calibrator is None:
+            from gcameraICC import calibration
+            self._calibrator = calibration.Calibrator(calibration.CalibrationCache(self.calibCacheBytes))
+        return self._calibrator
+
+    def makeCalibratedHDU(self, imDict, cmd):
+        """
+        Return an ImageHDU of the bias-subtracted, dark-scaled and flat-fielded
+        frame, or None if it could not be made.
+        """
+        try:
+            mask = None
+            if self.badPixelMode != 'off':
+                binning = (imDict.get('binx', self.actor.cam.binning), imDict.get('biny', self.actor.cam.binning))
+                mask = self.badPixelMask(imDict['data'].shape, binning)
+            frame, applied = self.calibrator.calibrate(imDict['data'], imDict['iTime'],
+                                                       biasFile=imDict.get('biasFile'),
+                                                       darkFile=imDict.get('darkFile'),
+                                                       flatFile=imDict.get('flatFile'),
+                                                       badPixels=mask, badPixelMode=self.badPixelMode)
+        except Exception as e:
+            cmd.warn('text=%s' % (qstr("could not calibrate frame: %s" % e)))
+            return None
+
+        import pyfits
+        hdu = pyfits.ImageHDU(frame, name='CALIBRATED')
+        hdu.header.update('CALSTEPS', ','.join(applied) or 'none', 'calibrations applied to this frame')
+        cache = self.calibrator.cache
+        cmd.diag('text="calibration cache: %d hits, %d misses, %.1f MB"' %
+                 (cache.hits, cache.misses, cache.nbytes/1024.**2))
+        return hdu
@@ -1,13 +1,29 @@
 """Base class for controlling guide cameras."""
 
 import abc
+import collections
 import time
 import sys
 import math
+import threading
 import traceback
 
 import numpy as np
 
+import coolerHistory
+
+# One reading of the cooler, as sent in the "cooler" keyword.
+CoolerSample = collections.namedtuple('CoolerSample', ['time', 'setpoint', 'ccdTemp',
+                                                       'heatsinkTemp', 'drive', 'fan',
+                                                       'statusText'])
+
+def format_cooler(sample):
+    """Return the "cooler" keyword for a CoolerSample."""
+    status = "{},{:.1f},{:.1f},{:.1f},{},{}".format(sample.setpoint,
+                                                    sample.ccdTemp, sample.heatsinkTemp,
+                                                    sample.drive, sample.fan, sample.statusText)
+    return "cooler={}".format(status)
+
 class CameraError(RuntimeError):
     def __str__(self):
         return self.__class__.__name__ + ': ' + self.message
@@ -25,6 +41,13 @@ class BaseCam(object):
         self.cmd = None
 
         self._isShuttingDown = False
+        self.isShutDown = False
+        self.errorCount = 0 # consecutive camera errors, for the ICC's watchdog.
+        self._shutdownLock = threading.Lock()
+        self._shutdownSetpoint = None
+        # held for the whole of each exposure, so the ICC doesn't close the
+        # connection under one when it reconnects.
+        self.exposeLock = threading.Lock()
 
         if not getattr(self,'camName',None):
             self.camName = 'unknown'
@@ -52,6 +75,11 @@ class BaseCam(object):
         self.heatsinkTemp = np.nan
         self.fan = np.nan
         self.statusText = 'Unknown'
+        self.statusCode = coolerHistory.STATUS_UNKNOWN
+        self.coolerReadTime = np.nan
+
+        # a coolerHistory.CoolerHistory to record each read_cooler() sample in.
+        self.history = None
 
         # TBD: The stuff below here is only in place for testing.
         # TBD: It should be removed once I've got full tests in place for
@@ -63,6 +91,7 @@ class BaseCam(object):
         """Handle an error, either outputting to a cmdr, or saving for later."""
         if self.verbose:
             traceback.print_exc()
+        self.errorCount += 1
         if self.cmd is not None:
             msg = str(e)
             msg += '. Last message: {}'.format(self.errMsg)
@@ -93,17 +122,46 @@ class BaseCam(object):
 
     def cooler_status(self):
         """Return the cooler status keywords."""
-        status = "{},{:.1f},{:.1f},{:.1f},{},{}".format(self.setpoint,
-                                                        self.ccdTemp, self.heatsinkTemp,
-                                                        self.drive, self.fan, self.statusText)
-        return "cooler={}".format(status)
+        return self.cached_cooler_status()
+
+    def cached_cooler_status(self):
+        """Return the cooler status keywords from the last values read, without talking to the camera."""
+        return format_cooler(self.cooler_sample())
+
+    def cooler_sample(self):
+        """Return the last read cooler values as a CoolerSample, without talking to the camera."""
+        return CoolerSample(self.coolerReadTime, self.setpoint, self.ccdTemp,
+                            self.heatsinkTemp, self.drive, self.fan, self.statusText)
+
+    def read_cooler(self):
+        """
+        Read the cooler once from the camera, and return it as a CoolerSample.
+
+        The sample is also appended to self.history, if we have one.
+        """
+        self._checkSelf()
+        try:
+            self._check_temperature()
+        except Exception:
+            self.errorCount += 1
+            raise
+        self.errorCount = 0
+        self.coolerReadTime = time.time()
+        sample = self.cooler_sample()
+        if self.history is not None:
+            self.history.append(sample, self.statusCode)
+        return sample
 
     def set_status_text(self,value):
         """Set self.statusText from coolerStusNames, safely."""
         try:
+            if value < 0:
+                raise IndexError(value)
             self.statusText = self.coolerStatusNames[value]
+            self.statusCode = value
         except:
             self.statusText = 'Invalid'
+            self.statusCode = coolerHistory.STATUS_INVALID
 
     @abc.abstractmethod
     def set_cooler(self, setpoint):
@@ -160,7 +218,14 @@ class BaseCam(object):
             openShutter (bool): open the shutter.
             cmd (Cmdr): Commander for passing response messages.
         """
+        with self.exposeLock:
+            return self._expose_locked(itime, openShutter, cmd)
+
+    def _expose_locked(self, itime, openShutter, cmd):
+        """Take an exposure, holding exposeLock. See _expose()."""
         self._checkSelf()
+        if self._isShuttingDown:
+            raise CameraError('{} camera is shutting down: no exposures allowed'.format(self.camName))
 
         self.itime = itime
         self.openShutter = openShutter
@@ -172,14 +237,21 @@ class BaseCam(object):
             cmd.respond('exposureState="integrating",%0.1f,%0.1f' % (itime, itime))
             self._wait_on_exposure()
             cmd.respond('exposureState="reading",%0.1f,%0.1f' % (self.read_time,self.read_time))
+            readStart = time.time()
             image = self._get_exposure()
+            self.update_read_time(time.time() - readStart)
             cmd.respond('exposureState="done",0,0')
+            self.errorCount = 0
             return image
         except Exception as e:
             cmd.respond('exposureState="failed",0,0')
             self.handle_error(e)
             raise e
 
+    def update_read_time(self, elapsed):
+        """Fold one measured readout time into read_time, our running estimate of it."""
+        self.read_time += 0.25*(elapsed - self.read_time)
+
     @abc.abstractmethod
     def _prep_exposure(self):
         """Prep for an exposure to start."""
@@ -235,10 +307,82 @@ class BaseCam(object):
         """Command the camera to shut off."""
         pass
 
+    @property
+    def exposing(self):
+        """True while an exposure is using the camera."""
+        return self.exposeLock.locked()
+
+    @property
+    def isShuttingDown(self):
+        """True while a shutdown is warming up the camera."""
+        return self._isShuttingDown
+
+    def safe_to_shutdown(self):
+        """True if the CCD is above, or close to, the safe temperature."""
+        return (self.ccdTemp > self.safe_temp) or np.isclose(self.ccdTemp, self.safe_temp, atol=0.5)
+
+    def start_shutdown(self):
+        """
+        Begin a safe shutdown: turn off the cooler, so the CCD starts to warm up.
+
+        Call shutdown_step() until it returns True to finish the shutdown.
+        Exposures are refused until the shutdown finishes or is aborted.
+        """
+        self._checkSelf()
+
+        with self._shutdownLock:
+            if self._isShuttingDown:
+                raise CameraError('camera is already shutting down.')
+            self._isShuttingDown = True
+            self._shutdownSetpoint = self.setpoint
+        self._cooler_off()
+
+    def shutdown_step(self, cmd=None):
+        """
+        Do one step of a shutdown started with start_shutdown().
+
+        If the CCD has warmed up enough, shut the camera off; otherwise read
+        the temperature (reporting it to cmd, if given).
+
+        Returns:
+            True once the camera is shut down, False if it is still warming
+            up, or None if the shutdown has been aborted.
+        """
+        with self._shutdownLock:
+            if not self._isShuttingDown:
+                return None
+            if self.safe_to_shutdown():
+                self._shutdown()
+                self._isShuttingDown = False
+                self.isShutDown = True
+                # the SDK handle is gone: nothing may talk to the camera now.
+                self.ok = False
+                self.errMsg = 'the camera was shut down'
+                return True
+
+        if cmd is not None:
+            cmd.inform(self.cooler_status())
+        else:
+            self._check_temperature()
+        return False
+
+    def abort_shutdown(self):
+        """Abort a shutdown in progress, and restore the previous cooler setpoint."""
+        with self._shutdownLock:
+            if not self._isShuttingDown:
+                raise CameraError('camera is not shutting down.')
+            self._isShuttingDown = False
+        setpoint = self._shutdownSetpoint
+        if setpoint is not None and not np.isnan(setpoint):
+            self.set_cooler(setpoint)
+
     def shutdown(self,cmd=None):
         """
         Safely shut down the camera, by turning off cooling, waiting for the
         temperature to stabilize, and then shutting down the connection and camera.
+
+        This blocks until the camera is warm: the actor's shutdown command
+        drives start_shutdown()/shutdown_step() from the reactor instead.
         """
         self._checkSelf()
 
@@ -246,18 +390,9 @@ class BaseCam(object):
             cmd.fail('camera is already shutting down.')
             return
 
-        self._isShuttingDown = True
-
-        self._cooler_off()
-        # Check that we're above, or close to freezing
-        while not((self.ccdTemp > self.safe_temp) or (np.isclose(self.ccdTemp, self.safe_temp, atol=0.5))):
-            if cmd is not None:
-                cmd.inform(self.cooler_status())
-            else:
-                self._check_temperature()
+        self.start_shutdown()
+        while self.shutdown_step(cmd) is False:
             time.sleep(self.shutdown_wait)
-        self._shutdown()
-        self._isShuttingDown = False
 
     def _expose_old(self, itime, openShutter, filename, cmd=None, recursing=False):
         """
@@ -1,6 +1,9 @@
 /* alta.i - add a method to the Apogee-supplied class to read an image into a numpy array. */
 
-%module alta
+/* threads="1": wrappers can release the GIL, so the rest of the ICC keeps running during calls that
+   wait on the camera. Only the calls named below do: the register reads and writes are quick, and
+   holding the GIL for them costs less than dropping and retaking it. AltaCam serializes its calls. */
+%module(threads="1") alta
 %{     
 #define SWIG_FILE_WITH_INIT
 #include "ApnCamera.h" 
@@ -11,10 +14,20 @@
 import_array();
 %}
 
+%nothread;
+%thread CApnCamera::InitDriver;
+%thread CApnCamera::ResetSystem;
+%thread CApnCamera::Expose;
+%thread CApnCamera::ImageReady;
+%thread CApnCamera::GetImageData;
+%thread CApnCamera::FillImageBuffer;
+
 // Apogee sugared up the camera class.
 %include "ApnCamera.i"
 
 // wrap an Apogee method with one which understands that it is getting a numpy array.
+// It runs without the GIL (see above): the typemap has already taken the array's
+// data pointer, and the caller's reference keeps the array alive.
 %extend CApnCamera {  
    int FillImageBuffer(unsigned short *INPLACE_ARRAY2, int DIM1, int DIM2) {
    	long ret;
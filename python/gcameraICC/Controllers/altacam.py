@@ -5,13 +5,27 @@ __all__ = ['AltaCam']
 import alta
 import numpy as np
 
+import functools
 import sys
 import socket
+import threading
 import time
 from traceback import print_exc
 
 import BaseCam
 
+def serialized(method):
+    """
+    Run method holding the camera's lock. The long SDK calls release the GIL
+    (see alta.i), so without it another thread's register reads could run in
+    the middle of a readout.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.sdkLock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
     # The CoolerStatus enum values, with slightly shortened names.
     coolerStatusNames = ('Off', 'RampingToSetPoint', 'Correcting', 'RampingToAmbient', 
@@ -22,6 +36,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
 
         self.camName = 'Apogee Alta'
         self.hostname = hostname
+        self.sdkLock = threading.RLock()
 
         alta.CApnCamera.__init__(self)
         BaseCam.BaseCam.__init__(self)
@@ -42,6 +57,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
         o1, o2, o3, o4 = map(int, addr.split('.'))
         return (o1 << 24) | (o2 << 16) | (o3 << 8) | o4
         
+    @serialized
     def doOpen(self):
         """ (Re-)open a connection to the camera at self.hostname. """
 
@@ -52,27 +68,24 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
             sys.stderr.write("failed to re-open a camera connection: %s\n" % (e))
         self.doInit()
     
+    @serialized
     def connect(self):
         """ (Re-)initialize an already open connection. """
 
         ip = socket.gethostbyname(self.hostname)
         ipAddr = self.__addr2ip(ip)
-        count = 5
-        while count > 0:
-            self.ok = self.InitDriver(ipAddr, 80, 0)
-            if self.ok:
-                break
+        # A single attempt: the ICC retries, with backoff, in a worker thread.
+        self.ok = self.InitDriver(ipAddr, 80, 0)
+        if not self.ok:
             self.CloseDriver()
-            count -= 1
-            time.sleep(1)
-
-        self.__checkSelf()
+            raise BaseCam.CameraError('InitDriver failed for {} ({})'.format(self.hostname, ip))
 
         # Turn off LEDs
         self.write_LedMode(0)
 
         return self.ok
     
+    @serialized
     def cooler_status(self):
         """ Return the cooler status keywords. """
 
@@ -93,6 +106,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
 
         super(AltaCam,self).cooler_status()
 
+    @serialized
     def setCooler(self, setpoint):
         """ Set the cooler setpoint.
 
@@ -114,6 +128,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
 
         return self.coolerStatus()
 
+    @serialized
     def setFan(self, level):
         """ Set the fan power.
 
@@ -129,6 +144,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
         self.write_FanMode(level)
 
     
+    @serialized
     def setBinning(self, x, y=None):
         """ Set the readout binning.
 
@@ -147,6 +163,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
         self.bin_x = x
         self.bin_y = y
 
+    @serialized
     def setWindow(self, x0, y0, x1, y1):
         """ Set the readout window, in binned pixels starting from 0,0. """
 
@@ -160,6 +177,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
         self.write_RoiStartX(x0 * self.bin_x)
         self.write_RoiStartY(y0 * self.bin_y)
         
+    @serialized
     def setBOSSFormat(self):
         """Set up for 2x2 binning."""
         self.__checkSelf()
@@ -182,6 +200,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
         oc = self.read_OverscanColumns()
         self.write_DigitizeOverscan(1)
 
+    @serialized
     def setFlatFormat(self):
         """Set up for unbinned images."""
         self.__checkSelf()
@@ -224,11 +243,12 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
 
         # Is the camera alive and flushing?
         for i in range(2):
-            state = self.read_ImagingStatus()
-            if state == 4:
-                break;
-            # print "starting state=%d, RESETTING" % (state)
-            self.ResetSystem()
+            with self.sdkLock:
+                state = self.read_ImagingStatus()
+                if state == 4:
+                    break;
+                # print "starting state=%d, RESETTING" % (state)
+                self.ResetSystem()
 
         if state != 4 or state < 0: 
             raise RuntimeError("bad imaging state=%d; please try gcamera reconnect before restarting the ICC" % (state))
@@ -240,14 +260,16 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
         start = time.time()
         if cmd:
             cmd.respond('exposureState="integrating",%0.1f,%0.1f' % (itime, itime))
-        self.Expose(itime, openShutter)
+        with self.sdkLock:
+            self.Expose(itime, openShutter)
         if itime > 0.25:
             time.sleep(itime - 0.2)
 
         # We are close to the end of the exposure. Start polling the camera
         for i in range(50):
             now = time.time()
-            state = self.read_ImagingStatus()
+            with self.sdkLock:
+                state = self.read_ImagingStatus()
             if state < 0: 
                 raise RuntimeError("bad state=%d; please try gcamera reconnect before restarting the ICC" % (state))
             if state == 3:
@@ -272,7 +294,8 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
             raise RuntimeError("failed to read image from camera; please try gcamera reconnect before restarting the ICC")
         t1 = time.time()
 
-        state = self.read_ImagingStatus()
+        with self.sdkLock:
+            state = self.read_ImagingStatus()
         print >> sys.stderr, "state=%d readoutTime=%0.2f" % (state,t1-t0)
 
         d['iTime'] = itime
@@ -302,6 +325,7 @@ class AltaCam(BaseCam.BaseCam,alta.CApnCamera):
             return None
         return image
     
+    @serialized
     def fetchImage(self, cmd=None):
         """ Return the current image. """
 
@@ -1,9 +1,18 @@
 """Python OO interface for controlling an Andor Ikon camera."""
+import threading
+
 import numpy as np
 
 import BaseCam
 import andor
 
+# The Andor SDK has a single "current camera" per process: every call acts on
+# whichever handle was last passed to SetCurrentCamera. When one process drives
+# several cameras, every SDK call goes through this lock and re-selects its own
+# camera first, so calls from different acquisition threads cannot interleave.
+_sdkLock = threading.RLock()
+_currentHandle = None
+
 class AndorError(BaseCam.CameraError):
     pass
 
@@ -14,10 +23,18 @@ class AndorCam(BaseCam.BaseCam):
                          'NotReached', 'OutOfRange', 'NotSupported',
                          'WasStableNowDrifting')
 
-    def __init__(self):
-        """ Connect to an Andor ikon and start to initialize it. """
+    def __init__(self, cameraIndex=0):
+        """
+        Connect to an Andor ikon and start to initialize it.
+
+        Kwargs:
+            cameraIndex (int): which of the attached cameras to use, as passed
+                to GetCameraHandle.
+        """
 
         self.camName = 'Andor iKon'
+        self.cameraIndex = cameraIndex
+        self.camHandle = None
         BaseCam.BaseCam.__init__(self)
 
         self.IDLE = andor.DRV_IDLE
@@ -27,16 +44,19 @@ class AndorCam(BaseCam.BaseCam):
         self.read_time = 0.5
 
         self.binning = 2
+        self.ow, self.oh = 0, 0 # the iKon frames have no overscan.
 
     def connect(self):
         """ (Re-)initialize and already open connection. """
 
         super(AndorCam,self).doInit()
 
-        self.camHandle = self.safe_call(andor.GetCameraHandle,0)
-        self.safe_call(andor.SetCurrentCamera,self.camHandle)
-        self.safe_call(andor.Initialize,"/usr/local/etc/andor")
-        self.width,self.height = self.safe_call(andor.GetDetector)
+        with _sdkLock:
+            self.camHandle = None
+            self.camHandle = self.safe_call(andor.GetCameraHandle,self.cameraIndex)
+            self._select(force=True)
+            self.safe_call(andor.Initialize,"/usr/local/etc/andor")
+            self.width,self.height = self.safe_call(andor.GetDetector)
         self.ok = True
 
         self._checkSelf()
@@ -44,6 +64,25 @@ class AndorCam(BaseCam.BaseCam):
         # Turn off LEDs
         # self.write_LedMode(0)
 
+    def _select(self, force=False):
+        """Make this camera the SDK's current camera, if it isn't already."""
+        global _currentHandle
+
+        if self.camHandle is None:
+            return
+        if force or _currentHandle != self.camHandle:
+            retval = andor.SetCurrentCamera(self.camHandle)
+            if retval != andor.DRV_SUCCESS:
+                _currentHandle = None
+                raise AndorError('Error number {} selecting camera handle {}'.format(retval,self.camHandle))
+            _currentHandle = self.camHandle
+
+    def sdk_call(self,func,*args):
+        """Call func with args on this camera, holding the SDK lock. Returns the raw result."""
+        with _sdkLock:
+            self._select()
+            return func(*args)
+
     def safe_call(self,func,*args):
         """
         Call func with args, check return for success, return actual result, if any.
@@ -52,7 +91,7 @@ class AndorCam(BaseCam.BaseCam):
         """
         if self.verbose:
             print 'Calling: {}{}'.format(func.__name__,args)
-        result = func(*args)
+        result = self.sdk_call(func,*args)
         # unpack the result: could be a single return value,
         # return value + one thing, or return value + many things.
         if type(result) == list:
@@ -84,11 +123,11 @@ class AndorCam(BaseCam.BaseCam):
             return
 
         # not safe_call: we need the return value
-        result = andor.GetTemperatureF()
+        result = self.sdk_call(andor.GetTemperatureF)
         if result[0] == andor.DRV_TEMPERATURE_OFF:
             self.safe_call(andor.CoolerON)
         # NOTE: setTemperature wants only an int...
-        andor.SetTemperature(int(setpoint))
+        self.sdk_call(andor.SetTemperature,int(setpoint))
 
         return self.cooler_status()
 
@@ -151,7 +190,7 @@ class AndorCam(BaseCam.BaseCam):
         # NOTE: apparently this function doesn't actually exist?
         # SensorTemp, TargetTemp, AmbientTemp, CoolerVolts = self.safe_call(andor.GetTemperatureStatus)
 
-        result = andor.GetTemperatureF()
+        result = self.sdk_call(andor.GetTemperatureF)
         if result[0] == andor.DRV_ACQUIRING:
             # just update the temperature, don't change the status text
             self.ccdTemp = result[1]
@@ -163,4 +202,12 @@ class AndorCam(BaseCam.BaseCam):
             self.set_status_text(result[0] - andor.DRV_TEMPERATURE_OFF)
 
     def _shutdown(self):
-        andor.ShutDown()
+        global _currentHandle
+
+        if self.camHandle is None:
+            # we never got a handle: ShutDown would act on another camera's.
+            return
+        with _sdkLock:
+            self.sdk_call(andor.ShutDown)
+            # ShutDown releases the current camera: force the next call to re-select.
+            _currentHandle = None
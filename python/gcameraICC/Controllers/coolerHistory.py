@@ -0,0 +1,164 @@
+"""
+A compact on-disk history of the camera cooler telemetry.
+
+Samples are fixed-size records in a numpy memmap'd ring file, so appending one
+costs a few stores into the page cache and the file never grows. The default
+capacity holds about a week of samples at 1 Hz.
+"""
+
+import os
+
+import numpy as np
+
+MAGIC = 'GCOOLER1'
+
+headerDtype = np.dtype([('magic', 'S8'), ('capacity', '<i8'), ('written', '<i8')])
+HEADER_SIZE = 64 # bytes reserved for the header, before the first record.
+
+recordDtype = np.dtype([('time', '<f8'), ('setpoint', '<f4'), ('ccdTemp', '<f4'),
+                        ('heatsinkTemp', '<f4'), ('drive', '<f4'), ('fan', '<f4'),
+                        ('status', '<i2'), ('pad', '<i2')])
+
+# Status codes for texts that aren't one of the camera's coolerStatusNames.
+STATUS_UNKNOWN = -1
+STATUS_INVALID = -2
+
+# The per-bin fields returned by CoolerHistory.aggregate()
+aggregateFields = ('ccdTemp', 'heatsinkTemp', 'drive')
+
+
+def status_text(code, statusNames):
+    """Return the cooler status text for a stored status code."""
+    if code == STATUS_INVALID:
+        return 'Invalid'
+    if 0 <= code < len(statusNames):
+        return statusNames[code]
+    return 'Unknown'
+
+
+def history_path(dataRoot, name):
+    """Return the cooler history file of the actor name."""
+    return os.path.join(dataRoot, '%s-coolerHistory.dat' % (name))
+
+
+def _float(value):
+    """Convert a cooler value (possibly None) to a float for storage."""
+    return np.nan if value is None else value
+
+
+class CoolerHistory(object):
+    """A fixed-capacity ring of cooler samples in a memmap'd file."""
+
+    def __init__(self, filename, capacity=7*24*3600):
+        """
+        Open the history in filename, creating (or re-creating) it if needed.
+
+        Args:
+            filename (str): the ring file.
+
+        Kwargs:
+            capacity (int): number of samples kept. An existing file with a
+                different capacity or layout is started afresh.
+        """
+        self.filename = filename
+        self.capacity = int(capacity)
+
+        size = HEADER_SIZE + self.capacity*recordDtype.itemsize
+        if not self._valid(size):
+            self._create(size)
+
+        self.header = np.memmap(filename, dtype=headerDtype, mode='r+', shape=(1,))
+        self.records = np.memmap(filename, dtype=recordDtype, mode='r+',
+                                 offset=HEADER_SIZE, shape=(self.capacity,))
+
+    def _valid(self, size):
+        """True if filename already holds a history with our layout."""
+        if not os.path.isfile(self.filename) or os.path.getsize(self.filename) != size:
+            return False
+        header = np.fromfile(self.filename, dtype=headerDtype, count=1)
+        return header['magic'][0] == MAGIC and header['capacity'][0] == self.capacity
+
+    def _create(self, size):
+        """Write a new, empty, history file."""
+        with open(self.filename, 'wb') as f:
+            header = np.zeros(1, dtype=headerDtype)
+            header['magic'] = MAGIC
+            header['capacity'] = self.capacity
+            f.write(header.tostring())
+            f.truncate(size)
+
+    def __len__(self):
+        return int(min(self.header['written'][0], self.capacity))
+
+    def append(self, sample, statusCode=STATUS_UNKNOWN):
+        """
+        Append a CoolerSample to the ring, overwriting the oldest if full.
+
+        The record is written before the count is bumped, so a reader never
+        sees a half-written sample as valid.
+        """
+        written = self.header['written'][0]
+        self.records[written % self.capacity] = (_float(sample.time), _float(sample.setpoint),
+                                                 _float(sample.ccdTemp), _float(sample.heatsinkTemp),
+                                                 _float(sample.drive), _float(sample.fan),
+                                                 statusCode, 0)
+        self.header['written'] = written + 1
+
+    def flush(self):
+        self.records.flush()
+        self.header.flush()
+
+    def close(self):
+        self.flush()
+        del self.records
+        del self.header
+
+    def since(self, t0):
+        """Return a time-ordered copy of the records with time >= t0."""
+        written = self.header['written'][0]
+        n = len(self)
+        start = written % self.capacity
+        if written > self.capacity and start > 0:
+            # The ring has wrapped: find t0 in each of its two ordered halves.
+            older = self.records[start:]
+            newer = self.records[:start]
+            i0 = np.searchsorted(older['time'], t0)
+            j0 = np.searchsorted(newer['time'], t0)
+            return np.concatenate((older[i0:], newer[j0:]))
+        else:
+            records = self.records[:n]
+            i0 = np.searchsorted(records['time'], t0)
+            return np.array(records[i0:])
+
+    def aggregate(self, t0, step):
+        """
+        Decimate the history since t0 into step-second bins.
+
+        Returns:
+            A dict of numpy arrays, one entry per non-empty bin: 'time' (bin
+            start), 'n' (samples in bin), '<field>Min', '<field>Mean',
+            '<field>Max' for each of aggregateFields (NaN values are ignored),
+            plus the last 'setpoint', 'fan' and 'status' code in each bin.
+        """
+        records = self.since(t0)
+        if len(records) == 0:
+            return None
+
+        binIdx = np.floor((records['time'] - t0)/step).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, binIdx[1:] != binIdx[:-1]])
+        lasts = np.r_[starts[1:], len(records)] - 1
+
+        result = {'time': t0 + binIdx[starts]*step,
+                  'n': np.diff(np.r_[starts, len(records)])}
+        for field in aggregateFields:
+            values = records[field].astype(np.float64)
+            good = ~np.isnan(values)
+            count = np.add.reduceat(good, starts)
+            total = np.add.reduceat(np.where(good, values, 0), starts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[field+'Mean'] = np.where(count > 0, total/count, np.nan)
+            result[field+'Min'] = np.fmin.reduceat(values, starts)
+            result[field+'Max'] = np.fmax.reduceat(values, starts)
+        for field in ('setpoint', 'fan', 'status'):
+            result[field] = records[field][lasts]
+        return result
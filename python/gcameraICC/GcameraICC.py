@@ -6,21 +6,89 @@ Configures its location based on the hostname it is running on.
 
 import abc
 
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 
 import opscore
+from opscore.utility.qstr import qstr
 from actorcore import ICC
 
 import ConfigParser
 import os
+import sys
+import time
 
 import gcameraICC
+from gcameraICC import telemetry
+from gcameraICC import stateSnapshot
+from Controllers import BaseCam
+from Controllers import coolerHistory
+
+
+def process_start_time():
+    """Return when this process started (Unix time), or None if we can't tell."""
+    try:
+        # field 22 of /proc/self/stat is our start time, in clock ticks since boot;
+        # the command name (field 2) may contain spaces, so count from its ')'.
+        stat = open('/proc/self/stat').read()
+        ticks = int(stat[stat.rindex(')')+2:].split()[19])
+        for line in open('/proc/stat'):
+            if line.startswith('btime'):
+                return int(line.split()[1]) + ticks/float(os.sysconf('SC_CLK_TCK'))
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+startupSteps = ('init', 'commands', 'configured', 'hub', 'camera')
+
+
+def format_startup_times(startTime, milestones):
+    """
+    Return the startupTimes keyword: the seconds from startTime to each of
+    startupSteps, -1 for those not reached yet.
+    """
+    reached = dict(milestones)
+    times = [reached[step] - startTime if step in reached else -1 for step in startupSteps]
+    return 'startupTimes=%s' % (','.join('%0.3f' % (t) for t in times))
+
+
+def runActors(actors):
+    """
+    Run several actors in this process, sharing one reactor.
+
+    Each actor keeps its own command thread (and hence its own acquisition
+    thread); only the last one started runs the reactor, which blocks.
+
+    The post-readout pipeline workers, which all the actors share, are forked
+    first, while this is the only thread.
+    """
+    startPipelines(actors)
+    for actor in actors[:-1]:
+        actor.run(doReactor=False)
+    actors[-1].run()
+
+
+def startPipelines(actors):
+    """Fork the pipeline workers for the actors' pipelineStages, if any have them."""
+    # only imported if an actor made a Pipeline.
+    pipeline = sys.modules.get('gcameraICC.pipeline')
+    if pipeline is None:
+        return
+    try:
+        pipeline.start_pool()
+    except RuntimeError as e:
+        for actor in actors:
+            actor.logger.warn('not running pipelineStages in worker processes: %s' % (e))
 
 
 class GcameraICC(ICC.SDSS_ICC):
     """An ICC to manage connections to a guide camera."""
     __metaclass__ = abc.ABCMeta
 
+    # opscore only allows one model per actor in a process, so the models are
+    # shared between all the cameras we run.
+    _models = {}
+
     @staticmethod
     def newActor(name='gcamera',location=None,**kwargs):
         """Return the version of the actor based on our location."""
@@ -35,7 +103,7 @@ class GcameraICC(ICC.SDSS_ICC):
 
 
     def __init__(self, name, productName=None, configFile=None, doConnect=True,
-                 debugLevel=30, makeCmdrConnection=True):
+                 debugLevel=30, makeCmdrConnection=True, cameraIndex=None):
         """
         Create an ICC to communicate with a guide camera.
 
@@ -47,102 +115,305 @@ class GcameraICC(ICC.SDSS_ICC):
             configFile (str): the full path of the configuration file; defaults
                 to $PRODUCTNAME_DIR/etc/$name.cfg
             makeCmdrConnection (bool): establish self.cmdr as a command connection to the hub.
+            cameraIndex (int): which of the host's cameras to drive; defaults
+                to the camera.cameraIndex config value, or 0.
         """
 
         self.version = gcameraICC.__version__
 
+        # when we reached each step of starting up, reported by startupProfile.
+        self.startTime = process_start_time() or time.time()
+        self.startupMilestones = [('init', time.time())]
+
         self.cam = None
+        self.connecting = False
+        self.connectRetry = None
+        self.telemetryCall = None
+        self.telemetryBusy = False
+        self.coolerSample = None
         super(GcameraICC, self).__init__(name, productName=productName,
                                          configFile=configFile,
                                          productDir=(os.path.dirname(__file__) + '/../../'),
                                          makeCmdrConnection=makeCmdrConnection)
+        self.startupMilestone('commands')
 
         self.logger.setLevel(debugLevel)
 
+        if cameraIndex is None:
+            try:
+                cameraIndex = self.config.getint('camera', 'cameraIndex')
+            except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+                cameraIndex = 0
+        self.cameraIndex = cameraIndex
+
+        self.telemetryPeriod = self.getCameraConfig('telemetryPeriod', 5.)
+        self.coolerMonitor = telemetry.CoolerMonitor(deadband=self.getCameraConfig('coolerDeadband', 0.2),
+                                                     driveDeadband=self.getCameraConfig('coolerDriveDeadband', 1.),
+                                                     heartbeat=self.getCameraConfig('coolerHeartbeat', 300.))
+        self.coolerHistory = self.openCoolerHistory()
+
+        # What we re-apply to the camera whenever we (re)connect to it:
+        # what we last used, if the state snapshot has it.
+        self.coolerSetpoint = self.getCameraConfig('setTemp', None)
+        self.cameraFormat = 'BOSS'
+        self.readTime = None
+        self.restoreActorState()
+
+        self.reconnectDelay = self.getCameraConfig('reconnectDelay', 1.)
+        self.reconnectMaxDelay = self.getCameraConfig('reconnectMaxDelay', 60.)
+        self.watchdogErrors = int(self.getCameraConfig('watchdogErrors', 3))
+
+        self.frameServer = self.startFrameServer()
+
         # generate the models for other actors, so we can access their information
         # when generating more detailed fits cards.
         self.models = {}
         for actor in ['mcp', 'tcc', 'gcamera']:
-            self.models[actor] = opscore.actor.model.Model(actor)
-
-    def prep_connectCamera(self,hostname=""):
-        """Prepare to connect to the camera."""
-        if self.cam:
-            del self.cam
-            self.cam = None
-
-        self.bcast.inform('text="trying to connect to camera at %s...."' % (hostname))
-        # Previously doSelect(1), which doesn't exist in the EPoll reactor on Linux
-        # Craig said this is probably necessary because of how the altacam
-        # C++ framework works (or doesn't).
-        reactor.doIteration(1)
-
-    def finish_connectCamera(self):
-        """Finalize the camera connection."""
-        if self.cam:
-            # OK, try to set the cooler.
-            try:
-                setPoint = float(self.config.get('camera', 'setTemp'))
-                self.callCommand("setTemp temp=%g" % (setPoint))
-                # self.callCommand("setTemp temp=5")
-            except Exception, e:
-                self.bcast.warn('text="could not get/parse alta.tempSetpoint config variable: %s"' % (e))
+            if actor not in GcameraICC._models:
+                GcameraICC._models[actor] = opscore.actor.model.Model(actor)
+            self.models[actor] = GcameraICC._models[actor]
+        self.startupMilestone('configured')
+
+    def startupMilestone(self, name):
+        """Record that we reached the startup step name now (the first time only)."""
+        if name not in dict(self.startupMilestones):
+            self.startupMilestones.append((name, time.time()))
+
+    def formatStartupTimes(self):
+        """Return the startupTimes keyword."""
+        return format_startup_times(self.startTime, self.startupMilestones)
+
+    def getCameraConfig(self, option, default, type=float):
+        """Return option from the [camera] config section as type, or default if it isn't there."""
+        try:
+            return type(self.config.get('camera', option))
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError, ValueError):
+            return default
 
-            self.statusCheck()
-        else:
-            self.bcast.warn('text="BAD THING: failed to connect to camera! Try \'gcamera reconnect\', I suppose. %s"' % (e))
+    def stateFilePath(self):
+        """Return the state snapshot file: camera.stateFile, or dataRoot/<name>-state.json."""
+        try:
+            return self.config.get('camera', 'stateFile')
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            return stateSnapshot.snapshot_path(self.config.get(self.name, 'dataRoot'), self.name)
+
+    def restoreActorState(self):
+        """Take the cooler setpoint, readout format and readout time from the state snapshot."""
+        state = stateSnapshot.read(self.stateFilePath())
+        if state is None:
+            return
+        if state['coolerSetpoint'] is not None:
+            self.coolerSetpoint = state['coolerSetpoint']
+        self.cameraFormat = state['cameraFormat']
+        self.readTime = state['readTime']
+
+    def startFrameServer(self):
+        """Listen for frame stream subscribers, if frameServerPort is set; return the factory or None."""
+        port = int(self.getCameraConfig('frameServerPort', 0))
+        if port <= 0:
+            return None
+        from gcameraICC import frameServer
+        factory = frameServer.FrameServerFactory(maxQueue=int(self.getCameraConfig('frameServerQueue', 2)))
+        interface = self.getCameraConfig('frameServerInterface', '', type=str)
+        try:
+            reactor.listenTCP(port, factory, interface=interface)
+        except Exception as e:
+            self.logger.warn('could not start the frame server on port %d: %s' % (port, e))
+            return None
+        return factory
+
+    def openCoolerHistory(self):
+        """Open the cooler history ring file, or return None if we can't."""
+        try:
+            filename = self.config.get('camera', 'historyFile')
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            filename = coolerHistory.history_path(self.config.get(self.name, 'dataRoot'), self.name)
+        # historyLength counts samples: by default, a week of them.
+        length = int(self.getCameraConfig('historyLength', 7*24*3600/self.telemetryPeriod))
 
-        return self.cam
+        try:
+            return coolerHistory.CoolerHistory(filename, length)
+        except Exception as e:
+            self.logger.warn('could not open cooler history %s: %s' % (filename, e))
+            return None
 
-    def statusCheck(self):
-        self.callCommand("status")
+    @abc.abstractmethod
+    def makeCamera(self):
+        """Create and return a new camera controller. Called in a worker thread."""
+        pass
 
-        try:
-            statusPeriod = int(self.config.get('camera', 'statusPeriod'))
-        except:
-            statusPeriod = 5*60
+    def connectCamera(self, cmd=None):
+        """
+        (Re-)connect to the camera in a worker thread, retrying with exponential
+        backoff until it succeeds. Safe to call from any thread.
 
-        reactor.callLater(statusPeriod, self.statusCheck)
+        Kwargs:
+            cmd (Cmdr): finished when we connect, or failed if the first attempt fails.
+        """
+        reactor.callFromThread(self.prep_connectCamera, cmd)
+
+    def prep_connectCamera(self, cmd=None):
+        """Drop the current camera and start connecting (reactor thread)."""
+        if self.connecting:
+            if self.connectRetry is not None and self.connectRetry.active():
+                # don't wait for the backoff: try again now.
+                self.connectRetry.cancel()
+                self._connectAttempt(0, cmd)
+            elif cmd is not None:
+                cmd.finish('text="already trying to connect to the camera."')
+            return
+
+        self.connecting = True
+        oldCam, self.cam = self.cam, None
+        self._connectAttempt(0, cmd, oldCam)
+
+    def _connectAttempt(self, attempt, cmd, oldCam=None):
+        self.connectRetry = None
+        self.bcast.inform('text="trying to connect to camera (attempt %d)...."' % (attempt+1))
+        d = threads.deferToThread(self._makeConnectedCamera, oldCam)
+        d.addCallbacks(self.finish_connectCamera, self._connectFailed,
+                       callbackArgs=(cmd,), errbackArgs=(attempt, cmd))
+
+    def _makeConnectedCamera(self, oldCam=None):
+        """Connect to the camera and restore its state. Called in a worker thread."""
+        if oldCam is not None and not oldCam.isShutDown:
+            # Release the old connection, if there is anything left of it.
+            self.closeCamera(oldCam)
+
+        cam = self.makeCamera()
+        if not cam.ok:
+            # release whatever the failed attempt did open, so retries don't leak handles.
+            self.closeCamera(cam)
+            raise BaseCam.CameraError(cam.errMsg)
+        cam.history = self.coolerHistory
+        self.restoreCameraState(cam)
+        return cam
+
+    def closeCamera(self, cam):
+        """
+        Close cam's connection, once any exposure still using it has finished.
+        Called in a worker thread.
+        """
+        with cam.exposeLock:
+            cam.ok = False
+            try:
+                cam._shutdown()
+            except Exception as e:
+                self.logger.warn('could not close the camera connection: %s' % (e))
+
+    def restoreCameraState(self, cam):
+        """Re-apply the cooler setpoint and readout format we last commanded."""
+        if self.coolerSetpoint is not None:
+            cam.set_cooler(self.coolerSetpoint)
+        if self.readTime:
+            cam.read_time = self.readTime
+        if self.cameraFormat == 'flat':
+            cam.setFlatFormat()
+        else:
+            cam.setBOSSFormat()
+
+    def finish_connectCamera(self, cam, cmd=None):
+        """Finalize the camera connection (reactor thread)."""
+        self.cam = cam
+        self.connecting = False
+        self.startupMilestone('camera')
+        self.bcast.inform('text="connected to camera; cooler setpoint %s, %s format."' %
+                          (self.coolerSetpoint, self.cameraFormat))
+        self.callCommand("status")
+        self.startTelemetry()
+        if cmd is not None:
+            cmd.finish('cameraConnected=True')
+
+    def _connectFailed(self, failure, attempt, cmd):
+        """Schedule the next connection attempt, backing off exponentially."""
+        delay = min(self.reconnectDelay * 2**attempt, self.reconnectMaxDelay)
+        self.bcast.warn('text=%s' % qstr("failed to connect to camera: %s; retrying in %gs" %
+                                         (failure.getErrorMessage(), delay)))
+        if cmd is not None:
+            cmd.fail('cameraConnected=False; text="will keep trying to connect in the background."')
+        self.connectRetry = reactor.callLater(delay, self._connectAttempt, attempt+1, None)
+
+    def cameraNeedsReconnect(self, cam):
+        """True if the watchdog should reconnect to cam."""
+        if cam.isShutDown or cam.isShuttingDown:
+            return False
+        return not cam.ok or cam.errorCount >= self.watchdogErrors
+
+    def startTelemetry(self):
+        """Start the cooler telemetry loop, unless it is already running. Reactor thread only."""
+        if self.telemetryCall is not None and self.telemetryCall.active():
+            return
+        self.coolerMonitor.reset()
+        self.telemetryTick()
+
+    def telemetryTick(self):
+        """
+        Read the cooler once, in a worker thread, and report it if it changed.
+
+        Reschedules itself every telemetryPeriod seconds, but doesn't touch a
+        camera that has been shut down.
+        """
+        self.telemetryCall = reactor.callLater(self.telemetryPeriod, self.telemetryTick)
+
+        cam = self.cam
+        if cam is None or cam.isShutDown or self.connecting or self.telemetryBusy:
+            return
+        if self.cameraNeedsReconnect(cam):
+            if cam.exposing:
+                # don't pull the camera from under an exposure: try again next tick.
+                return
+            self.bcast.warn('text=%s' % qstr("camera watchdog: connection is bad (%s); reconnecting." %
+                                             (cam.errMsg or '%d errors' % cam.errorCount)))
+            self.prep_connectCamera()
+            return
+        if not cam.ok:
+            return
+
+        self.telemetryBusy = True
+        d = threads.deferToThread(cam.read_cooler)
+        d.addCallbacks(self._gotCoolerSample, self._coolerReadFailed)
+        d.addBoth(self._telemetryDone)
+
+    def _gotCoolerSample(self, sample):
+        """Cache a new cooler sample, and send it if it differs from the last one sent."""
+        self.coolerSample = sample
+        if self.coolerMonitor.update(sample):
+            self.bcast.inform(BaseCam.format_cooler(sample))
+
+    def _coolerReadFailed(self, failure):
+        self.bcast.warn('text=%s' % qstr("failed to read the camera cooler: %s" % failure.getErrorMessage()))
+
+    def _telemetryDone(self, result):
+        self.telemetryBusy = False
 
     def connectionMade(self):
-        reactor.callLater(3, self.connectCamera)
+        """Start connecting to the camera as soon as the hub link is up (reactor thread)."""
+        self.startupMilestone('hub')
+        # the hub link may have been remade after a hiccup: keep a camera we already have.
+        if self.cam is None:
+            self.prep_connectCamera()
 
 
 class GcameraAPO(GcameraICC):
     """APO version of this actor."""
     location='APO'
 
-    def connectCamera(self):
+    def makeCamera(self):
         """Estabilish a connection with the camera's network port."""
 
         from Controllers import altacam
 
         altaHostname = self.config.get('camera', 'hostname')
-        self.prep_connectCamera()
-
-        try:
-            self.cam = altacam.AltaCam(altaHostname)
-        except Exception, e:
-            self.bcast.warn('text="BAD THING: could not connect to camera: %s"' % (e))
-
-        self.finish_connectCamera()
+        return altacam.AltaCam(altaHostname)
 
 
 class GcameraLCO(GcameraICC):
     """LCO version of this actor."""
     location='LCO'
 
-    def connectCamera(self):
+    def makeCamera(self):
         """Estabilish a connection with the camera's USB port."""
 
         from Controllers import andorcam
 
-
-        self.prep_connectCamera()
-
-        try:
-            self.cam = andorcam.AndorCam()
-        except Exception, e:
-            self.bcast.warn('text="BAD THING: could not connect to camera: %s"' % (e))
-
-        self.finish_connectCamera()
+        return andorcam.AndorCam(cameraIndex=self.cameraIndex)
@@ -0,0 +1,154 @@
+"""
+Bad pixel masks: hot, dead and bad-column pixels from the master dark and flat.
+
+A mask is the sorted array of the flat indices of the bad pixels of one frame
+format (its shape, i.e. ROI, and binning), usually a few hundred numbers,
+saved as a small compressed .npz. Applying it is fancy indexing: each bad
+pixel is replaced by the median of its good neighbours (the 3x3 box, or the
+5x5 box if all of those are bad), whose indices are worked out once, when the
+mask is loaded. Calibrated (float) frames can instead have them set to NaN.
+"""
+
+import os
+import warnings
+
+import numpy as np
+
+from gcameraICC.imageStats import MAD_SIGMA
+
+modes = ('off', 'replace', 'flag')
+
+
+def find_defects(darkRate, flatNorm, hotSigma=5., deadFraction=0.5, columnFraction=0.5):
+    """
+    Return the sorted flat indices of the bad pixels, and a dict of how many
+    were 'hot', 'dead' and in bad 'columns'.
+
+    Args:
+        darkRate (ndarray): bias-subtracted dark current per second, or None.
+        flatNorm (ndarray): flat normalized to median 1, or None.
+
+    Kwargs:
+        hotSigma (float): dark rate this many robust sigma above the median is hot.
+        deadFraction (float): flat response below this is dead.
+        columnFraction (float): a column with more than this fraction of bad pixels is bad throughout.
+    """
+    shape = darkRate.shape if darkRate is not None else flatNorm.shape
+    bad = np.zeros(shape, dtype=bool)
+    counts = {'hot': 0, 'dead': 0, 'columns': 0}
+    if darkRate is not None:
+        median = np.median(darkRate)
+        sigma = MAD_SIGMA*np.median(np.abs(darkRate - median))
+        hot = darkRate > median + hotSigma*max(sigma, 1e-6)
+        counts['hot'] = int(hot.sum())
+        bad |= hot
+    if flatNorm is not None:
+        dead = flatNorm < deadFraction
+        counts['dead'] = int(dead.sum())
+        bad |= dead
+    columns = bad.mean(axis=0) > columnFraction
+    counts['columns'] = int(columns.sum())
+    bad[:, columns] = True
+    return np.flatnonzero(bad).astype(np.uint32), counts
+
+
+def mask_path(directory, name, shape, binning):
+    """Return the mask file of the actor name for frames of shape and binning."""
+    return os.path.join(directory, '%s-badpix-%dx%d-bin%dx%d.npz' % ((name,) + tuple(shape) + tuple(binning)))
+
+
+def save(path, indices, shape, binning, darkFile=None, flatFile=None):
+    """Save a mask (written to a temporary file and renamed into place)."""
+    directory, basename = os.path.split(path)
+    tempname = os.path.join(directory, '.%s.tmp' % (basename))
+    with open(tempname, 'wb') as f:
+        np.savez_compressed(f, indices=np.asarray(indices, dtype=np.uint32),
+                            shape=np.asarray(shape), binning=np.asarray(binning),
+                            darkFile=str(darkFile or ''), flatFile=str(flatFile or ''))
+    os.rename(tempname, path)
+
+
+def load(path):
+    """Return the BadPixelMask saved at path, or None if there isn't one."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        return BadPixelMask(saved['indices'], tuple(saved['shape']))
+
+
+def _neighbours(indices, shape, radius):
+    """Return (flat indices, in-frame) of the (2r+1)**2 - 1 boxes around each of indices."""
+    rows, cols = np.unravel_index(indices, shape)
+    offsets = [(dy, dx) for dy in range(-radius, radius+1) for dx in range(-radius, radius+1)
+               if (dy, dx) != (0, 0)]
+    dy = np.array([o[0] for o in offsets])
+    dx = np.array([o[1] for o in offsets])
+    nrows = rows[:, None] + dy
+    ncols = cols[:, None] + dx
+    inside = (nrows >= 0) & (nrows < shape[0]) & (ncols >= 0) & (ncols < shape[1])
+    flat = np.clip(nrows, 0, shape[0]-1)*shape[1] + np.clip(ncols, 0, shape[1]-1)
+    return flat, inside
+
+
+class BadPixelMask(object):
+    """The bad pixels of one frame format, ready to be applied."""
+
+    def __init__(self, indices, shape):
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.shape = tuple(shape)
+
+        # the good pixels in the 3x3 box around each bad one, or in the 5x5 if there are none.
+        isBad = np.zeros(self.shape[0]*self.shape[1], dtype=bool)
+        isBad[self.indices] = True
+        near, nearInside = _neighbours(self.indices, self.shape, 1)
+        far, farInside = _neighbours(self.indices, self.shape, 2)
+        nearGood = nearInside & ~isBad[near]
+        farGood = farInside & ~isBad[far] & ~nearGood.any(axis=1)[:, None]
+        # every pixel gets the 5x5 list; those with a good 3x3 neighbour only use the 3x3 part of it.
+        self._neighbours = far
+        self._good = farGood
+        ring1 = (np.abs(np.arange(-2, 3)[:, None]) <= 1) & (np.abs(np.arange(-2, 3)[None, :]) <= 1)
+        ring1 = np.delete(ring1.ravel(), 12)
+        self._good[:, ring1] |= nearGood
+        self.hopeless = int((~self._good.any(axis=1)).sum())
+        self._bad = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def bad(self):
+        """Return a boolean frame that is True at the bad pixels."""
+        if self._bad is None:
+            self._bad = np.zeros(self.shape, dtype=bool)
+            self._bad.flat[self.indices] = True
+        return self._bad
+
+    def apply(self, data, mode='replace'):
+        """
+        Fix the bad pixels of data in place: 'replace' them with the median of
+        their good neighbours, or 'flag' them as NaN (float data only).
+        Returns data.
+        """
+        if data.shape != self.shape:
+            raise ValueError('mask is for %s frames, not %s' % (self.shape, data.shape))
+        if not data.flags.c_contiguous:
+            raise ValueError('can only fix contiguous frames in place')
+        if not len(self.indices) or mode == 'off':
+            return data
+        flat = data.reshape(-1)
+        if mode == 'flag':
+            flat[self.indices] = np.nan
+            return data
+
+        values = flat[self._neighbours].astype(np.float32)
+        values[~self._good] = np.nan
+        with warnings.catch_warnings():
+            # pixels with no good neighbour at all give nan, and a warning.
+            warnings.simplefilter('ignore', RuntimeWarning)
+            medians = np.nanmedian(values, axis=1)
+        if self.hopeless:
+            medians[np.isnan(medians)] = np.nanmedian(medians) if self.hopeless < len(medians) else 0
+        if np.issubdtype(data.dtype, np.integer):
+            medians = np.round(medians)
+        flat[self.indices] = medians
+        return data
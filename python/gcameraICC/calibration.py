@@ -0,0 +1,207 @@
+"""
+Calibrated guide frames, from bias, dark and flat frames kept decoded in memory.
+
+The calibration frames are read (and un-gzipped) once: a CalibrationCache keeps
+the decoded arrays, keyed by path and modification time, in least-recently-used
+order within a memory budget.
+"""
+
+import collections
+import os
+import threading
+
+import numpy as np
+
+
+def block_mean(data, shape):
+    """
+    Return data averaged down to shape in integer blocks, or None if the
+    shapes are not integer multiples of each other.
+    """
+    if data.shape == tuple(shape):
+        return data
+    ny, nx = shape
+    if ny == 0 or nx == 0 or data.shape[0] % ny or data.shape[1] % nx:
+        return None
+    by, bx = data.shape[0]//ny, data.shape[1]//nx
+    return data.reshape(ny, by, nx, bx).mean(axis=(1, 3), dtype=np.float32)
+
+
+class CalibrationCache(object):
+    """An LRU cache of decoded calibration frames, within a memory budget."""
+
+    def __init__(self, maxBytes=256*1024**2):
+        """
+        Kwargs:
+            maxBytes (int): evict the least recently used arrays beyond this
+                total size (the most recent one is always kept).
+        """
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def key(self, path):
+        """Return the cache key for the current version of path."""
+        return (path, os.path.getmtime(path))
+
+    def _lookup(self, key):
+        with self._lock:
+            value = self._cache.pop(key, None)
+            if value is not None:
+                self._cache[key] = value
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def _store(self, key, value, nbytes):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.maxBytes and len(self._cache) > 1:
+                oldKey, (oldValue, oldBytes) = self._cache.popitem(last=False)
+                self.nbytes -= oldBytes
+
+    def _forget(self, path):
+        """Drop any entries made from older versions of path."""
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == path]:
+                value, nbytes = self._cache.pop(key)
+                self.nbytes -= nbytes
+
+    def get(self, path):
+        """
+        Return (data, header) for the FITS file at path, reading it only if
+        it is not cached or has changed since. data is a read-only float32 array.
+        """
+        key = self.key(path)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached[0]
+
+        import pyfits
+
+        self._forget(path)
+        data, header = pyfits.getdata(path, header=True)
+        data = data.astype(np.float32)
+        data.flags.writeable = False
+        self._store(key, (data, header), data.nbytes)
+        return data, header
+
+    def derived(self, key, func):
+        """
+        Return func(), computing it only once for this key. key should be
+        built from the key()s of the files func reads, so it changes with them.
+        """
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached[0]
+
+        value = func()
+        value.flags.writeable = False
+        self._store(key, value, value.nbytes)
+        return value
+
+
+class Calibrator(object):
+    """Make bias-subtracted, dark-scaled and flat-fielded frames."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._scratch = None
+
+    def bias(self, biasFile, shape):
+        if not biasFile:
+            return None
+        data, header = self.cache.get(biasFile)
+        return data if data.shape == tuple(shape) else None
+
+    def darkRate(self, darkFile, biasFile, shape):
+        """Return the bias-subtracted dark counts per second, or None if there is no usable dark."""
+        if not darkFile:
+            return None
+        key = ('darkRate', self.cache.key(darkFile),
+               self.cache.key(biasFile) if biasFile else None, tuple(shape))
+
+        def make():
+            dark, header = self.cache.get(darkFile)
+            exptime = header.get('EXPTIME', 0)
+            if dark.shape != tuple(shape) or not exptime > 0:
+                return np.zeros(0, dtype=np.float32)
+            bias = self.bias(biasFile, shape)
+            rate = dark - bias if bias is not None else dark.copy()
+            rate /= exptime
+            return rate
+
+        rate = self.cache.derived(key, make)
+        return rate if rate.size else None
+
+    def flatNorm(self, flatFile, biasFile, shape):
+        """Return the flat, binned to shape, bias-subtracted and normalized to median 1, or None."""
+        if not flatFile:
+            return None
+        key = ('flatNorm', self.cache.key(flatFile),
+               self.cache.key(biasFile) if biasFile else None, tuple(shape))
+
+        def make():
+            flat, header = self.cache.get(flatFile)
+            # Flats may be taken at a different binning than the frames they correct.
+            binned = block_mean(flat, shape)
+            if binned is None:
+                return np.zeros(0, dtype=np.float32)
+            flatNorm = np.array(binned, dtype=np.float32)
+            if biasFile:
+                # The bias level doesn't depend on the binning, so its median is enough.
+                bias, biasHeader = self.cache.get(biasFile)
+                flatNorm -= np.median(bias)
+            flatNorm /= np.median(flatNorm)
+            # don't blow up dead or vignetted pixels.
+            flatNorm[flatNorm <= 0.01] = 1.
+            return flatNorm
+
+        flatNorm = self.cache.derived(key, make)
+        return flatNorm if flatNorm.size else None
+
+    def calibrate(self, data, itime, biasFile=None, darkFile=None, flatFile=None,
+                  badPixels=None, badPixelMode='replace'):
+        """
+        Return a float32 calibrated copy of data, and a list of what was applied.
+
+        Each step is skipped if its file is missing or doesn't match the frame's shape.
+        badPixels is a badPixels.BadPixelMask, applied last as badPixelMode.
+        """
+        frame = np.array(data, dtype=np.float32)
+        applied = []
+
+        bias = self.bias(biasFile, frame.shape)
+        if bias is not None:
+            frame -= bias
+            applied.append('bias')
+
+        rate = self.darkRate(darkFile, biasFile, frame.shape)
+        if rate is not None and itime > 0:
+            # frame -= rate*itime, reusing one scratch buffer for the product.
+            if self._scratch is None or self._scratch.shape != frame.shape:
+                self._scratch = np.empty_like(frame)
+            np.multiply(rate, itime, out=self._scratch)
+            frame -= self._scratch
+            applied.append('dark')
+
+        flatNorm = self.flatNorm(flatFile, biasFile, frame.shape)
+        if flatNorm is not None:
+            frame /= flatNorm
+            applied.append('flat')
+
+        if badPixels is not None and badPixelMode != 'off' and badPixels.shape == frame.shape:
+            badPixels.apply(frame, badPixelMode)
+            applied.append('badpix')
+
+        return frame, applied
@@ -0,0 +1,226 @@
+"""
+An SQLite catalog of the guider frames under dataRoot.
+
+Only the primary FITS header of each gimg-* file is read: for a gzipped file
+that means decompressing just the first few 2880-byte blocks, not the pixels.
+A tile-compressed .fits.fz file (see recompress.py) has an empty primary HDU,
+so the header of its compressed image extension is read instead.
+The headers are read in a process pool, and the catalog is incremental: a
+file whose size and mtime match its catalog row is not read again.
+
+Paths in the catalog are relative to dataRoot, e.g. 57000/gimg-0012.fits.gz.
+The calibrations table links each frame to the bias, dark and flat frames
+named in its header.
+"""
+
+import glob
+import gzip
+import multiprocessing
+import os
+import re
+import sqlite3
+
+import pyfits
+
+BLOCK = 2880
+MAX_HEADER_BLOCKS = 100 # give up on finding END after this many blocks.
+
+# catalog column, FITS keyword, python type
+headerColumns = (('imagetyp', 'IMAGETYP', str), ('exptime', 'EXPTIME', float),
+                 ('stack', 'STACK', int), ('ccdtemp', 'CCDTEMP', float),
+                 ('dateobs', 'DATE-OBS', str), ('binx', 'BINX', int), ('biny', 'BINY', int),
+                 ('naxis1', 'NAXIS1', int), ('naxis2', 'NAXIS2', int),
+                 ('biasfile', 'BIASFILE', str), ('darkfile', 'DARKFILE', str),
+                 ('flatfile', 'FLATFILE', str), ('flatcart', 'FLATCART', int))
+calibrationKinds = (('bias', 'biasfile'), ('dark', 'darkfile'), ('flat', 'flatfile'))
+
+schema = """
+CREATE TABLE IF NOT EXISTS frames (
+    path TEXT PRIMARY KEY,
+    mjd INTEGER,
+    seqno INTEGER,
+    size INTEGER,
+    mtime REAL,
+    %s
+);
+CREATE INDEX IF NOT EXISTS frames_mjd ON frames (mjd, seqno);
+CREATE INDEX IF NOT EXISTS frames_type ON frames (imagetyp, exptime);
+CREATE TABLE IF NOT EXISTS calibrations (
+    path TEXT,
+    kind TEXT,
+    calib TEXT,
+    PRIMARY KEY (path, kind)
+);
+CREATE INDEX IF NOT EXISTS calibrations_calib ON calibrations (calib);
+""" % (',\n    '.join('%s %s' % (column, {str: 'TEXT', float: 'REAL', int: 'INTEGER'}[type_])
+                       for column, keyword, type_ in headerColumns))
+
+framePattern = re.compile(r'^gimg-(\d{4})\.fits')
+
+
+def _open(path):
+    """Open a FITS file, gzipped or not, for reading its header."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _read_header(f, path):
+    """Return the header starting at f's position, reading only the blocks up to its END card."""
+    blocks = []
+    for i in range(MAX_HEADER_BLOCKS):
+        block = f.read(BLOCK)
+        if len(block) < BLOCK:
+            raise IOError('%s: no END card before the end of the file' % (path))
+        blocks.append(block)
+        # each card is 80 characters; END is alone on its card.
+        if any(block[j:j+80].rstrip() == 'END' for j in range(0, BLOCK, 80)):
+            return pyfits.Header.fromstring(''.join(blocks))
+    raise IOError('%s: no END card in the first %d blocks' % (path, MAX_HEADER_BLOCKS))
+
+
+def read_primary_header(path):
+    """
+    Return the primary header of path, reading only the blocks up to its END card.
+
+    For a tile-compressed file, return the compressed image's header, with
+    its image dimensions (ZNAXISn) as NAXISn.
+    """
+    f = _open(path)
+    try:
+        header = _read_header(f, path)
+        if header.get('NAXIS') == 0 and path.endswith('.fz'):
+            # an empty primary HDU has no data, so the extension follows directly.
+            header = _read_header(f, path)
+            for axis in (1, 2):
+                if 'ZNAXIS%d' % (axis) in header:
+                    header['NAXIS%d' % (axis)] = header['ZNAXIS%d' % (axis)]
+        return header
+    finally:
+        f.close()
+
+
+def relative_path(path, dataRoot):
+    """Return path relative to dataRoot if it is under it, else unchanged (None stays None)."""
+    if not path:
+        return None
+    root = os.path.normpath(dataRoot) + os.sep
+    if os.path.isabs(path) and os.path.normpath(path).startswith(root):
+        return os.path.relpath(path, dataRoot)
+    return path
+
+
+def read_entry(args):
+    """
+    Return the catalog row (a dict) for one file, or (path, error message).
+    Runs in a worker process.
+    """
+    dataRoot, relpath, size, mtime = args
+    path = os.path.join(dataRoot, relpath)
+    try:
+        header = read_primary_header(path)
+    except Exception as e:
+        return relpath, str(e)
+
+    mjdDir, basename = os.path.split(relpath)
+    row = {'path': relpath, 'mjd': int(mjdDir), 'seqno': int(framePattern.match(basename).group(1)),
+           'size': size, 'mtime': mtime}
+    for column, keyword, type_ in headerColumns:
+        value = header.get(keyword)
+        try:
+            row[column] = type_(value) if value not in (None, '') else None
+        except ValueError:
+            row[column] = None
+    for kind, column in calibrationKinds:
+        row[column] = relative_path(row[column], dataRoot)
+    return row
+
+
+def find_frames(dataRoot, firstMjd=None, lastMjd=None):
+    """Return {relative path: (size, mtime)} for the gimg files in the MJD directories of dataRoot."""
+    frames = {}
+    for mjdDir in sorted(os.listdir(dataRoot)):
+        if not mjdDir.isdigit():
+            continue
+        mjd = int(mjdDir)
+        if (firstMjd is not None and mjd < firstMjd) or (lastMjd is not None and mjd > lastMjd):
+            continue
+        for path in glob.glob(os.path.join(dataRoot, mjdDir, 'gimg-*.fits*')):
+            if not framePattern.match(os.path.basename(path)):
+                continue
+            st = os.stat(path)
+            frames[os.path.join(mjdDir, os.path.basename(path))] = (st.st_size, st.st_mtime)
+    return frames
+
+
+def connect(dbPath):
+    """Open (creating if needed) the catalog database."""
+    db = sqlite3.connect(dbPath)
+    db.executescript(schema)
+    return db
+
+
+def _store(db, row):
+    columns = ['path', 'mjd', 'seqno', 'size', 'mtime'] + [column for column, k, t in headerColumns]
+    db.execute('INSERT OR REPLACE INTO frames (%s) VALUES (%s)' % (','.join(columns), ','.join('?'*len(columns))),
+               [row[column] for column in columns])
+    db.execute('DELETE FROM calibrations WHERE path = ?', (row['path'],))
+    for kind, column in calibrationKinds:
+        if row[column]:
+            db.execute('INSERT INTO calibrations (path, kind, calib) VALUES (?, ?, ?)',
+                       (row['path'], kind, row[column]))
+
+
+def update(db, dataRoot, firstMjd=None, lastMjd=None, processes=None, log=None):
+    """
+    Bring the catalog up to date with the files in the MJD range of dataRoot.
+
+    Returns:
+        a dict of counts: 'read', 'skipped' (unchanged), 'removed' (files
+        gone), and 'failed' (unreadable, left out of the catalog and retried next time).
+    """
+    onDisk = find_frames(dataRoot, firstMjd, lastMjd)
+
+    query = 'SELECT path, size, mtime FROM frames'
+    conditions, params = [], []
+    if firstMjd is not None:
+        conditions.append('mjd >= ?')
+        params.append(firstMjd)
+    if lastMjd is not None:
+        conditions.append('mjd <= ?')
+        params.append(lastMjd)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    known = dict((path, (size, mtime)) for path, size, mtime in db.execute(query, params))
+
+    todo = [(dataRoot, path, size, mtime) for path, (size, mtime) in sorted(onDisk.items())
+            if known.get(path) != (size, mtime)]
+    gone = [path for path in known if path not in onDisk]
+    counts = {'read': 0, 'skipped': len(onDisk) - len(todo), 'removed': len(gone), 'failed': 0}
+
+    with db:
+        for path in gone:
+            db.execute('DELETE FROM frames WHERE path = ?', (path,))
+            db.execute('DELETE FROM calibrations WHERE path = ?', (path,))
+
+    if not todo:
+        return counts
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        with db:
+            for result in pool.imap_unordered(read_entry, todo, chunksize=16):
+                if isinstance(result, dict):
+                    _store(db, result)
+                    counts['read'] += 1
+                else:
+                    # don't leave a stale row for a file that has changed.
+                    db.execute('DELETE FROM frames WHERE path = ?', (result[0],))
+                    db.execute('DELETE FROM calibrations WHERE path = ?', (result[0],))
+                    counts['failed'] += 1
+                    if log:
+                        log('could not read %s: %s' % result)
+    finally:
+        pool.close()
+        pool.join()
+    return counts
@@ -0,0 +1,141 @@
+"""
+Centroids, FWHM and flux of guide stars at known positions.
+
+Every star gets a window x window cutout (taken all at once, by fancy
+indexing), and all the cutouts are measured together as one array: the
+background is the median of the window's border, the flux is the sum of
+the window above it, and the star is the pixels more than detectSigma times
+the border's scatter above it. Those give first and second moments, and a circular Gaussian fitted by weighted
+linear least squares to the log of the pixels (one batched 4x4 solve for all
+the stars). The Gaussian's centre and FWHM are used where the fit is good,
+else the moments'.
+
+Positions are the 0-based column (x) and row (y) of the frame as written.
+"""
+
+import collections
+import warnings
+
+import numpy as np
+
+from gcameraICC.imageStats import MAD_SIGMA
+
+# Gaussian FWHM/sigma
+FWHM_SIGMA = 2.0*np.sqrt(2.0*np.log(2.0))
+
+Centroid = collections.namedtuple('Centroid', ('x', 'y', 'fwhm', 'flux', 'peak', 'background', 'method'))
+
+
+def cutouts(data, xs, ys, window):
+    """
+    Return the window x window cutouts of data around each (xs, ys), as an
+    (n, window, window) array, and the column and row of their corners.
+    Windows that would run off the frame are moved onto it.
+    """
+    if data.shape[0] < window or data.shape[1] < window:
+        raise ValueError('a %dx%d frame is smaller than the %d pixel window' % (data.shape + (window,)))
+    half = window//2
+    x0 = np.clip(np.round(xs).astype(int) - half, 0, data.shape[1] - window)
+    y0 = np.clip(np.round(ys).astype(int) - half, 0, data.shape[0] - window)
+    rows = y0[:, None] + np.arange(window)
+    cols = x0[:, None] + np.arange(window)
+    return data[rows[:, :, None], cols[:, None, :]], x0, y0
+
+
+def _border(window):
+    border = np.zeros((window, window), dtype=bool)
+    border[0, :] = border[-1, :] = border[:, 0] = border[:, -1] = True
+    return border
+
+
+def measure(data, positions, window=15, detectSigma=3., bad=None):
+    """
+    Return a Centroid for each (x, y) of positions.
+
+    Args:
+        data (ndarray): the frame.
+        positions: a sequence of (x, y).
+
+    Kwargs:
+        window (int): the side of the window around each position.
+        detectSigma (float): pixels this many sigma above the background are the star.
+        bad (ndarray): boolean frame of pixels to ignore (e.g. badPixels.BadPixelMask.bad()).
+
+    A window with no star has NaN for all but its background, and method 'none'.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    if not len(positions):
+        return []
+    stamps, x0, y0 = cutouts(data, positions[:, 0], positions[:, 1], window)
+    stamps = stamps.astype(np.float64)
+    good = np.ones(stamps.shape, dtype=bool)
+    if bad is not None:
+        good = ~cutouts(bad, positions[:, 0], positions[:, 1], window)[0]
+
+    # background and its scatter from the border pixels.
+    border = np.where(good[:, _border(window)], stamps[:, _border(window)], np.nan)
+    with warnings.catch_warnings():
+        # a border with no good pixels gives nan, and a warning.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        background = np.nanmedian(border, axis=1)
+        noise = MAD_SIGMA*np.nanmedian(np.abs(border - background[:, None]), axis=1)
+    background = np.nan_to_num(background)
+    noise = np.maximum(np.nan_to_num(noise), 1.)
+
+    image = (stamps - background[:, None, None])*good
+    star = image > detectSigma*noise[:, None, None]
+    weight = np.where(star, image, 0.)
+    npix = star.sum(axis=(1, 2))
+    starFlux = weight.sum(axis=(1, 2))
+    flux = image.sum(axis=(1, 2))
+    peak = image.max(axis=(1, 2))
+    found = npix >= 3
+    safeFlux = np.where(found, starFlux, 1.)
+
+    # moments, in window coordinates.
+    gy, gx = np.mgrid[:window, :window].astype(np.float64)
+    xm = (weight*gx).sum(axis=(1, 2))/safeFlux
+    ym = (weight*gy).sum(axis=(1, 2))/safeFlux
+    dx = gx - xm[:, None, None]
+    dy = gy - ym[:, None, None]
+    mrr = (weight*(dx**2 + dy**2)).sum(axis=(1, 2))/safeFlux/2.
+    fwhm = FWHM_SIGMA*np.sqrt(np.maximum(mrr, 0.))
+
+    # Gaussian: ln I = a + b x + c y + d (x^2 + y^2), weighted by I^2, about the moment centre.
+    logImage = np.log(np.where(star, image, 1.))
+    w = np.where(star, image**2, 0.)
+    basis = np.array([np.ones_like(dx), dx, dy, dx**2 + dy**2])        # (4, n, window, window)
+    normal = np.einsum('inyx,jnyx,nyx->nij', basis, basis, w)
+    rhs = np.einsum('inyx,nyx->ni', basis, w*logImage)
+    fittable = found & (npix >= 5)
+    normal[~fittable] = np.eye(4)
+    rhs[~fittable] = 0.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fittable &= np.linalg.cond(normal) < 1e12
+    normal[~fittable] = np.eye(4)
+    a, b, c, d = np.linalg.solve(normal, rhs).T
+
+    fitted = fittable & (d < 0)
+    safeD = np.where(fitted, d, -1.)
+    sigma2 = -1./(2.*safeD)
+    xg = xm + b*sigma2
+    yg = ym + c*sigma2
+    fitted &= (np.abs(xg - xm) < window/4.) & (np.abs(yg - ym) < window/4.) & (sigma2 < window**2)
+
+    x = np.where(fitted, xg, xm) + x0
+    y = np.where(fitted, yg, ym) + y0
+    fwhm = np.where(fitted, FWHM_SIGMA*np.sqrt(sigma2), fwhm)
+
+    results = []
+    for i in range(len(positions)):
+        if not found[i]:
+            results.append(Centroid(np.nan, np.nan, np.nan, np.nan, np.nan, background[i], 'none'))
+        else:
+            results.append(Centroid(x[i], y[i], fwhm[i], flux[i], peak[i], background[i],
+                                    'gauss' if fitted[i] else 'moment'))
+    return results
+
+
+def format_centroid(index, centroid):
+    """Return the centroid keyword for star number index."""
+    return 'centroid=%d,%0.3f,%0.3f,%0.3f,%0.1f,%0.1f,%0.1f,%s' % ((index,) + tuple(centroid))
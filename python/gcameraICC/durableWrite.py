@@ -0,0 +1,181 @@
+"""
+Crash-safe writing of frames and calibration notes.
+
+Every file is written under a temporary name in its final directory, then
+renamed into place, so a crash never leaves a truncated gimg-NNNN.fits.gz
+(the temporary names start with '.', so genNextRealPath never sees them).
+
+How hard we push the data to disk is the fsync policy:
+    none:  leave it to the OS (the rename is still atomic).
+    frame: fsync each file before renaming it, and its directory after.
+    batch: fsync the files written so far every batchFrames files, or
+           batchSeconds after the first unsynced one, whichever comes first.
+"""
+
+import collections
+import gzip
+import os
+import threading
+import time
+
+import numpy as np
+
+policies = ('none', 'frame', 'batch')
+
+
+def _fsync(f):
+    """fsync an open file."""
+    os.fsync(f.fileno())
+
+
+def fsync_path(path):
+    """fsync a file or directory by name."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurableWriter(object):
+    """Write files atomically, with a configurable fsync policy, and time the writes."""
+
+    def __init__(self, policy='none', batchFrames=10, batchSeconds=5., nLatencies=1000):
+        """
+        Kwargs:
+            policy (str): one of policies.
+            batchFrames (int): with 'batch', sync after this many files...
+            batchSeconds (float): ... or this long after the first unsynced one.
+            nLatencies (int): number of recent write times kept for latency().
+        """
+        if policy not in policies:
+            raise ValueError('unknown fsync policy %r: must be one of %s' % (policy, policies))
+        self.policy = policy
+        self.batchFrames = batchFrames
+        self.batchSeconds = batchSeconds
+
+        self.latencies = collections.deque(maxlen=nLatencies)
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _tempname(self, path):
+        directory, basename = os.path.split(path)
+        return os.path.join(directory, '.%s.%d.tmp' % (basename, os.getpid()))
+
+    def _commit(self, f, tempname, path, mode=None):
+        """Sync (per the policy) and close f, then set its mode and rename it into place."""
+        f.flush()
+        if self.policy == 'frame':
+            _fsync(f)
+        f.close()
+        if mode is not None:
+            os.chmod(tempname, mode)
+        os.rename(tempname, path)
+        if self.policy == 'frame':
+            fsync_path(os.path.dirname(path) or '.')
+        elif self.policy == 'batch':
+            self._add_pending(path)
+
+    def _write(self, path, writeFunc, compress=False, mode=None):
+        start = time.time()
+        tempname = self._tempname(path)
+        f = open(tempname, 'wb')
+        try:
+            if compress:
+                gz = gzip.GzipFile(filename=os.path.basename(path)[:-3], mode='wb', fileobj=f)
+                writeFunc(gz)
+                gz.close()
+            else:
+                writeFunc(f)
+            self._commit(f, tempname, path, mode=mode)
+        except:
+            f.close()
+            if os.path.exists(tempname):
+                os.remove(tempname)
+            raise
+        self.latencies.append(time.time() - start)
+
+    def write_fits(self, hdus, path, compress=False, checksum=True, mode=0444):
+        """
+        Write an HDU or HDUList to path atomically.
+
+        Like actorcore.utility.fits.writeFits, which this replaces, it adds
+        the CHECKSUM/DATASUM cards and leaves the file read-only by default.
+
+        Args:
+            hdus (HDU or HDUList): what to write.
+            path (str): the final filename (ending in .gz if compress).
+
+        Kwargs:
+            compress (bool): gzip the file.
+            checksum (bool): add CHECKSUM and DATASUM cards to each HDU.
+            mode (int): permissions of the file, or None to leave them to the umask.
+        """
+        self._write(path, lambda f: hdus.writeto(f, checksum=checksum), compress=compress, mode=mode)
+
+    def write_text(self, path, text):
+        """Write text to path atomically."""
+        self._write(path, lambda f: f.write(text))
+
+    def append_text(self, path, text, header=''):
+        """
+        Append text to path (starting it with header if it is new), in one
+        O_APPEND write, synced per the policy.
+        """
+        isNew = not os.path.exists(path)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0664)
+        try:
+            os.write(fd, (header if isNew else '') + text)
+            if self.policy == 'frame':
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        if self.policy == 'frame' and isNew:
+            fsync_path(os.path.dirname(path) or '.')
+        elif self.policy == 'batch':
+            self._add_pending(path)
+
+    def _add_pending(self, path):
+        with self._lock:
+            self._pending.append(path)
+            due = len(self._pending) >= self.batchFrames
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.batchSeconds, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.sync()
+
+    def sync(self):
+        """fsync everything written but not yet synced, and their directories."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        directories = set()
+        for path in pending:
+            try:
+                fsync_path(path)
+            except OSError:
+                # it may have been removed already; nothing left to sync.
+                continue
+            directories.add(os.path.dirname(path) or '.')
+        for directory in directories:
+            fsync_path(directory)
+
+    def latency(self):
+        """Return (n, p50, p90, p99, max) of the recent write times, in seconds, or None."""
+        if not self.latencies:
+            return None
+        times = np.array(self.latencies)
+        p50, p90, p99 = np.percentile(times, (50, 90, 99))
+        return len(times), p50, p90, p99, times.max()
+
+    def format_latency(self):
+        """Return the writeLatency keyword."""
+        latency = self.latency()
+        if latency is None:
+            return 'writeLatency="%s",0,0,0,0,0' % (self.policy)
+        return 'writeLatency="%s",%d,%0.4f,%0.4f,%0.4f,%0.4f' % ((self.policy,) + latency)
@@ -0,0 +1,212 @@
+"""
+A shared-memory ring of the last few frames, for consumers on the same host.
+
+The ring is a file in /dev/shm (POSIX shared memory on Linux), mapped by the
+ICC and by any local reader. It holds nslots slots, each with a small header,
+the frame's metadata as JSON, and the raw uint16 pixels; the ring header
+counts the frames written, so frame N is in slot N % nslots.
+
+Each slot is guarded by a sequence lock: the writer makes the slot's seq odd
+before it touches the slot and even again when it is done. A reader that sees
+the same even seq before and after looking at a slot knows what it saw was
+consistent, and never blocks the writer.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+MAGIC = 'GFRING01'
+
+ringHeaderDtype = np.dtype([('magic', 'S8'), ('nslots', '<i4'), ('metaBytes', '<i4'),
+                            ('dataBytes', '<i8'), ('written', '<i8')])
+slotHeaderDtype = np.dtype([('seq', '<u8'), ('count', '<i8'), ('seqno', '<i4'),
+                            ('nrows', '<i4'), ('ncols', '<i4'), ('metaLen', '<i4'),
+                            ('time', '<f8')])
+HEADER_SIZE = 64 # bytes reserved for the ring header and for each slot header.
+PAGE = 4096 # slots start on page boundaries.
+
+
+def jsonable(value):
+    """json.dumps default= for numpy scalars."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+class TornRead(Exception):
+    """The slot was rewritten while we read it."""
+    pass
+
+
+def ring_path(name, directory='/dev/shm'):
+    """Return the shared memory file for the ring called name."""
+    return os.path.join(directory, '%s-frames' % (name))
+
+
+class FrameRing(object):
+    """The last nslots frames and their metadata, in a shared memory file."""
+
+    def __init__(self, filename, nslots=4, dataBytes=4*1024**2, metaBytes=4096, create=True):
+        """
+        Open the ring in filename.
+
+        Args:
+            filename (str): the shared memory file (see ring_path()).
+
+        Kwargs:
+            nslots (int): number of frames kept.
+            dataBytes (int): largest frame, in bytes.
+            metaBytes (int): room for each frame's JSON metadata.
+            create (bool): (re)create the ring if it doesn't exist or has a
+                different layout (the writer). Readers pass False, and get the
+                layout from the file.
+        """
+        self.filename = filename
+        if create:
+            self.nslots, self.dataBytes, self.metaBytes = int(nslots), int(dataBytes), int(metaBytes)
+            if not self._valid():
+                self._create()
+            mode = 'r+'
+        else:
+            header = np.fromfile(filename, dtype=ringHeaderDtype, count=1)[0]
+            if header['magic'] != MAGIC:
+                raise IOError('%s is not a frame ring' % (filename))
+            self.nslots, self.dataBytes, self.metaBytes = (int(header['nslots']), int(header['dataBytes']),
+                                                           int(header['metaBytes']))
+            mode = 'r'
+
+        self._buf = np.memmap(filename, dtype=np.uint8, mode=mode, shape=(self._size(),))
+        self.header = self._buf[:ringHeaderDtype.itemsize].view(ringHeaderDtype)
+        self.slots = [self._buf[self._offset(i):self._offset(i)+slotHeaderDtype.itemsize].view(slotHeaderDtype)
+                      for i in range(self.nslots)]
+
+    def _stride(self):
+        stride = HEADER_SIZE + self.metaBytes + self.dataBytes
+        return (stride + PAGE - 1)//PAGE*PAGE
+
+    def _offset(self, slot):
+        return PAGE + slot*self._stride()
+
+    def _size(self):
+        return PAGE + self.nslots*self._stride()
+
+    def _valid(self):
+        """True if filename already holds a ring with our layout."""
+        if not os.path.isfile(self.filename) or os.path.getsize(self.filename) != self._size():
+            return False
+        header = np.fromfile(self.filename, dtype=ringHeaderDtype, count=1)[0]
+        return (header['magic'] == MAGIC and header['nslots'] == self.nslots and
+                header['dataBytes'] == self.dataBytes and header['metaBytes'] == self.metaBytes)
+
+    def _create(self):
+        """Write a new, empty, ring file, replacing any old one atomically."""
+        tempname = self.filename + '.tmp'
+        with open(tempname, 'wb') as f:
+            header = np.zeros(1, dtype=ringHeaderDtype)
+            header['magic'] = MAGIC
+            header['nslots'] = self.nslots
+            header['metaBytes'] = self.metaBytes
+            header['dataBytes'] = self.dataBytes
+            f.write(header.tostring())
+            f.truncate(self._size())
+        os.rename(tempname, self.filename)
+
+    def close(self):
+        del self.slots
+        del self.header
+        del self._buf
+
+    @property
+    def written(self):
+        """Number of frames published so far."""
+        return int(self.header['written'][0])
+
+    def _meta(self, slot):
+        start = self._offset(slot) + HEADER_SIZE
+        return self._buf[start:start+self.metaBytes]
+
+    def _data(self, slot, nrows, ncols):
+        start = self._offset(slot) + HEADER_SIZE + self.metaBytes
+        return self._buf[start:start+nrows*ncols*2].view('<u2').reshape(nrows, ncols)
+
+    def publish(self, data, meta, seqno=0):
+        """
+        Copy a frame and its metadata into the next slot, and return the slot.
+
+        Args:
+            data (ndarray): the uint16 frame.
+            meta (dict): JSON-able metadata.
+
+        Kwargs:
+            seqno (int): the frame's sequence number.
+        """
+        data = np.asarray(data, dtype='<u2')
+        metaJson = json.dumps(meta, default=jsonable)
+        if data.nbytes > self.dataBytes:
+            raise ValueError('frame is %d bytes, but ring slots hold %d' % (data.nbytes, self.dataBytes))
+        if len(metaJson) > self.metaBytes:
+            raise ValueError('frame metadata is %d bytes, but ring slots hold %d' % (len(metaJson), self.metaBytes))
+
+        count = self.written
+        slot = count % self.nslots
+        header = self.slots[slot]
+        seq = header['seq'][0]
+        header['seq'] = seq + 1 # odd: being written.
+
+        self._meta(slot)[:len(metaJson)] = np.frombuffer(metaJson, dtype=np.uint8)
+        self._data(slot, *data.shape)[:] = data
+        header['count'] = count
+        header['seqno'] = seqno
+        header['nrows'], header['ncols'] = data.shape
+        header['metaLen'] = len(metaJson)
+        header['time'] = time.time()
+
+        header['seq'] = seq + 2
+        self.header['written'] = count + 1
+        return slot
+
+    def latest(self):
+        """Return the slot of the most recent frame, or None if there is none."""
+        written = self.written
+        if written == 0:
+            return None
+        return (written - 1) % self.nslots
+
+    def view(self, slot):
+        """
+        Return (data, meta, seq) for slot without copying the pixels.
+
+        data is a read-only view into shared memory: it stays consistent only
+        as long as still_valid(slot, seq) is True, so check that after using it.
+        Raises TornRead if the slot is being written.
+        """
+        header = self.slots[slot]
+        seq = header['seq'][0]
+        if seq % 2 or seq == 0:
+            raise TornRead('slot %d is empty or being written' % (slot))
+        nrows, ncols, metaLen = int(header['nrows'][0]), int(header['ncols'][0]), int(header['metaLen'][0])
+        meta = json.loads(self._meta(slot)[:metaLen].tostring())
+        data = self._data(slot, nrows, ncols)
+        if not self.still_valid(slot, seq):
+            raise TornRead('slot %d was rewritten while we read it' % (slot))
+        return data, meta, seq
+
+    def still_valid(self, slot, seq):
+        """True if slot hasn't been rewritten since view() returned seq."""
+        return self.slots[slot]['seq'][0] == seq
+
+    def read(self, slot, retries=3):
+        """Return a consistent copy (data, meta) of slot, retrying a torn read a few times."""
+        for i in range(retries + 1):
+            try:
+                data, meta, seq = self.view(slot)
+                data = data.copy()
+                if self.still_valid(slot, seq):
+                    return data, meta
+            except TornRead:
+                pass
+            time.sleep(0.001)
+        raise TornRead('could not get a consistent copy of slot %d' % (slot))
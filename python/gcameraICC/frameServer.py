@@ -0,0 +1,144 @@
+"""
+Stream each new frame to TCP subscribers.
+
+Every frame is sent as one message: a fixed little-endian header (see
+HEADER), the frame's metadata as JSON, then the raw uint16 pixels, row by row.
+
+Each subscriber has its own short queue. The transport tells the subscriber
+(as its push producer) when its send buffer is full; frames that arrive
+meanwhile wait in the queue, and the oldest are dropped when it overflows, so
+a slow client can never hold up the ICC or the other subscribers.
+"""
+
+import collections
+import json
+import struct
+
+import numpy as np
+
+from twisted.internet import protocol
+from zope.interface import implementer
+from twisted.internet.interfaces import IPushProducer
+
+from gcameraICC.frameRing import jsonable
+
+MAGIC = 'GFRM'
+VERSION = 1
+# magic, version, reserved, metadata length, nrows, ncols, payload length
+HEADER = struct.Struct('<4sHHIIIQ')
+
+
+def encode_frame(data, meta):
+    """Return the (header, metadata, payload) strings of the message for one frame."""
+    data = np.ascontiguousarray(data, dtype='<u2')
+    metaJson = json.dumps(meta, default=jsonable)
+    nrows, ncols = data.shape
+    payload = data.tostring()
+    header = HEADER.pack(MAGIC, VERSION, 0, len(metaJson), nrows, ncols, len(payload))
+    return header, metaJson, payload
+
+
+@implementer(IPushProducer)
+class FrameSubscriber(protocol.Protocol):
+    """One connected client, with its own queue of frames waiting to be sent."""
+
+    def connectionMade(self):
+        self.queue = collections.deque(maxlen=self.factory.maxQueue)
+        self.paused = False
+        self.sent = 0
+        self.dropped = 0
+        self.transport.registerProducer(self, True)
+        self.factory.subscribers.append(self)
+
+    def connectionLost(self, reason):
+        if self in self.factory.subscribers:
+            self.factory.subscribers.remove(self)
+
+    def dataReceived(self, data):
+        # subscribers have nothing to say to us.
+        pass
+
+    def enqueue(self, message):
+        """Queue message, dropping the oldest queued one if we're full, and send what we can."""
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        self._send()
+
+    def _send(self):
+        while self.queue and not self.paused:
+            self.transport.writeSequence(self.queue.popleft())
+            self.sent += 1
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self._send()
+
+    def stopProducing(self):
+        self.queue.clear()
+
+
+class FrameServerFactory(protocol.ServerFactory):
+    """Accept subscribers and send each broadcast frame to all of them."""
+
+    protocol = FrameSubscriber
+
+    def __init__(self, maxQueue=2):
+        """
+        Kwargs:
+            maxQueue (int): frames each subscriber may have waiting before
+                the oldest are dropped.
+        """
+        self.maxQueue = maxQueue
+        self.subscribers = []
+
+    def broadcast(self, data, meta):
+        """Send a frame to every subscriber (call from the reactor thread)."""
+        if not self.subscribers:
+            return
+        # the pixels are converted once, and the same strings queued for everybody.
+        message = encode_frame(data, meta)
+        for subscriber in list(self.subscribers):
+            subscriber.enqueue(message)
+
+
+class FrameReceiver(protocol.Protocol):
+    """A client for the frame server: override frameReceived()."""
+
+    def connectionMade(self):
+        self._buffer = []
+        self._buffered = 0
+        self._header = None
+
+    def dataReceived(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        while True:
+            if self._header is None:
+                if self._buffered < HEADER.size:
+                    return
+                self._header = HEADER.unpack(self._take(HEADER.size))
+                if self._header[0] != MAGIC:
+                    self.transport.loseConnection()
+                    return
+            magic, version, reserved, metaLen, nrows, ncols, payloadLen = self._header
+            if self._buffered < metaLen + payloadLen:
+                return
+            meta = json.loads(self._take(metaLen))
+            data = np.frombuffer(self._take(payloadLen), dtype='<u2').reshape(nrows, ncols)
+            self._header = None
+            self.frameReceived(data, meta)
+
+    def _take(self, n):
+        """Remove and return the first n buffered bytes."""
+        joined = ''.join(self._buffer)
+        self._buffer = [joined[n:]]
+        self._buffered -= n
+        return joined[:n]
+
+    def frameReceived(self, data, meta):
+        """Called with each frame (a read-only uint16 array) and its metadata."""
+        pass
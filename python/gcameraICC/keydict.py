@@ -1,4 +1,4 @@
-KeysDictionary('gcamera',(0, 1),
+KeysDictionary('gcamera',(0, 2),
                Key("text", String(help="text for humans")),
                Key("simulating", 
                    Enum('On', 'Off', help="Are we reading simulated/historical data, or taking new images?"),
@@ -9,6 +9,88 @@ KeysDictionary('gcamera',(0, 1),
                    Float(help="remaining time for this state (sec; 0 if none, short or unknown)"),
                    Float(help="total time for this state (sec; 0 if none, short or unknown)")),
                Key("filename", 
-                   String(help='last read file'))
+                   String(help='last read file'),
+                   Int(help='shared memory frame ring slot holding the frame, or -1 if it is not in the ring; '
+                            'only sent if the frame ring is on')*(0, 1)),
+               Key("coolerHistory",
+                   Float(help="start of the history bin (Unix time)"),
+                   Int(help="number of cooler samples in the bin"),
+                   Float(help="minimum CCD temperature (degC)"),
+                   Float(help="mean CCD temperature (degC)"),
+                   Float(help="maximum CCD temperature (degC)"),
+                   Float(help="minimum heatsink temperature (degC)"),
+                   Float(help="mean heatsink temperature (degC)"),
+                   Float(help="maximum heatsink temperature (degC)"),
+                   Float(help="minimum cooler drive (percent)"),
+                   Float(help="mean cooler drive (percent)"),
+                   Float(help="maximum cooler drive (percent)"),
+                   Float(help="last cooler setpoint in the bin (degC)"),
+                   Float(help="last fan setting in the bin"),
+                   String(help="last cooler status in the bin")),
+               Key("shutdownState",
+                   Enum('warming', 'done', 'aborted', 'failed', help="state of the camera shutdown"),
+                   Float(help="CCD temperature (degC)"),
+                   Float(help="temperature the CCD must reach before the camera is turned off (degC)")),
+               Key("calibratedFile",
+                   String(help="calibrated copy of the last guide frame")),
+               Key("biasLevel",
+                   Float(help="median overscan level of the last frame (ADU)"),
+                   Float(help="scatter of the per-row overscan level (ADU)")),
+               Key("imageStats",
+                   Float(help="median of the last frame (ADU)"),
+                   Float(help="robust (MAD) sigma of the last frame (ADU)"),
+                   Float(help="99.9th percentile of the last frame (ADU)"),
+                   Int(help="number of saturated pixels in the last frame"),
+                   Int(help="minimum pixel value of the last frame"),
+                   Int(help="maximum pixel value of the last frame")),
+               Key("preview",
+                   String(help="quick-look preview of the last frame")),
+               Key("writeLatency",
+                   Enum('none', 'frame', 'batch', help="fsync policy for frame writes"),
+                   Int(help="number of recent writes timed"),
+                   Float(help="median write time (sec)"),
+                   Float(help="90th percentile write time (sec)"),
+                   Float(help="99th percentile write time (sec)"),
+                   Float(help="longest write time (sec)")),
+               Key("ptcLevel",
+                   Float(help="flat exposure time (sec)"),
+                   Float(help="median bias-subtracted signal (ADU)"),
+                   Float(help="median variance of the flat pair (ADU^2)")),
+               Key("detector",
+                   Float(help="gain (e-/ADU)"),
+                   Float(help="read noise (ADU)"),
+                   Float(help="read noise (e-)"),
+                   Float(help="full well (ADU): the signal where the variance turns over"),
+                   Bool('False', 'True', help="was the full well reached? If not, it is the highest signal measured"),
+                   Float(help="largest fractional deviation from a linear response, below 70% of the full well")),
+               Key("badPixelMask",
+                   String(help="bad pixel mask file"),
+                   Int(help="number of bad pixels"),
+                   Int(help="number of hot pixels"),
+                   Int(help="number of dead pixels"),
+                   Int(help="number of bad columns")),
+               Key("centroidStars",
+                   Int(help="number of guide stars centroided after each exposure"),
+                   Int(help="side of the window measured around each star (pixels)")),
+               Key("centroid",
+                   Int(help="index of the star in the centroidStars list"),
+                   Float(help="0-based column of the centroid"),
+                   Float(help="0-based row of the centroid"),
+                   Float(help="FWHM (pixels)"),
+                   Float(help="background-subtracted flux in the window (ADU)"),
+                   Float(help="background-subtracted peak (ADU)"),
+                   Float(help="background level (ADU)"),
+                   Enum('gauss', 'moment', 'none', help="how the centroid was measured: 'none' if no star was found")),
+               Key("seeing",
+                   Int(help="number of sources measured in the last exposure"),
+                   Float(help="median source FWHM (pixels)"),
+                   Float(help="median source ellipticity (1 - b/a)"),
+                   Float(help="time taken to measure them (sec)")),
+               Key("startupTimes",
+                   Float(help="seconds from process start to the actor being created; -1 if not yet"),
+                   Float(help="... to the command sets being loaded"),
+                   Float(help="... to the actor being configured"),
+                   Float(help="... to the hub link being up"),
+                   Float(help="... to the camera being connected"))
                )
                        
@@ -0,0 +1,77 @@
+"""
+A per-night manifest of the frames written, one fixed-schema line per frame.
+
+The manifest lives next to the frames, as manifest-MJD.tsv: a header line
+naming the columns, then one tab-separated line per frame, appended as each
+frame is written. Tools can scan it instead of globbing the directory and
+opening every FITS header. Files that don't apply (e.g. a bias's dark) are '-'.
+"""
+
+import collections
+import os
+
+# column name, and how to format it.
+columns = (('seqno', '%d'), ('type', '%s'), ('exptime', '%.3f'), ('stack', '%d'),
+           ('ccdTemp', '%.2f'), ('binx', '%d'), ('biny', '%d'),
+           ('biasFile', '%s'), ('darkFile', '%s'), ('flatFile', '%s'), ('flatCartridge', '%d'),
+           ('writeTime', '%.3f'), ('size', '%d'), ('compression', '%s'))
+names = tuple(name for name, fmt in columns)
+_converters = {'%d': int, '%s': str, '%.3f': float, '%.2f': float}
+
+Entry = collections.namedtuple('Entry', names)
+
+
+def manifest_path(dirname):
+    """Return the manifest of the night directory dirname (named by its MJD)."""
+    return os.path.join(dirname, 'manifest-%s.tsv' % (os.path.basename(os.path.normpath(dirname))))
+
+
+def header_line():
+    return '#' + '\t'.join(names) + '\n'
+
+
+def format_entry(**values):
+    """Return the manifest line for a frame; every column must be given."""
+    fields = []
+    for name, fmt in columns:
+        value = values[name]
+        fields.append('-' if value is None or value == '' else fmt % (value,))
+    return '\t'.join(fields) + '\n'
+
+
+def parse_line(line):
+    """Return the Entry for one manifest line."""
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != len(columns):
+        raise ValueError('manifest line has %d columns, not %d: %r' % (len(fields), len(columns), line))
+    values = []
+    for field, (name, fmt) in zip(fields, columns):
+        values.append(None if field == '-' else _converters[fmt](field))
+    return Entry(*values)
+
+
+def read(path):
+    """Return the list of Entries in the manifest at path ([] if there is none)."""
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            entries.append(parse_line(line))
+    return entries
+
+
+def latest_calibrations(entries, forSeqno):
+    """
+    Return the latest bias, dark, and flat Entries before forSeqno, as a
+    dict keyed by type (missing types are None), as findBiasAndDarkAndFlat does
+    from the calibration notes.
+    """
+    latest = {'bias': None, 'dark': None, 'flat': None}
+    for entry in entries:
+        if entry.type in latest and entry.seqno < forSeqno:
+            if latest[entry.type] is None or entry.seqno > latest[entry.type].seqno:
+                latest[entry.type] = entry
+    return latest
@@ -0,0 +1,182 @@
+"""
+Combine raw bias or dark frames into a master calibration frame.
+
+The frames are combined tile by tile (a band of rows at a time), with an
+iterative sigma-clipped mean, in a pool of worker processes. Only one tile of
+every frame is in memory in each worker, so the memory used is bounded no
+matter how many frames go in. Gzipped frames are first decompressed once each
+to a scratch directory, since reading a tile of a gzipped file decompresses
+everything before it.
+
+The actor runs the combination in a fresh interpreter (combine_subprocess),
+because forking a pool from a process that already has other threads can
+deadlock the workers on locks those threads held.
+"""
+
+import argparse
+import contextlib
+import gzip
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import warnings
+
+import numpy as np
+
+import pyfits
+
+
+def sigma_clip_mean(cube, nsigma=3., maxiter=5):
+    """
+    Return the mean along axis 0 of cube, iteratively rejecting values more
+    than nsigma standard deviations from the median.
+
+    Pixels where everything would be rejected get the plain median.
+    """
+    cube = np.asarray(cube, dtype=np.float32)
+    work = cube.copy()
+    for i in range(maxiter):
+        center = np.nanmedian(work, axis=0)
+        std = np.nanstd(work, axis=0)
+        reject = np.abs(cube - center) > nsigma*std
+        nextWork = np.where(reject, np.nan, cube)
+        if np.array_equal(np.isnan(nextWork), np.isnan(work)):
+            break
+        work = nextWork
+
+    with warnings.catch_warnings():
+        # all-rejected pixels give nan (and a RuntimeWarning) here.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(work, axis=0)
+    empty = np.isnan(mean)
+    if empty.any():
+        mean[empty] = np.median(cube, axis=0)[empty]
+    return mean
+
+
+def read_rows(path, row0, row1):
+    """Read rows row0:row1 of the primary HDU of path, without reading the rest."""
+    hdulist = pyfits.open(path)
+    try:
+        return np.array(hdulist[0].section[row0:row1], dtype=np.float32)
+    finally:
+        hdulist.close()
+
+
+def decompress(path, directory):
+    """Return an uncompressed copy of path in directory, or path itself if it isn't gzipped."""
+    if not path.endswith('.gz'):
+        return path
+    output = os.path.join(directory, os.path.basename(path)[:-3])
+    with contextlib.closing(gzip.open(path, 'rb')) as src:
+        with open(output, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024**2)
+    return output
+
+
+def _decompress(args):
+    """Decompress one frame into its own scratch subdirectory. Runs in a worker process."""
+    i, path, directory = args
+    directory = os.path.join(directory, '%d' % (i))
+    os.mkdir(directory)
+    return decompress(path, directory)
+
+
+def _combine_tile(args):
+    """Combine one band of rows from all the frames. Runs in a worker process."""
+    paths, row0, row1, ncols, nsigma, maxiter = args
+    cube = np.empty((len(paths), row1-row0, ncols), dtype=np.float32)
+    for i, path in enumerate(paths):
+        cube[i] = read_rows(path, row0, row1)
+    return sigma_clip_mean(cube, nsigma=nsigma, maxiter=maxiter)
+
+
+def tile_rows(nframes, shape, maxTileBytes):
+    """Return how many rows per tile keep a tile of every frame within maxTileBytes."""
+    rowBytes = nframes*shape[1]*np.dtype(np.float32).itemsize
+    return int(max(1, min(shape[0], maxTileBytes//rowBytes)))
+
+
+def combine(paths, nsigma=3., maxiter=5, processes=None, maxTileBytes=64*1024**2, scratchDir=None):
+    """
+    Sigma-clip combine the frames in paths into a float32 master frame.
+
+    Args:
+        paths (list): FITS files, all with the same shape.
+
+    Kwargs:
+        nsigma (float): rejection threshold, in standard deviations.
+        maxiter (int): maximum number of clipping iterations.
+        processes (int): size of the process pool (default: number of CPUs).
+        maxTileBytes (int): memory for one tile of every frame, per worker.
+        scratchDir (str): where gzipped frames are decompressed (default: the system temporary directory).
+    """
+    header = pyfits.getheader(paths[0])
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    for path in paths[1:]:
+        other = pyfits.getheader(path)
+        if (other['NAXIS2'], other['NAXIS1']) != shape:
+            raise ValueError('%s is %dx%d, not %dx%d like %s' % (path, other['NAXIS1'], other['NAXIS2'],
+                                                                 shape[1], shape[0], paths[0]))
+
+    nrows = tile_rows(len(paths), shape, maxTileBytes)
+    scratch = tempfile.mkdtemp(prefix='gcameraMaster-', dir=scratchDir)
+    pool = multiprocessing.Pool(processes)
+    try:
+        paths = pool.map(_decompress, [(i, path, scratch) for i, path in enumerate(paths)], chunksize=1)
+        tasks = [(paths, row0, min(row0+nrows, shape[0]), shape[1], nsigma, maxiter)
+                 for row0 in range(0, shape[0], nrows)]
+        tiles = pool.map(_combine_tile, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return np.vstack(tiles)
+
+
+def combine_subprocess(paths, shape, nsigma=3., processes=None, maxTileBytes=64*1024**2):
+    """
+    Run combine() on paths in a new interpreter, and return its float32 master
+    of shape. Safe to call from a threaded process.
+
+    Raises RuntimeError, with the last line of its error output, if it fails.
+    """
+    args = [sys.executable, '-m', 'gcameraICC.masters', '--nsigma', repr(nsigma),
+            '--processes', str(processes or 0), '--max-tile-bytes', str(maxTileBytes)] + list(paths)
+    env = os.environ.copy()
+    # find this copy of gcameraICC, however we were set up.
+    packageRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([packageRoot] + [p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    output, errors = proc.communicate()
+    if proc.returncode != 0:
+        lines = errors.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else 'combining process exited with status %d' % (proc.returncode))
+    master = np.frombuffer(output, dtype='<f4')
+    if master.size != shape[0]*shape[1]:
+        raise RuntimeError('combining process returned %d pixels, not %dx%d' % (master.size, shape[1], shape[0]))
+    return master.reshape(shape)
+
+
+def main(argv=None):
+    """Combine the frames named in argv, writing the master's raw little-endian float32 pixels to stdout."""
+    parser = argparse.ArgumentParser(description='Sigma-clip combine FITS frames into a master.')
+    parser.add_argument('paths', nargs='+', help='the frames to combine')
+    parser.add_argument('--nsigma', type=float, default=3., help='rejection threshold, in standard deviations')
+    parser.add_argument('--processes', type=int, default=0, help='worker processes (0: one per CPU)')
+    parser.add_argument('--max-tile-bytes', type=int, default=64*1024**2,
+                        help='memory for one tile of every frame, per worker')
+    args = parser.parse_args(argv)
+
+    master = combine(args.paths, nsigma=args.nsigma, processes=args.processes or None,
+                     maxTileBytes=args.max_tile_bytes)
+    sys.stdout.write(master.astype('<f4').tostring())
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
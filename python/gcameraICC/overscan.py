@@ -0,0 +1,75 @@
+"""
+Bias level tracking from the serial overscan columns.
+
+The Apogee cameras digitize ow (unbinned) overscan columns after the imaging
+columns of each row, so the last ow/binx columns of a frame hold the bias
+level. The per-row level is a trimmed mean over that strip: the lowest and
+highest few values in each row are dropped, so a cosmic ray or the first,
+sometimes bleeding, overscan column don't pull it.
+"""
+
+import numpy as np
+
+
+def overscan_width(ncols, ow, binx):
+    """Return the number of binned overscan columns in a frame ncols wide, or 0 if it has none."""
+    nover = ow // binx
+    if nover <= 0 or nover >= ncols:
+        return 0
+    return nover
+
+
+def row_levels(data, nover, trim=2):
+    """
+    Return the bias level in each row of data, from its last nover columns.
+
+    Args:
+        data (ndarray): the raw frame, overscan included.
+        nover (int): number of overscan columns.
+
+    Kwargs:
+        trim (int): values dropped from each end of every row's sorted overscan.
+    """
+    strip = np.sort(data[:, -nover:], axis=1)
+    trim = min(trim, (nover - 1)//2)
+    if trim > 0:
+        strip = strip[:, trim:-trim]
+    return strip.mean(axis=1, dtype=np.float64)
+
+
+def sections(shape, nover):
+    """Return the FITS (1-indexed, inclusive) BIASSEC and DATASEC of a frame with nover overscan columns."""
+    nrows, ncols = shape
+    biassec = '[%d:%d,1:%d]' % (ncols - nover + 1, ncols, nrows)
+    datasec = '[1:%d,1:%d]' % (ncols - nover, nrows)
+    return biassec, datasec
+
+
+def correct(data, nover, subtract=False, trim=False):
+    """
+    Measure the overscan of data, optionally removing its row structure and trimming it.
+
+    If subtract, each row has its overscan level subtracted and the frame's
+    median level added back, so the result stays uint16 and comparable with
+    uncorrected bias frames, with the row-to-row bias noise removed.
+
+    Returns:
+        (data, info): data is the corrected (and maybe trimmed) frame; info is
+            a dict of 'level' (median row level), 'sigma' (scatter of the row
+            levels), and the 'biassec' and 'datasec' of the untrimmed frame.
+    """
+    levels = row_levels(data, nover)
+    level = np.median(levels)
+    biassec, datasec = sections(data.shape, nover)
+    info = {'level': level, 'sigma': levels.std(), 'biassec': biassec, 'datasec': datasec}
+
+    if trim:
+        data = data[:, :-nover]
+    if subtract:
+        offsets = np.round(levels - level).astype(np.int32)
+        corrected = data.astype(np.int32)
+        corrected -= offsets[:, np.newaxis]
+        data = np.clip(corrected, 0, 65535).astype(data.dtype)
+    elif trim:
+        data = np.ascontiguousarray(data)
+    return data, info
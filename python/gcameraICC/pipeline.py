@@ -0,0 +1,214 @@
+"""
+Post-readout stages run in a pool of worker processes, off the actor's GIL.
+
+A frame is put in shared memory once, when it is published to the frame ring
+(see frameRing), and each stage is handed only its ring slot and frame
+count. The workers map the ring read-only and work on the frame in place;
+if the ring has moved on by the time a stage starts, or moves on while it
+runs, the stage reports that instead of a result. Each stage returns a list
+of keywords (any files it writes are announced by its keywords), which are
+sent on from the pool's result thread.
+
+Stages are named in `stages`; each is a function of (data, meta, options)
+that returns a list of keywords, where meta is the frame's ring metadata and
+options is the dict given to Pipeline.
+
+One pool of workers serves every Pipeline in the process (each actor, when
+several cameras share a process), and each worker maps the rings it is handed
+as it first needs them. The pool is forked by start_pool, which must be
+called from the main thread before any other threads start (runActors does
+this before the actors run): a child forked while another thread holds a lock
+(e.g. the logging module's) can deadlock on it.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+from gcameraICC import frameRing
+from gcameraICC import imageStats
+from gcameraICC import preview
+from gcameraICC import seeing
+
+
+def imaging(data, meta):
+    """Return the imaging section of data: without any overscan columns."""
+    nover = meta.get('overscanCols') or 0
+    return data[:, :-nover] if nover else data
+
+
+def stage_imageStats(data, meta, options):
+    stats = imageStats.frame_stats(imaging(data, meta), saturation=options.get('saturation', 65535))
+    return [imageStats.format_stats(stats)]
+
+
+def stage_seeing(data, meta, options):
+    start = time.time()
+    result = seeing.frame_seeing(imaging(data, meta), saturation=options.get('saturation', 65535),
+                                 **options.get('seeing', {}))
+    return [seeing.format_seeing(result._replace(elapsed=time.time() - start))]
+
+
+def stage_preview(data, meta, options):
+    directory, basename = os.path.split(str(meta['filename']))
+    basename = basename.split('.')[0].replace(options.get('filePrefix', 'gimg'), 'gprev', 1)
+    filename = preview.write_preview(data, os.path.join(directory, basename),
+                                     format=options.get('previewFormat', 'png'),
+                                     size=options.get('previewSize', 256))
+    return ['preview=%s' % (filename)]
+
+
+stages = {'imageStats': stage_imageStats,
+          'seeing': stage_seeing,
+          'preview': stage_preview}
+
+# in each worker process: the rings (read-only), by file.
+_rings = {}
+
+
+def worker_ring(ringFile):
+    """Return the frame ring in ringFile, mapping it the first time (in a worker process)."""
+    if ringFile not in _rings:
+        _rings[ringFile] = frameRing.FrameRing(ringFile, create=False)
+    return _rings[ringFile]
+
+
+def run_stage(args):
+    """
+    Run one stage on the frame that is number count in the ring in ringFile,
+    in its slot. Runs in a worker process.
+
+    Returns:
+        (name, count, keywords, error, elapsed): error is None if the stage ran.
+    """
+    name, ringFile, slot, count, options = args
+    start = time.time()
+    try:
+        ring = worker_ring(ringFile)
+        data, meta, seq = ring.view(slot)
+        if int(ring.slots[slot]['count'][0]) != count:
+            raise frameRing.TornRead('frame %d was overwritten before %s could run' % (count, name))
+        keywords = stages[name](data, meta, options)
+        if not ring.still_valid(slot, seq):
+            raise frameRing.TornRead('frame %d was overwritten while %s ran' % (count, name))
+        return name, count, keywords, None, time.time() - start
+    except Exception as e:
+        return name, count, [], str(e), time.time() - start
+
+
+# in the actor's process: every Pipeline made, and the pool they share.
+_pipelines = []
+_pool = None
+
+
+def start_pool():
+    """
+    Fork the worker processes for the Pipelines made so far, if there are any
+    and they aren't running yet. Returns the number of Pipelines served.
+
+    Raises RuntimeError unless called from the main thread with no other
+    threads running.
+    """
+    global _pool
+    if _pool is not None or not _pipelines:
+        return len(_pipelines) if _pool is not None else 0
+    others = [thread.name for thread in threading.enumerate() if thread is not threading.current_thread()]
+    if not isinstance(threading.current_thread(), threading._MainThread) or others:
+        raise RuntimeError('the pipeline workers must be forked from the main thread before any other '
+                           'threads start: %s running' % (', '.join(others) or threading.current_thread().name))
+    sizes = [pipe.processes for pipe in _pipelines]
+    _pool = multiprocessing.Pool(None if None in sizes else max(sizes))
+    return len(_pipelines)
+
+
+def stop_pool():
+    """Wait for the stages already queued, and stop the workers."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+
+class Pipeline(object):
+    """Run the configured stages on each published frame, in the shared process pool."""
+
+    def __init__(self, ringFile, names, inform, warn, processes=None, maxPending=8, options=None):
+        """
+        Args:
+            ringFile (str): the frame ring's shared memory file.
+            names (list): the stages to run on each frame, from stages.
+            inform (callable): called with each keyword (from the pool's result thread).
+            warn (callable): called with a message when a stage fails.
+
+        Kwargs:
+            processes (int): size of the process pool (default: number of CPUs);
+                the pool is as large as the largest asked for.
+            maxPending (int): frames arriving while this many stage runs are unfinished are skipped.
+            options (dict): passed to every stage.
+        """
+        unknown = [name for name in names if name not in stages]
+        if unknown:
+            raise ValueError('unknown pipeline stages %s: must be some of %s' % (unknown, sorted(stages)))
+        self.ringFile = ringFile
+        self.names = list(names)
+        self.inform = inform
+        self.warn = warn
+        self.processes = processes
+        self.maxPending = maxPending
+        self.options = options or {}
+        self.dropped = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        _pipelines.append(self)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    @property
+    def running(self):
+        """True if the workers have been started, so frames can be submitted."""
+        return _pool is not None
+
+    def submit(self, slot, count, names=None):
+        """
+        Queue the stages for the frame that is number count in the ring, in slot.
+        Returns False if the workers are behind and the frame was skipped.
+
+        Kwargs:
+            names (list): run only these of our stages.
+        """
+        pool = _pool
+        if pool is None:
+            raise RuntimeError('the pipeline workers have not been started')
+        names = [name for name in self.names if names is None or name in names]
+        with self._lock:
+            if self.pending + len(names) > self.maxPending:
+                self.dropped += 1
+                return False
+            self.pending += len(names)
+        for name in names:
+            pool.apply_async(run_stage, ((name, self.ringFile, slot, count, self.options),), callback=self._done)
+        return True
+
+    def _done(self, result):
+        name, count, keywords, error, elapsed = result
+        try:
+            for keyword in keywords:
+                self.inform(keyword)
+            if error is not None:
+                self.warn('pipeline stage %s failed on frame %d: %s' % (name, count, error))
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self._idle.notify_all()
+
+    def close(self):
+        """Wait for the stages already queued, and stop sending this Pipeline's frames."""
+        with self._lock:
+            while self.pending:
+                self._idle.wait()
+        if self in _pipelines:
+            _pipelines.remove(self)
@@ -0,0 +1,145 @@
+"""
+Small quick-look previews of each frame, made in a background thread.
+
+A preview is the frame block-averaged down to at most `size` pixels on a side
+and asinh-stretched into 8 bits, written as a grayscale PNG (with a small
+pure-python writer, so we need no imaging library) or as a tiny FITS file.
+"""
+
+import os
+import Queue
+import struct
+import threading
+import traceback
+import zlib
+
+import numpy as np
+
+from gcameraICC import imageStats
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+
+def bin_down(data, size):
+    """Block-average data so neither side exceeds size, cropping any leftover edge pixels."""
+    factor = int(np.ceil(max(data.shape)/float(size)))
+    if factor <= 1:
+        return np.asarray(data, dtype=np.float32)
+    ny, nx = data.shape[0]//factor, data.shape[1]//factor
+    cropped = data[:ny*factor, :nx*factor]
+    return cropped.reshape(ny, factor, nx, factor).mean(axis=(1, 3), dtype=np.float32)
+
+
+def stretch(data, low=0.5, high=99.8):
+    """
+    Return data asinh-stretched into uint8, between its low and high percentiles.
+
+    The asinh softening is a few times the robust noise, so the sky noise is
+    visible while bright stars don't saturate.
+    """
+    sample = imageStats.subsample(data).ravel()
+    vmin, vmax, median = np.percentile(sample, (low, high, 50))
+    sigma = imageStats.MAD_SIGMA*np.median(np.abs(sample - median))
+    span = vmax - vmin
+    if not span > 0:
+        return np.zeros(data.shape, dtype=np.uint8)
+    soften = max(3*sigma, span/1000.)
+
+    scaled = np.clip(data, vmin, vmax)
+    scaled -= vmin
+    scaled = np.arcsinh(scaled/soften)
+    scaled *= 255/np.arcsinh(span/soften)
+    return np.round(scaled).astype(np.uint8)
+
+
+def _png_chunk(tag, data):
+    return (struct.pack('>I', len(data)) + tag + data +
+            struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+
+def png_bytes(image):
+    """Return a 2D uint8 array as an 8-bit grayscale PNG, with row 0 at the top."""
+    height, width = image.shape
+    # every scanline starts with its filter type: 0, none.
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = image
+    return (PNG_SIGNATURE +
+            _png_chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) +
+            _png_chunk('IDAT', zlib.compress(raw.tostring(), 6)) +
+            _png_chunk('IEND', ''))
+
+
+def write_preview(data, pathname, format='png', size=256):
+    """Write a preview of data to pathname (without extension); return the full filename."""
+    binned = bin_down(data, size)
+    if format == 'fits':
+        filename = pathname + '.fits'
+        contents = None
+    else:
+        filename = pathname + '.png'
+        # FITS rows go up the image, PNG rows go down it.
+        contents = png_bytes(stretch(binned)[::-1])
+
+    # write and rename, so nobody picks up a half-written preview.
+    tempname = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + '.tmp')
+    if contents is None:
+        import pyfits
+        pyfits.PrimaryHDU(binned).writeto(tempname, clobber=True)
+    else:
+        with open(tempname, 'wb') as f:
+            f.write(contents)
+    os.rename(tempname, filename)
+    return filename
+
+
+class PreviewWriter(object):
+    """Make previews in a background thread, so exposures never wait on them."""
+
+    def __init__(self, announce, format='png', size=256, maxPending=2):
+        """
+        Args:
+            announce (callable): called with the preview keyword for each
+                preview written (from the worker thread).
+
+        Kwargs:
+            format (str): 'png' or 'fits'.
+            size (int): maximum preview size, in pixels on a side.
+            maxPending (int): frames waiting for a preview beyond this are skipped.
+        """
+        self.announce = announce
+        self.format = format
+        self.size = size
+        self.dropped = 0
+        self._queue = Queue.Queue(maxPending)
+        self._thread = None
+
+    def submit(self, data, pathname):
+        """
+        Queue a preview of data, to be written as pathname + extension.
+        Returns False if the queue was full and the frame was skipped.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='preview')
+            self._thread.daemon = True
+            self._thread.start()
+        try:
+            self._queue.put_nowait((data, pathname))
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            data, pathname = self._queue.get()
+            try:
+                filename = write_preview(data, pathname, self.format, self.size)
+                self.announce('preview=%s' % (filename))
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait for all the queued previews to be written."""
+        self._queue.join()
@@ -0,0 +1,113 @@
+"""
+Gain, read noise and full well from a photon transfer curve.
+
+Each exposure level is a pair of flats; the bias is a pair of biases. Every
+frame is cut into box x box regions, and all the regions are measured at
+once (as rows of one array): the signal is the bias-subtracted mean of the
+pair, and the variance is half the variance of their difference, which
+cancels the flat field and any fixed pattern. The medians over the regions
+give one point of the curve per level.
+
+In ADU, the variance of a level is signal/gain + readNoise**2 (gain in
+e-/ADU) until the wells start to fill, where the variance turns over: that
+signal is the full well. Only the levels below 70% of it are fitted.
+"""
+
+import collections
+import json
+import os
+
+import numpy as np
+
+# fit the transfer curve and linearity only this far up towards the full well.
+FIT_FRACTION = 0.7
+
+Level = collections.namedtuple('Level', ('exptime', 'signal', 'variance'))
+Result = collections.namedtuple('Result', ('gain', 'readNoise', 'readNoiseElectrons', 'fullWell',
+                                           'fullWellReached', 'nonlinearity', 'levels'))
+
+
+def regions(data, box):
+    """Return data cut into box x box regions, one per row (any partial regions at the edges are dropped)."""
+    ny, nx = data.shape[0]//box, data.shape[1]//box
+    if ny == 0 or nx == 0:
+        raise ValueError('a %dx%d frame has no %dx%d regions' % (data.shape + (box, box)))
+    blocks = np.asarray(data[:ny*box, :nx*box], dtype=np.float64).reshape(ny, box, nx, box)
+    return blocks.swapaxes(1, 2).reshape(ny*nx, box*box)
+
+
+def read_noise(bias1, bias2, box=32):
+    """Return the read noise (ADU): the median over regions of the rms of the bias difference, / sqrt(2)."""
+    diff = regions(bias1, box) - regions(bias2, box)
+    return np.median(diff.std(axis=1)) / np.sqrt(2)
+
+
+def pair_level(exptime, flat1, flat2, bias, box=32):
+    """Return the Level of a pair of flats, bias subtracted with the frame bias."""
+    a = regions(flat1, box) - regions(bias, box)
+    b = regions(flat2, box) - regions(bias, box)
+    signal = (a.mean(axis=1) + b.mean(axis=1))/2
+    variance = (a - b).var(axis=1)/2
+    return Level(exptime, np.median(signal), np.median(variance))
+
+
+def fit(levels, readNoise):
+    """
+    Return the Result of fitting a list of Levels, with readNoise (ADU) from the biases.
+
+    Raises ValueError if fewer than two levels are below the full well.
+    """
+    levels = sorted(levels, key=lambda level: level.signal)
+    signals = np.array([level.signal for level in levels])
+    variances = np.array([level.variance for level in levels])
+
+    turnover = int(np.argmax(variances))
+    fullWellReached = turnover < len(levels) - 1
+    fullWell = signals[turnover]
+    use = signals <= (FIT_FRACTION*fullWell if fullWellReached else fullWell)
+    if use.sum() < 2:
+        raise ValueError('only %d exposure levels below %.0f ADU: need at least 2 to fit' %
+                         (use.sum(), fullWell))
+
+    slope, intercept = np.polyfit(signals[use], variances[use], 1)
+    if slope <= 0:
+        raise ValueError('the variance does not rise with the signal: are the flats lit?')
+    gain = 1/slope
+
+    exptimes = np.array([level.exptime for level in levels])
+    nonlinearity = 0.
+    if use.sum() > 2:
+        linear = np.polyval(np.polyfit(exptimes[use], signals[use], 1), exptimes[use])
+        nonlinearity = np.max(np.abs(signals[use] - linear)/signals[use])
+
+    return Result(gain, readNoise, readNoise*gain, fullWell, fullWellReached, nonlinearity, levels)
+
+
+def format_result(result):
+    """Return the detector keyword."""
+    return 'detector=%0.3f,%0.2f,%0.2f,%0.0f,%s,%0.4f' % (result.gain, result.readNoise, result.readNoiseElectrons,
+                                                        result.fullWell, result.fullWellReached, result.nonlinearity)
+
+
+def detector_path(dataRoot, name):
+    """Return the measured detector properties file of the actor name."""
+    return os.path.join(dataRoot, '%s-detector.json' % (name))
+
+
+def dumps(result, now):
+    """Return the detector file contents for result, measured at now."""
+    return json.dumps({'gain': result.gain, 'readNoise': result.readNoise, 'fullWell': result.fullWell,
+                       'nonlinearity': result.nonlinearity, 'measured': now},
+                      sort_keys=True, indent=1) + '\n'
+
+
+def load(path):
+    """Return the measured detector properties at path as a dict, or None if there are none."""
+    try:
+        with open(path) as f:
+            detector = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(detector, dict) or 'gain' not in detector or 'readNoise' not in detector:
+        return None
+    return detector
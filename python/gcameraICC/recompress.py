@@ -0,0 +1,235 @@
+"""
+Re-encode past nights from whole-file gzip to tile-compressed FITS.
+
+Each gimg-NNNN.fits.gz becomes gimg-NNNN.fits.fz: an empty primary HDU, then
+the image as a RICE-compressed (lossless for integers) CompImageHDU, which can
+be read back a tile at a time. Any floating point extension (e.g. the
+CALIBRATED frame) is kept as an uncompressed image, so nothing is quantized.
+
+A directory is converted all-or-nothing: every file is first written to a
+hidden temporary file and verified, by reading it back and comparing the MD5
+of its pixels with the original's. Only when the whole directory verified
+are the new files renamed into place, the originals removed, and the
+BIASFILE/DARKFILE/FLATFILE cards, the bias/dark/flat notes and the manifest
+updated to the new names. Workers run at low CPU and I/O priority, and can be
+throttled to a maximum rate.
+"""
+
+import glob
+import hashlib
+import os
+import re
+import subprocess
+import time
+
+import numpy as np
+
+import pyfits
+
+from gcameraICC import durableWrite
+from gcameraICC import manifest
+
+OLD_EXT = '.fits.gz'
+NEW_EXT = '.fits.fz'
+referenceCards = ('BIASFILE', 'DARKFILE', 'FLATFILE')
+notePatterns = ('bias-*.dat', 'dark-*.dat', 'flat-*.dat')
+
+
+def new_name(path):
+    """Return the tile-compressed name of a gzipped frame."""
+    return path[:-len(OLD_EXT)] + NEW_EXT
+
+
+def temp_name(path):
+    directory, basename = os.path.split(new_name(path))
+    return os.path.join(directory, '.%s.tmp' % (basename))
+
+
+def pixel_md5(data):
+    """Return the MD5 of data's values, independent of its byte order."""
+    if data is None:
+        return None
+    return hashlib.md5(np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('>')).tostring()).hexdigest()
+
+
+class Throttle(object):
+    """Sleep as needed to keep the bytes we move below a maximum rate."""
+
+    def __init__(self, maxBytesPerSec=None):
+        self.maxBytesPerSec = maxBytesPerSec
+        self.start = time.time()
+        self.moved = 0
+
+    def __call__(self, nbytes):
+        self.moved += nbytes
+        if self.maxBytesPerSec:
+            ahead = self.moved/float(self.maxBytesPerSec) - (time.time() - self.start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+_throttle = None
+
+
+def init_worker(maxBytesPerSec=None):
+    """Pool initializer: lower our CPU and I/O priority, and set up the throttle."""
+    global _throttle
+    _throttle = Throttle(maxBytesPerSec)
+    os.nice(19)
+    try:
+        # idle I/O class: only use the disk when nobody else wants it.
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['ionice', '-c', '3', '-p', str(os.getpid())], stdout=devnull, stderr=devnull)
+    except OSError:
+        pass
+
+
+def frame_key(path):
+    """Return the night directory and file name of path, e.g. 57000/gimg-0001.fits.gz."""
+    return '/'.join(os.path.normpath(path).split(os.sep)[-2:])
+
+
+def renamed_path(path, renamed):
+    """
+    Return the new name of path if it is one of the renamed frames, else None.
+
+    renamed is a set of frame_key()s, so a reference matches whatever dataRoot it was written with.
+    """
+    if path and path.endswith(OLD_EXT) and frame_key(path) in renamed:
+        return new_name(path)
+    return None
+
+
+def rename_references(header, renamed):
+    """Point the calibration file cards of header at the new names of the renamed frames."""
+    for card in referenceCards:
+        newPath = renamed_path(header.get(card), renamed)
+        if newPath:
+            header[card] = newPath
+
+
+def convert_file(args):
+    """
+    Write the tile-compressed version of one file to its temporary name, and verify it.
+    Runs in a worker process.
+
+    Returns:
+        (path, error): error is None if the temporary file verified.
+    """
+    path, renamed = args
+    tempname = temp_name(path)
+    try:
+        original = pyfits.open(path)
+        try:
+            hdus = [pyfits.PrimaryHDU()]
+            checksums = []
+            for hdu in original:
+                data = hdu.data
+                header = hdu.header.copy()
+                rename_references(header, renamed)
+                if data is not None and data.dtype.kind in 'iu':
+                    for card in ('SIMPLE', 'EXTEND', 'XTENSION', 'PCOUNT', 'GCOUNT'):
+                        if card in header:
+                            del header[card]
+                    hdus.append(pyfits.CompImageHDU(data, header, compression_type='RICE_1'))
+                else:
+                    hdus.append(pyfits.ImageHDU(data, header))
+                checksums.append(pixel_md5(data))
+            pyfits.HDUList(hdus).writeto(tempname, clobber=True)
+        finally:
+            original.close()
+        if _throttle:
+            _throttle(os.path.getsize(path) + os.path.getsize(tempname))
+
+        new = pyfits.open(tempname)
+        try:
+            newChecksums = [pixel_md5(hdu.data) for hdu in new[1:]]
+        finally:
+            new.close()
+        if newChecksums != checksums:
+            raise ValueError('pixel checksums differ after compression')
+        return path, None
+    except Exception as e:
+        if os.path.exists(tempname):
+            os.remove(tempname)
+        return path, str(e)
+
+
+def rewrite_notes(dirname, renamed, writer):
+    """Point the bias/dark/flat notes of dirname at the renamed frames."""
+    for pattern in notePatterns:
+        for note in glob.glob(os.path.join(dirname, pattern)):
+            lines = open(note).read().splitlines()
+            changed = False
+            for i, line in enumerate(lines):
+                key, sep, value = line.partition('=')
+                newPath = renamed_path(value, renamed) if key == 'filename' else None
+                if newPath:
+                    lines[i] = 'filename=%s' % (newPath)
+                    changed = True
+            if changed:
+                writer.write_text(note, ''.join('%s\n' % (line) for line in lines))
+
+
+def rewrite_manifest(dirname, renamed, writer):
+    """Update the names, sizes and compression of the renamed frames in dirname's manifest."""
+    path = manifest.manifest_path(dirname)
+    if not os.path.exists(path):
+        return
+    night = os.path.basename(os.path.normpath(dirname))
+    lines = [manifest.header_line()]
+    for entry in manifest.read(path):
+        values = entry._asdict()
+        # the manifest's calibration files are in the same night.
+        for column in ('biasFile', 'darkFile', 'flatFile'):
+            newPath = renamed_path(os.path.join(night, values[column] or ''), renamed)
+            if newPath:
+                values[column] = os.path.basename(newPath)
+        frame = os.path.join(dirname, 'gimg-%04d%s' % (entry.seqno, OLD_EXT))
+        if frame_key(frame) in renamed:
+            values['size'] = os.path.getsize(new_name(frame))
+            values['compression'] = 'rice'
+        lines.append(manifest.format_entry(**values))
+    writer.write_text(path, ''.join(lines))
+
+
+def plan_directory(dirname):
+    """Return the gzipped gimg frames in dirname."""
+    return sorted(path for path in glob.glob(os.path.join(dirname, 'gimg-*' + OLD_EXT))
+                  if re.match(r'^gimg-\d{4}\.fits\.gz$', os.path.basename(path)))
+
+
+def recompress_directory(dirname, pool, writer=None, dryRun=False, log=None):
+    """
+    Convert all the gzipped frames in dirname, using pool (see init_worker).
+
+    Returns:
+        (number converted, list of (path, error) for the files that failed).
+        If any failed, nothing in the directory is changed.
+    """
+    writer = writer or durableWrite.DurableWriter('frame')
+    paths = plan_directory(dirname)
+    if not paths:
+        return 0, []
+
+    renamed = set(frame_key(path) for path in paths)
+    failures = [result for result in pool.imap_unordered(convert_file, [(path, renamed) for path in paths])
+                if result[1] is not None]
+
+    if failures or dryRun:
+        for path in paths:
+            if os.path.exists(temp_name(path)):
+                os.remove(temp_name(path))
+        return (0 if failures else len(paths)), failures
+
+    for path in paths:
+        durableWrite.fsync_path(temp_name(path))
+        os.rename(temp_name(path), new_name(path))
+    durableWrite.fsync_path(dirname)
+    rewrite_notes(dirname, renamed, writer)
+    rewrite_manifest(dirname, renamed, writer)
+    for path in paths:
+        os.remove(path)
+        if log:
+            log('%s -> %s' % (path, new_name(path)))
+    return len(paths), []
@@ -0,0 +1,201 @@
+"""
+Whole-frame seeing metrics: how many sources, and their median FWHM and ellipticity.
+
+Sources are found in the frame block-summed by binFactor (a 2048x2048 frame
+becomes 512x512): the binned pixels more than nsigma above a coarse
+background mesh that are also the largest of their 3x3 neighbours. The
+brightest maxSources of them are each cut out of the full-resolution frame,
+recentred on their brightest pixel, and measured all at once: the FWHM is
+the diameter of the circle with the same area as the pixels above half
+maximum, and the ellipticity (1 - b/a) comes from the flux-weighted second
+moments of the pixels above a tenth of the peak. Both are unbiased for a
+Gaussian, and cheap.
+
+The metrics are computed in a pool of worker threads (numpy releases the GIL
+for most of the work), so the exposure only waits for them if it wants their
+FITS cards before they are ready.
+"""
+
+import collections
+import multiprocessing.pool
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from gcameraICC import centroids
+from gcameraICC import imageStats
+
+# the ellipticity is measured down to this fraction of the peak: at half of
+# it, the pixel grid makes a round 2 pixel sigma star look 10% elliptical.
+ISOPHOTE = 0.1
+
+Seeing = collections.namedtuple('Seeing', ('nsources', 'fwhm', 'ellipticity', 'elapsed'))
+
+
+def block_sum(data, factor):
+    """Return data summed in factor x factor blocks, cropping any leftover edge pixels."""
+    ny, nx = data.shape[0]//factor, data.shape[1]//factor
+    return data[:ny*factor, :nx*factor].reshape(ny, factor, nx, factor).sum(axis=(1, 3), dtype=np.float32)
+
+
+def background_mesh(data, mesh=32):
+    """Return the background of data: the median of each mesh x mesh block, expanded back to data's shape."""
+    ny, nx = max(1, data.shape[0]//mesh), max(1, data.shape[1]//mesh)
+    by, bx = data.shape[0]//ny, data.shape[1]//nx
+    blocks = data[:ny*by, :nx*bx].reshape(ny, by, nx, bx).swapaxes(1, 2).reshape(ny, nx, by*bx)
+    medians = np.median(blocks, axis=2)
+    rows = np.minimum(np.arange(data.shape[0])//by, ny-1)
+    cols = np.minimum(np.arange(data.shape[1])//bx, nx-1)
+    return medians[rows[:, None], cols[None, :]]
+
+
+def find_peaks(binned, nsigma=5., maxSources=100, edge=2):
+    """
+    Return the row and column of the brightest maxSources peaks of binned more
+    than nsigma above its background, brightest first.
+    """
+    residual = binned - background_mesh(binned)
+    sample = imageStats.subsample(residual).ravel()
+    sigma = imageStats.MAD_SIGMA*np.median(np.abs(sample - np.median(sample)))
+    inner = residual[1:-1, 1:-1]
+    peak = inner > nsigma*max(sigma, 1e-6)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy or dx:
+                peak &= inner >= residual[1+dy:residual.shape[0]-1+dy, 1+dx:residual.shape[1]-1+dx]
+    rows, cols = np.nonzero(peak)
+    rows += 1
+    cols += 1
+    keep = ((rows >= edge) & (rows < binned.shape[0] - edge) &
+            (cols >= edge) & (cols < binned.shape[1] - edge))
+    rows, cols = rows[keep], cols[keep]
+    order = np.argsort(residual[rows, cols])[::-1][:maxSources]
+    return rows[order], cols[order]
+
+
+def measure_sources(data, xs, ys, window=25, saturation=65535):
+    """
+    Return the FWHM and ellipticity of the sources near each (xs, ys) of data,
+    leaving out saturated sources and single hot pixels or cosmic rays.
+    """
+    if not len(xs):
+        return np.zeros(0), np.zeros(0)
+    # recentre each window on its brightest pixel.
+    stamps, x0, y0 = centroids.cutouts(data, xs, ys, window)
+    brightest = stamps.reshape(len(xs), -1).argmax(axis=1)
+    stamps, x0, y0 = centroids.cutouts(data, x0 + brightest % window, y0 + brightest//window, window)
+    stamps = stamps.astype(np.float32)
+
+    border = np.concatenate((stamps[:, 0, :], stamps[:, -1, :], stamps[:, 1:-1, 0], stamps[:, 1:-1, -1]), axis=1)
+    background = np.median(border, axis=1)
+    peak = stamps.reshape(len(xs), -1).max(axis=1)
+    image = stamps - background[:, None, None]
+    height = (peak - background)[:, None, None]
+    npix = (image > height/2).sum(axis=(1, 2)).astype(np.float64)
+
+    weight = np.where(image > ISOPHOTE*height, image, 0)
+    gy, gx = np.mgrid[:window, :window].astype(np.float32)
+    total = np.maximum(weight.sum(axis=(1, 2)), 1e-6)
+    xm = (weight*gx).sum(axis=(1, 2))/total
+    ym = (weight*gy).sum(axis=(1, 2))/total
+    dx = gx - xm[:, None, None]
+    dy = gy - ym[:, None, None]
+    mxx = (weight*dx**2).sum(axis=(1, 2))/total
+    myy = (weight*dy**2).sum(axis=(1, 2))/total
+    mxy = (weight*dx*dy).sum(axis=(1, 2))/total
+    # eigenvalues of the second moment matrix: a**2 and b**2.
+    mean = (mxx + myy)/2
+    diff = np.sqrt(((mxx - myy)/2)**2 + mxy**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ellipticity = 1 - np.sqrt((mean - diff)/(mean + diff))
+
+    good = (npix >= 3) & (peak < saturation)
+    fwhm = 2*np.sqrt(npix/np.pi)
+    return fwhm[good], np.nan_to_num(ellipticity[good])
+
+
+def frame_seeing(data, binFactor=4, nsigma=5., maxSources=100, window=25, saturation=65535):
+    """Return the Seeing of data (with elapsed 0: see SeeingMeter)."""
+    binned = block_sum(data, binFactor)
+    rows, cols = find_peaks(binned, nsigma=nsigma, maxSources=maxSources)
+    xs = cols*binFactor + binFactor//2
+    ys = rows*binFactor + binFactor//2
+    fwhm, ellipticity = measure_sources(data, xs, ys, window=window, saturation=saturation)
+    if not len(fwhm):
+        return Seeing(0, np.nan, np.nan, 0.)
+    return Seeing(len(fwhm), np.median(fwhm), np.median(ellipticity), 0.)
+
+
+def format_seeing(seeing):
+    """Return the seeing keyword."""
+    return 'seeing=%d,%0.2f,%0.3f,%0.3f' % seeing
+
+
+def seeing_cards(seeing):
+    """Return the FITS cards for seeing, as (key, value, comment)."""
+    if not seeing.nsources:
+        return [('SEENSRC', 0, 'number of sources measured for SEEFWHM')]
+    return [('SEEFWHM', round(seeing.fwhm, 2), 'median source FWHM [pixels]'),
+            ('SEEELLIP', round(seeing.ellipticity, 3), 'median source ellipticity (1 - b/a)'),
+            ('SEENSRC', seeing.nsources, 'number of sources measured for SEEFWHM')]
+
+
+class SeeingMeter(object):
+    """Measure the seeing of frames in a pool of worker threads."""
+
+    def __init__(self, announce, workers=2, maxPending=4, **kwargs):
+        """
+        Args:
+            announce (callable): called with the seeing keyword of each frame (from a worker thread).
+
+        Kwargs:
+            workers (int): number of worker threads.
+            maxPending (int): frames submitted beyond this many unfinished ones are skipped.
+            **kwargs: passed to frame_seeing().
+        """
+        self.announce = announce
+        self.workers = workers
+        self.maxPending = maxPending
+        self.kwargs = kwargs
+        self.dropped = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _measure(self, data):
+        start = time.time()
+        try:
+            seeing = frame_seeing(data, **self.kwargs)
+            seeing = seeing._replace(elapsed=time.time() - start)
+            self.announce(format_seeing(seeing))
+            return seeing
+        except Exception:
+            traceback.print_exc()
+            return None
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def submit(self, data):
+        """
+        Start measuring data; returns a multiprocessing AsyncResult whose
+        get() gives its Seeing (or None if it failed), or None if the frame
+        was skipped because the workers are behind.
+        """
+        if self._pool is None:
+            self._pool = multiprocessing.pool.ThreadPool(self.workers)
+        with self._lock:
+            if self.pending >= self.maxPending:
+                self.dropped += 1
+                return None
+            self.pending += 1
+        return self._pool.apply_async(self._measure, (data,))
+
+    def close(self):
+        """Wait for the frames already submitted, and stop the workers."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,104 @@
+"""
+Combine the frames of a stacked exposure as they arrive.
+
+The camera integrates the next frame while a worker thread folds in the last
+one: into a running sum for a mean, or into a preallocated cube for a median
+or sigma-clipped mean. Only the mean is really pipelined: when the last frame
+is read out, only a division is left. A median or clipped mean has no running
+form, so the whole combination of the cube still runs after the last readout,
+about as long as combining a list of the frames did.
+"""
+
+import Queue
+import threading
+import time
+
+import numpy as np
+
+methods = ('median', 'mean', 'clip')
+
+
+class StackAccumulator(object):
+    """Fold the frames of one stack into its combination, in a worker thread."""
+
+    def __init__(self, nframes, method='median', nsigma=3.):
+        """
+        Args:
+            nframes (int): the number of frames that will be added.
+
+        Kwargs:
+            method (str): one of methods.
+            nsigma (float): rejection threshold for 'clip'.
+        """
+        if method not in methods:
+            raise ValueError('unknown stack combine method %r: must be one of %s' % (method, methods))
+        self.nframes = nframes
+        self.method = method
+        self.nsigma = nsigma
+        self.nadded = 0
+        self.foldTime = 0.
+
+        self._sum = None
+        self._cube = None
+        self._error = None
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='stack')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, data):
+        """Queue one frame to be folded in; returns at once."""
+        if self.nadded >= self.nframes:
+            raise ValueError('stack already has its %d frames' % (self.nframes))
+        self._queue.put((self.nadded, data))
+        self.nadded += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                start = time.time()
+                self._fold(*item)
+                self.foldTime += time.time() - start
+            except Exception as e:
+                self._error = e
+
+    def _fold(self, i, data):
+        if self.method == 'mean':
+            if self._sum is None:
+                self._sum = np.zeros(data.shape, dtype=np.float64)
+            self._sum += data
+        else:
+            if self._cube is None:
+                self._cube = np.empty((self.nframes,) + data.shape, dtype=data.dtype)
+            self._cube[i] = data
+
+    def close(self):
+        """Stop the worker thread, once the frames already queued are folded in."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def finish(self):
+        """Wait for the queued frames to be folded in, and return the uint16 combination."""
+        self.close()
+        if self._error is not None:
+            raise self._error
+        if self.nadded != self.nframes:
+            raise ValueError('stack has %d of its %d frames' % (self.nadded, self.nframes))
+
+        if self.method == 'mean':
+            combined = self._sum / self.nframes
+        elif self.method == 'median':
+            combined = np.median(self._cube, axis=0)
+        else:
+            from gcameraICC import masters
+            combined = masters.sigma_clip_mean(self._cube, nsigma=self.nsigma)
+        if self.method == 'median':
+            # as np.median(frames).astype('u2') always has.
+            return combined.astype('u2')
+        return np.clip(np.round(combined), 0, 65535).astype('u2')
@@ -0,0 +1,73 @@
+"""
+A small JSON snapshot of the ICC's state, so that a restarted actor can pick
+up where it left off instead of rescanning tonight's directory.
+
+The snapshot holds the night directory, the next frame number, the active
+bias/dark/flat (with their temperatures), the flat cartridge, the readout
+format, the cooler setpoint and the measured readout time. It is rewritten
+(atomically) whenever that changes, and only trusted on startup if it still
+agrees with the directory: see check_frames().
+"""
+
+import glob
+import json
+import os
+
+VERSION = 1
+
+# what a snapshot holds, besides its version and when it was written.
+fields = ('dataDir', 'seqno', 'biasFile', 'biasTemp', 'darkFile', 'darkTemp',
+          'flatFile', 'flatCartridge', 'cameraFormat', 'coolerSetpoint', 'readTime')
+
+
+def snapshot_path(dataRoot, name):
+    """Return the snapshot file of the actor name."""
+    return os.path.join(dataRoot, '%s-state.json' % (name))
+
+
+def read(path):
+    """Return the snapshot at path as a dict, or None if it is missing, unreadable or out of date."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != VERSION:
+        return None
+    if any(field not in state for field in fields):
+        return None
+    # json gives us unicode; the rest of the ICC (and pyfits) expects str.
+    return dict((str(key), str(value) if isinstance(value, unicode) else value)
+                for key, value in state.items())
+
+
+def dumps(state, now):
+    """Return the snapshot of state (a dict with every one of fields), written at now."""
+    snapshot = dict((field, state[field]) for field in fields)
+    snapshot['version'] = VERSION
+    snapshot['time'] = now
+    return json.dumps(snapshot, sort_keys=True, indent=1) + '\n'
+
+
+def _frames(dataDir, seqno):
+    return glob.glob(os.path.join(dataDir, 'gimg-%04d.fits*' % (seqno)))
+
+
+def check_frames(state, dataDir):
+    """
+    Return why state can't be used for tonight's directory dataDir, or None if it can.
+
+    Only a few files are looked at: the snapshot's next frame must not exist
+    yet, the frame before it must, and so must the bias, dark and flat.
+    """
+    if state['dataDir'] != dataDir:
+        return 'snapshot is for %s, not %s' % (state['dataDir'], dataDir)
+    seqno = state['seqno']
+    if _frames(dataDir, seqno):
+        return 'frame %d has been written since the snapshot' % (seqno)
+    if seqno > 1 and not _frames(dataDir, seqno-1):
+        return 'frame %d is missing' % (seqno-1)
+    for field in ('biasFile', 'darkFile', 'flatFile'):
+        if state[field] and not os.path.exists(state[field]):
+            return '%s %s is missing' % (field, state[field])
+    return None
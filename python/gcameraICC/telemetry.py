@@ -0,0 +1,71 @@
+"""
+Change-only reporting of the camera cooler telemetry.
+
+The ICC reads the cooler once per telemetry tick; a CoolerMonitor decides
+whether that sample is worth sending to the hub.
+"""
+
+import math
+
+
+def _isnan(value):
+    """math.isnan that accepts None and other non-numbers."""
+    try:
+        return math.isnan(value)
+    except TypeError:
+        return False
+
+
+class CoolerMonitor(object):
+    """Decide when a cooler sample differs enough from the last one we reported."""
+
+    def __init__(self, deadband=0.2, driveDeadband=1.0, heartbeat=300.):
+        """
+        Kwargs:
+            deadband (float): temperature change (degC) that triggers a report.
+            driveDeadband (float): cooler drive change (percent) that triggers a report.
+            heartbeat (float): always report after this many seconds of silence.
+        """
+        self.deadband = deadband
+        self.driveDeadband = driveDeadband
+        self.heartbeat = heartbeat
+
+        self.last = None
+        self.lastTime = None
+
+    def reset(self):
+        """Forget the last reported sample, so the next one is always reported."""
+        self.last = None
+        self.lastTime = None
+
+    def _changed(self, old, new, deadband):
+        """True if old and new differ by more than deadband (NaN only equals NaN)."""
+        if _isnan(old) or _isnan(new) or old is None or new is None:
+            return _isnan(old) != _isnan(new) or (old is None) != (new is None)
+        return abs(new - old) > deadband
+
+    def changed(self, sample):
+        """True if sample differs from the last reported sample beyond the deadbands."""
+        last = self.last
+        if last is None:
+            return True
+        if sample.statusText != last.statusText:
+            return True
+        return (self._changed(last.setpoint, sample.setpoint, 0) or
+                self._changed(last.fan, sample.fan, 0) or
+                self._changed(last.ccdTemp, sample.ccdTemp, self.deadband) or
+                self._changed(last.heatsinkTemp, sample.heatsinkTemp, self.deadband) or
+                self._changed(last.drive, sample.drive, self.driveDeadband))
+
+    def update(self, sample):
+        """
+        Consider a new sample, and return True if it should be reported.
+
+        A reported sample becomes the new reference for the deadbands.
+        """
+        due = self.lastTime is None or (sample.time - self.lastTime) >= self.heartbeat
+        if due or self.changed(sample):
+            self.last = sample
+            self.lastTime = sample.time
+            return True
+        return False
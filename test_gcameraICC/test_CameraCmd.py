@@ -30,6 +30,14 @@ class TestCamCmd(TestHelper.ActorTester, unittest.TestCase):
         self._run_cmd('shutdown')
         self._check_cmd(0,0,0,0,True,True)
 
+    def test_buildMaster_too_few_frames(self):
+        self._run_cmd('buildMaster bias first=5 last=6')
+        self._check_cmd(0,0,0,0,True,True)
+
+    def test_centroidStars_odd_values(self):
+        self._run_cmd('centroidStars stars=10,20,30')
+        self._check_cmd(0,0,0,0,True,True)
+
 
 if __name__ == '__main__':
     verbosity = 1
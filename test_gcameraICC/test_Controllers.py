@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 """unittests for the various gcamera Controllers."""
 
+import os
 import sys
+import threading
+import time
 import unittest
 import numpy as np
 
@@ -29,8 +32,8 @@ height = 1111
 width = 2222
 
 def fake_GetAcquiredData16(image):
-    """Return success code, and set image to something."""
-    image[:] = np.ones(width*height,dtype='uint16')
+    """Return success code, and set image (of any binning) to something."""
+    image[:] = 1
     return andor.DRV_SUCCESS
 
 # Need to be able test without having the _andor.so compiled library available.
@@ -43,6 +46,8 @@ attrs = {'GetCameraHandle.return_value':[DRV_SUCCESS,1234],
          'GetDetector.return_value':[DRV_SUCCESS,width,height],
          'SetAcquisitionMode.return_value':DRV_SUCCESS,
          'SetExposureTime.return_value':DRV_SUCCESS,
+         'SetImage.return_value':DRV_SUCCESS,
+         'SetReadMode.return_value':DRV_SUCCESS,
          'SetShutter.return_value':DRV_SUCCESS,
          'StartAcquisition.return_value':DRV_SUCCESS,
          'GetAcquiredData16.side_effect':fake_GetAcquiredData16,
@@ -147,6 +152,9 @@ class TestAndorCam(TestBaseCam,unittest.TestCase):
         self.assertFalse(self.cam.ok)
         self.assertIn('Error number {}'.format(FAKE_FAIL),self.cam.errMsg)
         andor.GetCameraHandle.assert_called_once_with(0)
+        # without a handle of its own, it must not shut down whichever camera is current.
+        self.cam._shutdown()
+        self.assertFalse(andor.ShutDown.called)
 
     def test_connect_fails_Initialize(self,*funcs):
         newattr = {'Initialize.return_value':FAKE_FAIL}
@@ -158,6 +166,30 @@ class TestAndorCam(TestBaseCam,unittest.TestCase):
         andor.GetCameraHandle.assert_called_once_with(0)
         andor.SetCurrentCamera.assert_called_once_with(self.cam.camHandle)
         andor.Initialize.assert_called_once_with("/usr/local/etc/andor")
+        # the handle it did get must be released.
+        self.cam._shutdown()
+        andor.ShutDown.assert_called_once_with()
+
+    def test_connect_cameraIndex(self):
+        self.cam = andorcam.AndorCam(cameraIndex=2)
+        self.assertTrue(self.cam.ok)
+        andor.GetCameraHandle.assert_called_once_with(2)
+
+    def test_two_cameras_select_handle(self):
+        """Each camera should re-select its own handle before talking to the SDK."""
+        newattr = {'GetCameraHandle.side_effect':lambda index: [DRV_SUCCESS,100+index]}
+        andor.configure_mock(**newattr)
+
+        cam0 = andorcam.AndorCam(cameraIndex=0)
+        cam1 = andorcam.AndorCam(cameraIndex=1)
+        andor.reset_mock()
+        cam0._start_exposure()
+        cam0._status()
+        cam1._start_exposure()
+        cam0._start_exposure()
+        self.assertEqual(andor.SetCurrentCamera.call_args_list,
+                         [mock.call(100), mock.call(101), mock.call(100)])
+        self.assertEqual(andor.StartAcquisition.call_count,3)
 
 
     def test_prep_exposure_openShutter(self):
@@ -304,19 +336,132 @@ class TestAndorCam(TestBaseCam,unittest.TestCase):
         self.assertEqual(andor.GetTemperature.call_count,0)
         andor.ShutDown.assert_called_once_with()
 
+    def test_shutdown_steps(self):
+        """Each step should read the temperature once, until the camera is warm."""
+        side_effect = [[DRV_TEMPERATURE_NOT_STABILIZED,-50], [DRV_TEMPERATURE_NOT_STABILIZED,5]]
+        newattr = {'GetTemperatureF.side_effect':side_effect}
+        andor.configure_mock(**newattr)
+
+        self.cam.ccdTemp = -100
+        self.cam.start_shutdown()
+        self.assertTrue(self.cam.isShuttingDown)
+        andor.CoolerOFF.assert_called_once_with()
+        self.assertFalse(self.cam.shutdown_step())
+        self.assertFalse(self.cam.shutdown_step())
+        self.assertFalse(andor.ShutDown.called)
+        self.assertTrue(self.cam.shutdown_step())
+        andor.ShutDown.assert_called_once_with()
+        self.assertFalse(self.cam.isShuttingDown)
+        self.assertEqual(andor.GetTemperatureF.call_count,2)
+        # nothing may read the cooler from the shut down camera.
+        self.assertFalse(self.cam.ok)
+        with self.assertRaises(BaseCam.CameraError):
+            self.cam.read_cooler()
+
+    def test_shutdown_twice(self):
+        self.cam.ccdTemp = -100
+        self.cam.start_shutdown()
+        with self.assertRaises(BaseCam.CameraError):
+            self.cam.start_shutdown()
+
+    def test_shutdown_abort(self):
+        """Aborting should stop the steps and restore the cooler setpoint."""
+        newattr = {'GetTemperatureF.return_value':[DRV_TEMPERATURE_OFF,-90]}
+        andor.configure_mock(**newattr)
+
+        self.cam.setpoint = -100
+        self.cam.ccdTemp = -100
+        self.cam.start_shutdown()
+        self.cam.abort_shutdown()
+        self.assertFalse(self.cam.isShuttingDown)
+        self.assertIsNone(self.cam.shutdown_step())
+        self.assertFalse(andor.ShutDown.called)
+        andor.CoolerON.assert_called_once_with()
+        andor.SetTemperature.assert_called_once_with(-100)
+
+    def test_expose_refused_while_shutting_down(self):
+        self.cam.ccdTemp = -100
+        self.cam.start_shutdown()
+        with self.assertRaises(BaseCam.CameraError) as cm:
+            self.cam.expose(1,cmd=self.cmd)
+        self.assertIn('shutting down', cm.exception.message)
+        self.assertFalse(andor.StartAcquisition.called)
+
     def test_expose(self):
         result = self.cam.expose(1,cmd=self.cmd)
         andor.SetShutter.assert_called_once_with(1,0,self.cam.shutter_time,self.cam.shutter_time)
         self.assertEqual(self.cam.errMsg,'')
         self._check_cmd(0,0,0,0,False)
-        self.assertTrue((result['data'] == np.ones((width,height),dtype='uint16')).all())
+        shape = (width/self.cam.binning, height/self.cam.binning)
+        self.assertTrue((result['data'] == np.ones(shape,dtype='uint16')).all())
+
+    def test_exposing(self):
+        exposing = []
+        andor.StartAcquisition.side_effect = lambda: exposing.append(self.cam.exposing) or DRV_SUCCESS
+        self.assertFalse(self.cam.exposing)
+        self.cam.expose(1,cmd=self.cmd)
+        self.assertEqual(exposing, [True])
+        self.assertFalse(self.cam.exposing)
 
     def test_dark(self):
         result = self.cam.dark(1,cmd=self.cmd)
         andor.SetShutter.assert_called_once_with(1,2,self.cam.shutter_time,self.cam.shutter_time)
         self.assertEqual(self.cam.errMsg,'')
         self._check_cmd(0,0,0,0,False)
-        self.assertTrue((result['data'] == np.ones((width,height),dtype='uint16')).all())
+        shape = (width/self.cam.binning, height/self.cam.binning)
+        self.assertTrue((result['data'] == np.ones(shape,dtype='uint16')).all())
+
+
+class TestAltaReleasesGIL(unittest.TestCase):
+    """
+    The Alta's long calls must let other threads run. Needs a real camera
+    (and the compiled _alta): set ALTA_HOSTNAME to its hostname.
+    """
+    def setUp(self):
+        hostname = os.environ.get('ALTA_HOSTNAME')
+        if not hostname:
+            self.skipTest('ALTA_HOSTNAME is not set: no Alta camera to test with')
+        try:
+            from gcameraICC.Controllers import altacam
+        except ImportError as e:
+            self.skipTest('no alta library: %s' % (e))
+        self.cam = altacam.AltaCam(hostname)
+        self.cam.connect()
+
+    def tearDown(self):
+        self.cam.CloseDriver()
+
+    def count_while(self, func):
+        """Return how many times per second another thread goes round a python loop while func runs."""
+        counts = [0]
+        done = threading.Event()
+        def spin():
+            while not done.is_set():
+                counts[0] += 1
+        thread = threading.Thread(target=spin)
+        thread.start()
+        start = time.time()
+        try:
+            func()
+        finally:
+            elapsed = time.time() - start
+            done.set()
+            thread.join()
+        return counts[0]/elapsed
+
+    def test_readout_runs_concurrently(self):
+        baseline = self.count_while(lambda: time.sleep(1))
+
+        self.cam.Expose(0., False)
+        while not self.cam.ImageReady():
+            time.sleep(0.01)
+        image = []
+        during = self.count_while(lambda: image.append(self.cam.fetchImage()))
+
+        self.assertIsNotNone(image[0])
+        # holding the GIL for the whole readout would leave the other thread a
+        # few switch intervals at most.
+        self.assertGreater(during, baseline/2.)
 
 
 if __name__ == '__main__':
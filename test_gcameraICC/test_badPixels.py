@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""unittests for bad pixel masks."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from gcameraICC import badPixels
+from gcameraICC import calibration
+
+shape = (30, 40)
+
+class TestFindDefects(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(3)
+        self.darkRate = np.random.normal(2., 0.1, shape)
+        self.flatNorm = np.random.normal(1., 0.01, shape)
+
+    def test_clean(self):
+        indices, counts = badPixels.find_defects(self.darkRate, self.flatNorm)
+        self.assertEqual(len(indices), 0)
+        self.assertEqual(counts, {'hot': 0, 'dead': 0, 'columns': 0})
+
+    def test_hot_and_dead(self):
+        self.darkRate[5, 6] = 50.
+        self.flatNorm[10, 20] = 0.1
+        indices, counts = badPixels.find_defects(self.darkRate, self.flatNorm)
+        self.assertEqual(list(indices), [5*shape[1] + 6, 10*shape[1] + 20])
+        self.assertEqual(indices.dtype, np.uint32)
+        self.assertEqual(counts, {'hot': 1, 'dead': 1, 'columns': 0})
+
+    def test_column(self):
+        self.darkRate[:20, 7] = 50.
+        indices, counts = badPixels.find_defects(self.darkRate, None)
+        self.assertEqual(counts['columns'], 1)
+        self.assertEqual(len(indices), shape[0])
+        self.assertTrue(np.all(np.unravel_index(indices, shape)[1] == 7))
+
+
+class TestBadPixelMask(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_save_load(self):
+        path = badPixels.mask_path(self.tempdir, 'gcamera', shape, (2, 2))
+        self.assertEqual(os.path.basename(path), 'gcamera-badpix-30x40-bin2x2.npz')
+        self.assertIsNone(badPixels.load(path))
+        badPixels.save(path, [3, 17, 400], shape, (2, 2), darkFile='dark.fits.gz')
+        mask = badPixels.load(path)
+        self.assertEqual(mask.shape, shape)
+        self.assertEqual(list(mask.indices), [3, 17, 400])
+        self.assertEqual(os.listdir(self.tempdir), [os.path.basename(path)])
+
+    def test_replace(self):
+        data = np.arange(shape[0]*shape[1], dtype='u2').reshape(shape)
+        expected = data[4:7, 4:7].copy()
+        data[5, 5] = 60000
+        mask = badPixels.BadPixelMask([5*shape[1] + 5], shape)
+        self.assertIs(mask.apply(data), data)
+        self.assertEqual(data[5, 5], np.median(np.delete(expected.ravel(), 4)))
+
+    def test_replace_cluster(self):
+        data = np.full(shape, 100, dtype='f4')
+        data[9:12, 9:12] = 1e6
+        data[8, 7:14] = 200.
+        indices = [row*shape[1] + col for row in range(9, 12) for col in range(9, 12)]
+        mask = badPixels.BadPixelMask(indices, shape)
+        self.assertEqual(mask.hopeless, 0)
+        mask.apply(data)
+        # the centre has no good 3x3 neighbour: it uses the 5x5 box.
+        self.assertEqual(data[10, 10], 100.)
+        # the top row's good 3x3 neighbours are all 200; the centre's 5x5 box is mostly 100.
+        np.testing.assert_array_equal(data[9, 9:12], 200.)
+        np.testing.assert_array_equal(data[9:12, 9:12] < 1e6, True)
+
+    def test_edge(self):
+        data = np.full(shape, 100, dtype='f4')
+        data[0, 0] = 1e6
+        badPixels.BadPixelMask([0], shape).apply(data)
+        self.assertEqual(data[0, 0], 100.)
+
+    def test_flag(self):
+        data = np.full(shape, 100, dtype='f4')
+        badPixels.BadPixelMask([3, 17], shape).apply(data, 'flag')
+        self.assertEqual(np.isnan(data).sum(), 2)
+        self.assertTrue(np.isnan(data.flat[17]))
+
+    def test_wrong_shape(self):
+        mask = badPixels.BadPixelMask([3], shape)
+        with self.assertRaises(ValueError):
+            mask.apply(np.zeros((shape[0], shape[1]+1), dtype='f4'))
+
+    def test_calibrate(self):
+        data = np.full(shape, 300, dtype='u2')
+        data[2, 3] = 9000
+        mask = badPixels.BadPixelMask([2*shape[1] + 3], shape)
+        calibrator = calibration.Calibrator(calibration.CalibrationCache())
+        frame, applied = calibrator.calibrate(data, 5., badPixels=mask)
+        self.assertEqual(applied, ['badpix'])
+        np.testing.assert_allclose(frame, 300)
+        self.assertEqual(data[2, 3], 9000)
+
+        frame, applied = calibrator.calibrate(data, 5., badPixels=mask, badPixelMode='off')
+        self.assertEqual(applied, [])
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""unittests for the calibration-frame cache and calibrated frames."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+import pyfits
+
+from gcameraICC import calibration
+
+shape = (40, 60)
+
+class TestCalibration(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.bias = np.full(shape, 100, dtype='u2')
+        self.dark = np.full(shape, 100 + 2*10, dtype='u2') # 2 ADU/s for 10s
+        flat = np.full((shape[0]*2, shape[1]*2), 1100, dtype='u2') # unbinned
+        flat[:, :shape[1]//2] = 2100 # the left quarter has twice the response
+        self.biasFile = self.write('gimg-0001.fits.gz', self.bias)
+        self.darkFile = self.write('gimg-0002.fits.gz', self.dark, EXPTIME=10.)
+        self.flatFile = self.write('gimg-0003.fits.gz', flat)
+        self.cache = calibration.CalibrationCache()
+        self.calibrator = calibration.Calibrator(self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, data, **cards):
+        path = os.path.join(self.tempdir, name)
+        hdu = pyfits.PrimaryHDU(data)
+        for key, value in cards.items():
+            hdu.header[key] = value
+        hdu.writeto(path, clobber=True)
+        return path
+
+    def test_block_mean(self):
+        data = np.arange(16, dtype='f4').reshape(4, 4)
+        np.testing.assert_allclose(calibration.block_mean(data, (2, 2)), [[2.5, 4.5], [10.5, 12.5]])
+        self.assertIsNone(calibration.block_mean(data, (3, 2)))
+
+    def test_calibrate(self):
+        data = np.full(shape, 100 + 2*5, dtype='u2') + 500
+        data[:, :shape[1]//4] += 1000
+        frame, applied = self.calibrator.calibrate(data, 5., self.biasFile, self.darkFile, self.flatFile)
+        self.assertEqual(applied, ['bias', 'dark', 'flat'])
+        self.assertEqual(frame.dtype, np.float32)
+        # bias and dark removed, then the left quarter divided by 2.
+        np.testing.assert_allclose(frame[:, :shape[1]//4], 1500/2., rtol=1e-5)
+        np.testing.assert_allclose(frame[:, shape[1]//4:], 500, rtol=1e-5)
+
+    def test_calibrate_missing_files(self):
+        data = np.full(shape, 300, dtype='u2')
+        frame, applied = self.calibrator.calibrate(data, 5., self.biasFile)
+        self.assertEqual(applied, ['bias'])
+        np.testing.assert_allclose(frame, 200)
+
+    def test_calibrate_wrong_shape(self):
+        data = np.full((shape[0], shape[1]+1), 300, dtype='u2')
+        frame, applied = self.calibrator.calibrate(data, 5., self.biasFile, self.darkFile)
+        self.assertEqual(applied, [])
+
+    def test_cache_hits(self):
+        data = np.full(shape, 300, dtype='u2')
+        self.calibrator.calibrate(data, 5., self.biasFile, self.darkFile, self.flatFile)
+        misses = self.cache.misses
+        for i in range(3):
+            self.calibrator.calibrate(data, 5., self.biasFile, self.darkFile, self.flatFile)
+        self.assertEqual(self.cache.misses, misses)
+
+    def test_cache_reloads_changed_file(self):
+        data, header = self.cache.get(self.biasFile)
+        self.assertEqual(data[0, 0], 100)
+        self.write('gimg-0001.fits.gz', self.bias + 5)
+        os.utime(self.biasFile, (time.time()+10, time.time()+10))
+        data, header = self.cache.get(self.biasFile)
+        self.assertEqual(data[0, 0], 105)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_cache_budget(self):
+        cache = calibration.CalibrationCache(maxBytes=self.bias.size*4*2)
+        for path in (self.biasFile, self.darkFile, self.flatFile):
+            cache.get(path)
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.nbytes, self.bias.size*4*4)
+        cache.get(self.biasFile)
+        cache.get(self.darkFile)
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
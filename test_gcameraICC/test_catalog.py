@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""unittests for the archive catalog builder."""
+
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+import pyfits
+
+from gcameraICC import catalog
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.db = catalog.connect(os.path.join(self.dataRoot, 'catalog.sqlite'))
+        self.write(57000, 1, 'bias', 0.)
+        self.write(57000, 2, 'dark', 15.)
+        self.write(57000, 3, 'object', 5., biasFile=self.path(57000, 1), darkFile=self.path(57000, 2))
+        self.write(57001, 1, 'dark', 30.)
+        # not frames.
+        open(os.path.join(self.dataRoot, '57000', 'bias-0001.dat'), 'w').write('filename=x\n')
+        os.mkdir(os.path.join(self.dataRoot, 'logs'))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dataRoot)
+
+    def path(self, mjd, seqno):
+        return os.path.join(self.dataRoot, str(mjd), 'gimg-%04d.fits.gz' % (seqno))
+
+    def write(self, mjd, seqno, imagetyp, exptime, biasFile=None, darkFile=None):
+        dirname = os.path.join(self.dataRoot, str(mjd))
+        if not os.path.isdir(dirname):
+            os.mkdir(dirname)
+        hdu = pyfits.PrimaryHDU(np.zeros((64, 48), dtype='u2'))
+        hdu.header['IMAGETYP'] = imagetyp
+        hdu.header['EXPTIME'] = exptime
+        hdu.header['CCDTEMP'] = -40.
+        if biasFile:
+            hdu.header['BIASFILE'] = biasFile
+        if darkFile:
+            hdu.header['DARKFILE'] = darkFile
+        hdu.writeto(self.path(mjd, seqno), clobber=True)
+
+    def test_read_primary_header(self):
+        header = catalog.read_primary_header(self.path(57000, 2))
+        self.assertEqual(header['IMAGETYP'], 'dark')
+        self.assertEqual(header['NAXIS1'], 48)
+
+    def test_truncated(self):
+        path = os.path.join(self.dataRoot, '57000', 'gimg-0009.fits.gz')
+        gz = gzip.open(path, 'wb')
+        gz.write('SIMPLE  =                    T' + ' '*50)
+        gz.close()
+        with self.assertRaises(IOError):
+            catalog.read_primary_header(path)
+
+    def test_relative_path(self):
+        self.assertEqual(catalog.relative_path(self.path(57000, 1), self.dataRoot), '57000/gimg-0001.fits.gz')
+        self.assertEqual(catalog.relative_path('/elsewhere/gimg-0001.fits.gz', self.dataRoot),
+                         '/elsewhere/gimg-0001.fits.gz')
+        self.assertIsNone(catalog.relative_path('', self.dataRoot))
+
+    def test_update(self):
+        counts = catalog.update(self.db, self.dataRoot, processes=2)
+        self.assertEqual(counts, {'read': 4, 'skipped': 0, 'removed': 0, 'failed': 0})
+        darks = list(self.db.execute("SELECT path FROM frames WHERE imagetyp='dark' AND exptime > 10 "
+                                     "ORDER BY path"))
+        self.assertEqual(darks, [('57000/gimg-0002.fits.gz',), ('57001/gimg-0001.fits.gz',)])
+        row = self.db.execute("SELECT mjd, seqno, naxis1, naxis2 FROM frames WHERE path='57000/gimg-0003.fits.gz'")
+        self.assertEqual(row.fetchone(), (57000, 3, 48, 64))
+        calibs = list(self.db.execute("SELECT kind, calib FROM calibrations ORDER BY kind"))
+        self.assertEqual(calibs, [('bias', '57000/gimg-0001.fits.gz'), ('dark', '57000/gimg-0002.fits.gz')])
+
+    def test_update_incremental(self):
+        catalog.update(self.db, self.dataRoot, processes=1)
+        counts = catalog.update(self.db, self.dataRoot, processes=1)
+        self.assertEqual(counts, {'read': 0, 'skipped': 4, 'removed': 0, 'failed': 0})
+
+        self.write(57000, 2, 'dark', 60.)
+        os.utime(self.path(57000, 2), (time.time(), time.time() + 10))
+        os.remove(self.path(57001, 1))
+        counts = catalog.update(self.db, self.dataRoot, processes=1)
+        self.assertEqual(counts, {'read': 1, 'skipped': 2, 'removed': 1, 'failed': 0})
+        exptime = self.db.execute("SELECT exptime FROM frames WHERE path='57000/gimg-0002.fits.gz'").fetchone()
+        self.assertEqual(exptime, (60.,))
+
+    def test_update_mjd_range(self):
+        counts = catalog.update(self.db, self.dataRoot, firstMjd=57001, processes=1)
+        self.assertEqual(counts['read'], 1)
+        # the other night isn't touched by a scan of this one.
+        catalog.update(self.db, self.dataRoot, processes=1)
+        counts = catalog.update(self.db, self.dataRoot, lastMjd=57000, processes=1)
+        self.assertEqual(counts, {'read': 0, 'skipped': 3, 'removed': 0, 'failed': 0})
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""unittests for guide star centroids."""
+
+import unittest
+import numpy as np
+
+from gcameraICC import centroids
+
+shape = (200, 300)
+sigma = 2.
+
+def star(data, x, y, peak, sigma=sigma):
+    gy, gx = np.mgrid[:data.shape[0], :data.shape[1]]
+    data += peak*np.exp(-((gx - x)**2 + (gy - y)**2)/(2*sigma**2))
+
+class TestCentroids(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(5)
+        self.data = np.random.normal(500, 5, shape)
+        self.stars = [(40.3, 50.7), (150.5, 100.2), (250.8, 160.4)]
+        for x, y in self.stars:
+            star(self.data, x, y, 3000)
+
+    def test_cutouts(self):
+        data = np.arange(100).reshape(10, 10)
+        stamps, x0, y0 = centroids.cutouts(data, np.array([5., 0.4, 9.]), np.array([5., 0.4, 9.]), 5)
+        self.assertEqual(stamps.shape, (3, 5, 5))
+        self.assertEqual(list(x0), [3, 0, 5])
+        np.testing.assert_array_equal(stamps[0], data[3:8, 3:8])
+        np.testing.assert_array_equal(stamps[2], data[5:, 5:])
+        with self.assertRaises(ValueError):
+            centroids.cutouts(data, np.array([5.]), np.array([5.]), 11)
+
+    def test_measure(self):
+        # the guesses are a couple of pixels off.
+        guesses = [(x + 1.6, y - 2.1) for x, y in self.stars]
+        results = centroids.measure(self.data.astype('u2'), guesses)
+        self.assertEqual(len(results), 3)
+        for (x, y), result in zip(self.stars, results):
+            self.assertEqual(result.method, 'gauss')
+            self.assertAlmostEqual(result.x, x, delta=0.05)
+            self.assertAlmostEqual(result.y, y, delta=0.05)
+            self.assertAlmostEqual(result.fwhm, centroids.FWHM_SIGMA*sigma, delta=0.1)
+            self.assertAlmostEqual(result.flux, 3000*2*np.pi*sigma**2, delta=0.03*3000*2*np.pi*sigma**2)
+            self.assertAlmostEqual(result.background, 500, delta=5)
+
+    def test_no_star(self):
+        result, = centroids.measure(self.data, [(100, 30)])
+        self.assertEqual(result.method, 'none')
+        self.assertTrue(np.isnan(result.x))
+        self.assertAlmostEqual(result.background, 500, delta=2)
+        self.assertTrue(centroids.format_centroid(3, result).startswith('centroid=3,nan,nan,'))
+
+    def test_bad_pixels(self):
+        x, y = self.stars[0]
+        bad = np.zeros(shape, dtype=bool)
+        self.data[52, 44] = 60000
+        bad[52, 44] = True
+        result, = centroids.measure(self.data, [(x, y)], bad=bad)
+        self.assertAlmostEqual(result.x, x, delta=0.05)
+        self.assertAlmostEqual(result.y, y, delta=0.05)
+
+    def test_empty(self):
+        self.assertEqual(centroids.measure(self.data, []), [])
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
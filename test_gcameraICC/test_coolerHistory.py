@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""unittests for the cooler history ring file."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from gcameraICC.Controllers import coolerHistory
+from gcameraICC.Controllers.BaseCam import CoolerSample
+
+def sample(t, ccdTemp):
+    return CoolerSample(t, -40, ccdTemp, np.nan, 50., np.nan, 'Stabilized')
+
+class TestCoolerHistory(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'coolerHistory.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_create(self):
+        history = coolerHistory.CoolerHistory(self.filename, capacity=100)
+        self.assertEqual(len(history), 0)
+        self.assertEqual(os.path.getsize(self.filename),
+                         coolerHistory.HEADER_SIZE + 100*coolerHistory.recordDtype.itemsize)
+        self.assertIsNone(history.aggregate(0, 10))
+
+    def test_reopen_keeps_samples(self):
+        history = coolerHistory.CoolerHistory(self.filename, capacity=100)
+        for t in range(10):
+            history.append(sample(t, -40), 2)
+        history.close()
+        history = coolerHistory.CoolerHistory(self.filename, capacity=100)
+        self.assertEqual(len(history), 10)
+        np.testing.assert_array_equal(history.since(5)['time'], [5, 6, 7, 8, 9])
+
+    def test_reopen_new_capacity(self):
+        history = coolerHistory.CoolerHistory(self.filename, capacity=100)
+        history.append(sample(0, -40))
+        history.close()
+        history = coolerHistory.CoolerHistory(self.filename, capacity=50)
+        self.assertEqual(len(history), 0)
+
+    def test_wrap(self):
+        history = coolerHistory.CoolerHistory(self.filename, capacity=10)
+        for t in range(25):
+            history.append(sample(t, -t), 2)
+        self.assertEqual(len(history), 10)
+        np.testing.assert_array_equal(history.since(0)['time'], np.arange(15, 25))
+        np.testing.assert_array_equal(history.since(21)['time'], np.arange(21, 25))
+        np.testing.assert_array_equal(history.since(16.5)['time'], np.arange(17, 25))
+
+    def test_aggregate(self):
+        history = coolerHistory.CoolerHistory(self.filename, capacity=1000)
+        for t in range(100):
+            history.append(sample(t, -float(t)), 2)
+        bins = history.aggregate(40, 20)
+        np.testing.assert_array_equal(bins['time'], [40, 60, 80])
+        np.testing.assert_array_equal(bins['n'], [20, 20, 20])
+        np.testing.assert_allclose(bins['ccdTempMin'], [-59, -79, -99])
+        np.testing.assert_allclose(bins['ccdTempMax'], [-40, -60, -80])
+        np.testing.assert_allclose(bins['ccdTempMean'], [-49.5, -69.5, -89.5])
+        np.testing.assert_allclose(bins['driveMean'], [50, 50, 50])
+        self.assertTrue(np.isnan(bins['heatsinkTempMean']).all())
+        self.assertEqual(coolerHistory.status_text(bins['status'][0], ('Off','On','Stable')), 'Stable')
+
+    def test_aggregate_skips_empty_bins(self):
+        history = coolerHistory.CoolerHistory(self.filename, capacity=1000)
+        for t in (0, 1, 50, 51, 52):
+            history.append(sample(t, -40))
+        bins = history.aggregate(0, 10)
+        np.testing.assert_array_equal(bins['time'], [0, 50])
+        np.testing.assert_array_equal(bins['n'], [2, 3])
+
+    def test_history_path(self):
+        # actors sharing a dataRoot must not share a ring.
+        self.assertNotEqual(coolerHistory.history_path('/data/gcam', 'gcamera'),
+                            coolerHistory.history_path('/data/gcam', 'gcamera2'))
+        self.assertEqual(coolerHistory.history_path('/data/gcam', 'gcamera'), '/data/gcam/gcamera-coolerHistory.dat')
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""unittests for the atomic, fsync-policy file writer."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import mock
+import pyfits
+
+from gcameraICC import durableWrite
+
+class TestDurableWrite(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.hdu = pyfits.PrimaryHDU(np.arange(100*100, dtype='u2').reshape(100, 100))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            durableWrite.DurableWriter('sometimes')
+
+    def test_write_fits_gzip(self):
+        writer = durableWrite.DurableWriter()
+        path = os.path.join(self.tempdir, 'gimg-0001.fits.gz')
+        writer.write_fits(self.hdu, path, compress=True)
+        self.assertEqual(os.listdir(self.tempdir), ['gimg-0001.fits.gz'])
+        np.testing.assert_array_equal(pyfits.getdata(path), self.hdu.data)
+
+    def test_write_fits_output(self):
+        """The same output as actorcore's writeFits: checksums, and a read-only file."""
+        writer = durableWrite.DurableWriter()
+        path = os.path.join(self.tempdir, 'gimg-0001.fits.gz')
+        writer.write_fits(self.hdu, path, compress=True)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0444)
+        hdulist = pyfits.open(path, checksum=True)
+        self.assertIn('CHECKSUM', hdulist[0].header)
+        self.assertIn('DATASUM', hdulist[0].header)
+        hdulist.close()
+
+    def test_write_text(self):
+        writer = durableWrite.DurableWriter('frame')
+        path = os.path.join(self.tempdir, 'bias-0002.dat')
+        writer.write_text(path, 'filename=x\ntemp=-40.00\n')
+        self.assertEqual(open(path).read(), 'filename=x\ntemp=-40.00\n')
+
+    def test_failed_write_leaves_nothing(self):
+        writer = durableWrite.DurableWriter()
+        path = os.path.join(self.tempdir, 'gimg-0003.fits.gz')
+        hdu = mock.Mock()
+        hdu.writeto.side_effect = IOError('disk full')
+        with self.assertRaises(IOError):
+            writer.write_fits(hdu, path, compress=True)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_frame_policy_syncs(self):
+        writer = durableWrite.DurableWriter('frame')
+        with mock.patch('gcameraICC.durableWrite._fsync') as fsync, \
+             mock.patch('gcameraICC.durableWrite.fsync_path') as fsync_path:
+            writer.write_fits(self.hdu, os.path.join(self.tempdir, 'gimg-0004.fits'))
+        # the file, then its directory.
+        self.assertEqual(fsync.call_count, 1)
+        fsync_path.assert_called_once_with(self.tempdir)
+
+    def test_batch_policy(self):
+        writer = durableWrite.DurableWriter('batch', batchFrames=3, batchSeconds=60)
+        with mock.patch('gcameraICC.durableWrite.fsync_path') as fsync:
+            for i in range(2):
+                writer.write_fits(self.hdu, os.path.join(self.tempdir, 'gimg-%04d.fits' % (i+1)))
+            self.assertEqual(fsync.call_count, 0)
+            self.assertIsNotNone(writer._timer)
+            writer.write_fits(self.hdu, os.path.join(self.tempdir, 'gimg-0003.fits'))
+            # three files and their one directory.
+            self.assertEqual(fsync.call_count, 4)
+        self.assertIsNone(writer._timer)
+        self.assertEqual(writer._pending, [])
+
+    def test_latency_per_policy(self):
+        """Time a few writes in each mode, as they would be reported."""
+        for policy in durableWrite.policies:
+            writer = durableWrite.DurableWriter(policy, batchFrames=4)
+            self.assertEqual(writer.format_latency(), 'writeLatency="%s",0,0,0,0,0' % (policy))
+            for i in range(8):
+                writer.write_fits(self.hdu, os.path.join(self.tempdir, '%s-%04d.fits.gz' % (policy, i)),
+                                  compress=True)
+            n, p50, p90, p99, longest = writer.latency()
+            self.assertEqual(n, 8)
+            self.assertTrue(0 < p50 <= p90 <= p99 <= longest)
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
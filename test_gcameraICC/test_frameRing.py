@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""unittests for the shared memory frame ring."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from gcameraICC import frameRing
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = frameRing.ring_path('gcamera', self.tempdir)
+        self.ring = frameRing.FrameRing(self.filename, nslots=3, dataBytes=64*64*2)
+        self.frames = [np.full((64, 64), i, dtype='u2') for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_empty(self):
+        self.assertEqual(self.ring.written, 0)
+        self.assertIsNone(self.ring.latest())
+        with self.assertRaises(frameRing.TornRead):
+            self.ring.view(0)
+
+    def test_publish_read(self):
+        slot = self.ring.publish(self.frames[1], {'type': 'object', 'iTime': np.float32(2)}, seqno=12)
+        self.assertEqual(slot, 0)
+        self.assertEqual(self.ring.latest(), 0)
+        reader = frameRing.FrameRing(self.filename, create=False)
+        data, meta = reader.read(0)
+        np.testing.assert_array_equal(data, self.frames[1])
+        self.assertEqual(meta, {'type': 'object', 'iTime': 2.})
+        self.assertEqual(reader.slots[0]['seqno'][0], 12)
+
+    def test_wraps(self):
+        for i, frame in enumerate(self.frames):
+            slot = self.ring.publish(frame, {'i': i})
+            self.assertEqual(slot, i % 3)
+        self.assertEqual(self.ring.written, 5)
+        self.assertEqual(self.ring.latest(), 1)
+        data, meta = self.ring.read(self.ring.latest())
+        self.assertEqual(meta['i'], 4)
+        np.testing.assert_array_equal(data, self.frames[4])
+
+    def test_view_invalidated(self):
+        """A zero-copy view is no longer valid once its slot is rewritten."""
+        self.ring.publish(self.frames[0], {})
+        reader = frameRing.FrameRing(self.filename, create=False)
+        data, meta, seq = reader.view(0)
+        self.assertFalse(data.flags.writeable)
+        self.assertTrue(reader.still_valid(0, seq))
+        for frame in self.frames[1:4]:
+            self.ring.publish(frame, {})
+        self.assertFalse(reader.still_valid(0, seq))
+
+    def test_torn_read(self):
+        self.ring.publish(self.frames[0], {})
+        self.ring.slots[0]['seq'] += 1 # as if a write were in progress.
+        with self.assertRaises(frameRing.TornRead):
+            self.ring.read(0, retries=1)
+
+    def test_too_big(self):
+        with self.assertRaises(ValueError):
+            self.ring.publish(np.zeros((65, 64), dtype='u2'), {})
+
+    def test_reopen_keeps_frames(self):
+        self.ring.publish(self.frames[2], {})
+        ring = frameRing.FrameRing(self.filename, nslots=3, dataBytes=64*64*2)
+        self.assertEqual(ring.written, 1)
+        ring = frameRing.FrameRing(self.filename, nslots=4, dataBytes=64*64*2)
+        self.assertEqual(ring.written, 0)
+        self.assertEqual(os.listdir(self.tempdir), ['gcamera-frames'])
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""unittests for the TCP frame server, with a local client."""
+
+import unittest
+import numpy as np
+
+from twisted.internet import defer, protocol, reactor
+from twisted.trial import unittest as trial_unittest
+
+from gcameraICC import frameServer
+
+class Receiver(frameServer.FrameReceiver):
+    def connectionMade(self):
+        frameServer.FrameReceiver.connectionMade(self)
+        self.frames = []
+        self.factory.connected.callback(self)
+
+    def frameReceived(self, data, meta):
+        self.frames.append((data, meta))
+        if len(self.frames) == self.factory.expected:
+            self.factory.done.callback(self.frames)
+
+class ReceiverFactory(protocol.ClientFactory):
+    protocol = Receiver
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.connected = defer.Deferred()
+        self.done = defer.Deferred()
+
+
+class FakeTransport(object):
+    def __init__(self, sent):
+        self.sent = sent
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def writeSequence(self, message):
+        self.sent.append(message)
+
+
+def deferLater(delay):
+    d = defer.Deferred()
+    reactor.callLater(delay, d.callback, None)
+    return d
+
+
+class TestEncode(unittest.TestCase):
+    def test_encode_frame(self):
+        data = np.arange(6, dtype='u2').reshape(2, 3)
+        header, meta, payload = frameServer.encode_frame(data, {'seqno': np.int32(3)})
+        self.assertEqual(frameServer.HEADER.unpack(header),
+                         (frameServer.MAGIC, frameServer.VERSION, 0, len(meta), 2, 3, 12))
+        self.assertEqual(meta, '{"seqno": 3}')
+        self.assertEqual(payload, data.tostring())
+
+
+class TestFrameServer(trial_unittest.TestCase):
+    def setUp(self):
+        self.server = frameServer.FrameServerFactory(maxQueue=2)
+        self.port = reactor.listenTCP(0, self.server, interface='127.0.0.1')
+        self.connector = None
+
+    def tearDown(self):
+        if self.connector is not None:
+            self.connector.disconnect()
+        return self.port.stopListening()
+
+    def connect(self, expected):
+        factory = ReceiverFactory(expected)
+        self.connector = reactor.connectTCP('127.0.0.1', self.port.getHost().port, factory)
+        return factory
+
+    @defer.inlineCallbacks
+    def test_stream(self):
+        factory = self.connect(2)
+        yield factory.connected
+        # let the server side of the connection register too.
+        while not self.server.subscribers:
+            yield deferLater(0.01)
+
+        frames = [np.random.randint(0, 65535, size=(300, 200)).astype('u2') for i in range(2)]
+        for i, frame in enumerate(frames):
+            self.server.broadcast(frame, {'seqno': i})
+        received = yield factory.done
+        for (data, meta), frame, i in zip(received, frames, range(2)):
+            np.testing.assert_array_equal(data, frame)
+            self.assertEqual(meta, {'seqno': i})
+
+    def test_no_subscribers(self):
+        self.server.broadcast(np.zeros((2, 2), dtype='u2'), {})
+
+    def test_slow_subscriber_drops_oldest(self):
+        """A paused subscriber keeps only its newest maxQueue frames."""
+        sent = []
+        subscriber = frameServer.FrameSubscriber()
+        subscriber.factory = self.server
+        subscriber.transport = FakeTransport(sent)
+        subscriber.connectionMade()
+        subscriber.pauseProducing()
+        for i in range(5):
+            self.server.broadcast(np.zeros((2, 2), dtype='u2'), {'seqno': i})
+        self.assertEqual(sent, [])
+        self.assertEqual(subscriber.dropped, 3)
+        subscriber.resumeProducing()
+        self.assertEqual([m[1] for m in sent], ['{"seqno": 3}', '{"seqno": 4}'])
+        subscriber.connectionLost(None)
+        self.assertEqual(self.server.subscribers, [])
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -1,14 +1,28 @@
 #!/usr/bin/env python
 """unittests for gcameraICC itself"""
 
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 
+# TBD: #python3: python3 has unittest.mock.
+import mock
+
+from twisted.internet import defer, threads
+
 from actorcore import Actor, ICC
 from opscore.actor import Model, KeyVarDispatcher
 
 from actorcore import TestHelper
 
 from gcameraICC import GcameraICC
+from gcameraICC import stateSnapshot
+from gcameraICC.Commands import CameraCmd
 
 import gcameraTester
 
@@ -50,6 +64,300 @@ class TestGcameraICC(gcameraTester.GcameraTester,unittest.TestCase):
         self.assertIn('attaching command set CameraCmd',logged)
         # self.assertIn('attaching command set CameraCmd_LCO',logged)
 
+    def test_watchdog(self):
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        cam = mock.Mock(ok=True, errorCount=0, isShutDown=False, isShuttingDown=False)
+        self.assertFalse(self.gcamera.cameraNeedsReconnect(cam))
+        cam.errorCount = self.gcamera.watchdogErrors
+        self.assertTrue(self.gcamera.cameraNeedsReconnect(cam))
+        cam.errorCount = 0
+        cam.ok = False
+        self.assertTrue(self.gcamera.cameraNeedsReconnect(cam))
+
+    def test_watchdog_ignores_shutdown(self):
+        """A camera that we shut down on purpose must not be reconnected."""
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        cam = mock.Mock(ok=False, errorCount=10, isShutDown=True, isShuttingDown=False)
+        self.assertFalse(self.gcamera.cameraNeedsReconnect(cam))
+        cam.isShutDown, cam.isShuttingDown = False, True
+        self.assertFalse(self.gcamera.cameraNeedsReconnect(cam))
+
+    def test_telemetry_skips_shut_down_camera(self):
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        self.gcamera.cam = mock.Mock(ok=False, errorCount=0, isShutDown=True, isShuttingDown=False)
+        with mock.patch.object(GcameraICC, 'reactor'), mock.patch.object(GcameraICC, 'threads') as threads:
+            self.gcamera.telemetryTick()
+        self.assertFalse(threads.deferToThread.called)
+        self.assertFalse(self.gcamera.connecting)
+
+    def test_watchdog_waits_for_exposure(self):
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        self.gcamera.cam = mock.Mock(ok=False, errorCount=0, isShutDown=False, isShuttingDown=False,
+                                     exposing=True)
+        with mock.patch.object(GcameraICC, 'reactor'), \
+                mock.patch.object(self.gcamera, 'prep_connectCamera') as prep_connectCamera:
+            self.gcamera.telemetryTick()
+            self.assertFalse(prep_connectCamera.called)
+            self.gcamera.cam.exposing = False
+            self.gcamera.telemetryTick()
+            prep_connectCamera.assert_called_once_with()
+
+    def test_failed_connection_is_closed(self):
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        cam = mock.MagicMock(ok=False, errMsg='no camera')
+        with mock.patch.object(self.gcamera, 'makeCamera', return_value=cam):
+            with self.assertRaises(GcameraICC.BaseCam.CameraError):
+                self.gcamera._makeConnectedCamera()
+        cam._shutdown.assert_called_once_with()
+
+    def test_startup_milestones(self):
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        steps = [name for name, t in self.gcamera.startupMilestones]
+        self.assertEqual(steps, ['init', 'commands', 'configured'])
+        times = [float(x) for x in self.gcamera.formatStartupTimes().split('=')[1].split(',')]
+        self.assertEqual(len(times), len(GcameraICC.startupSteps))
+        self.assertTrue(0 <= times[0] <= times[1] <= times[2])
+        self.assertEqual(times[3:], [-1, -1])
+
+    def test_connectionMade_connects_now(self):
+        self.gcamera = GcameraICC.GcameraICC.newActor(location='lco',makeCmdrConnection=False)
+        with mock.patch.object(self.gcamera, 'prep_connectCamera') as prep_connectCamera:
+            self.gcamera.connectionMade()
+            prep_connectCamera.assert_called_once_with()
+            self.assertIn('hub', dict(self.gcamera.startupMilestones))
+            # a new hub link must not drop the camera we have.
+            self.gcamera.cam = mock.Mock()
+            self.gcamera.connectionMade()
+            self.assertEqual(prep_connectCamera.call_count, 1)
+
+
+class TestRunActors(unittest.TestCase):
+    def test_pipeline_workers_forked_first(self):
+        # before any actor's threads, and once for all of them.
+        from gcameraICC import pipeline
+        order = []
+        actors = [mock.Mock(), mock.Mock()]
+        for actor in actors:
+            actor.run.side_effect = lambda **kwargs: order.append('run')
+        with mock.patch.object(pipeline, 'start_pool', side_effect=lambda: order.append('fork')):
+            GcameraICC.runActors(actors)
+        self.assertEqual(order, ['fork', 'run', 'run'])
+
+
+def mockActor(dataRoot):
+    """Return a mock actor with no camera, whose config is all defaults, writing to dataRoot."""
+    actor = mock.Mock(location='LCO', cam=None, frameServer=None)
+    actor.name = 'gcamera'
+    actor.config.get.side_effect = lambda section, option: {'dataRoot': dataRoot, 'filePrefix': 'gimg'}[option]
+    actor.getCameraConfig.side_effect = lambda option, default, type=float: default
+    actor.stateFilePath.return_value = os.path.join(dataRoot, 'gcamera-state.json')
+    return actor
+
+class TestNextFrame(unittest.TestCase):
+    """The next frame number comes from the state we keep, not a scan of the night's directory."""
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.actor = mockActor(self.dataRoot)
+
+    def tearDown(self):
+        shutil.rmtree(self.dataRoot)
+
+    def warmStart(self):
+        """Return a CameraCmd restored from a snapshot saying frame 4 is next."""
+        dataDir = CameraCmd.CameraCmd(self.actor).tonightDir()
+        for seqno in (1, 2, 3):
+            open(os.path.join(dataDir, 'gimg-%04d.fits.gz' % (seqno)), 'w').write('x')
+        state = dict((field, None) for field in stateSnapshot.fields)
+        state.update(dataDir=dataDir, seqno=4, flatCartridge=-1)
+        open(self.actor.stateFilePath(), 'w').write(stateSnapshot.dumps(state, 0))
+        camCmd = CameraCmd.CameraCmd(self.actor)
+        self.assertEqual(camCmd.nextSeqno, 4)
+        return camCmd
+
+    def test_warm_start_does_not_scan(self):
+        camCmd = self.warmStart()
+        with mock.patch.object(CameraCmd.glob, 'glob') as glob:
+            dirname, filename = camCmd.genNextRealPath(self.actor.bcast)
+        self.assertFalse(glob.called)
+        self.assertEqual(filename, 'gimg-0004.fits')
+
+    def test_rescan(self):
+        camCmd = self.warmStart()
+        camCmd.nextSeqno = 10
+        dirname, filename = camCmd.genNextRealPath(self.actor.bcast, rescan=True)
+        self.assertEqual(filename, 'gimg-0004.fits')
+        self.assertEqual(camCmd.nextSeqno, 4)
+
+    def test_new_night(self):
+        camCmd = self.warmStart()
+        with mock.patch.object(camCmd, 'tonightDir', return_value=os.path.join(self.dataRoot, '99999')):
+            dirname, filename = camCmd.genNextRealPath(self.actor.bcast)
+        self.assertEqual(filename, 'gimg-0001.fits')
+        self.assertEqual(camCmd.nextSeqno, 1)
+
+
+class TestSeeingCards(unittest.TestCase):
+    """The frame is written without waiting for its seeing."""
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.camCmd = CameraCmd.CameraCmd(mockActor(self.dataRoot))
+        self.hdr = mock.Mock()
+        self.cmd = mock.Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dataRoot)
+
+    def test_not_ready(self):
+        pending = mock.Mock()
+        pending.ready.return_value = False
+        self.camCmd.addSeeingCards(self.hdr, {'seeing': pending}, self.cmd)
+        self.assertFalse(pending.get.called)
+        self.assertFalse(self.hdr.update.called)
+
+    def test_ready(self):
+        from gcameraICC import seeing
+        result = seeing.Seeing(12, 2.5, 0.1, 0.02)
+        pending = mock.Mock()
+        pending.ready.return_value = True
+        pending.get.return_value = result
+        self.camCmd.addSeeingCards(self.hdr, {'seeing': pending}, self.cmd)
+        self.assertEqual([call[0][0] for call in self.hdr.update.call_args_list],
+                         [key for key, value, comment in seeing.seeing_cards(result)])
+
+
+class TestShutDownStatus(unittest.TestCase):
+    """After a shutdown, status reports it without talking to the camera."""
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.actor = mockActor(self.dataRoot)
+        self.camCmd = CameraCmd.CameraCmd(self.actor)
+        self.actor.cam = mock.Mock(isShutDown=True, ccdTemp=1.5, safe_temp=0.,
+                                   m_pvtRoiBinningV=2, m_pvtRoiBinningH=2)
+        self.actor.cam.cooler_status.side_effect = GcameraICC.BaseCam.CameraError('camera connection is down')
+        self.actor.cam.cached_cooler_status.return_value = 'cooler=0,1.5,nan,nan,nan,"Off"'
+        self.cmd = mock.Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dataRoot)
+
+    def responses(self):
+        return [call[0][0] for call in self.cmd.respond.call_args_list]
+
+    def test_coolerStatus(self):
+        self.camCmd.coolerStatus(self.cmd)
+        self.assertEqual(self.responses(), ['shutdownState="done",1.5,0.0', 'cooler=0,1.5,nan,nan,nan,"Off"'])
+        self.assertFalse(self.cmd.fail.called)
+        self.assertTrue(self.cmd.finish.called)
+
+    def test_status(self):
+        self.camCmd.status(self.cmd)
+        self.assertIn('cameraConnected=False', self.responses())
+        self.assertIn('shutdownState="done",1.5,0.0', self.responses())
+        self.assertTrue(self.cmd.finish.called)
+
+
+class RecordingLock(object):
+    """An RLock that remembers the threads that took it."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.threads = []
+
+    def __enter__(self):
+        self.threads.append(threading.current_thread())
+        return self.lock.__enter__()
+
+    def __exit__(self, *args):
+        return self.lock.__exit__(*args)
+
+def deferToOtherThread(func, *args, **kwargs):
+    """threads.deferToThread, but run now in a new thread, returning a fired Deferred."""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(defer.maybeDeferred(func, *args, **kwargs)))
+    thread.start()
+    thread.join()
+    return result[0]
+
+class TestBuildMaster(unittest.TestCase):
+    """buildMaster must leave the reactor free, even while an exposure holds seqnoLock."""
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.actor = mockActor(self.dataRoot)
+        self.camCmd = CameraCmd.CameraCmd(self.actor)
+        self.camCmd.seqnoLock = RecordingLock()
+        self.cmd = mock.Mock()
+        self.cmd.cmd.keywords = {'bias': None, 'first': mock.Mock(values=[1]), 'last': mock.Mock(values=[3])}
+        self.master = {'data': None, 'type': 'bias', 'iTime': 0., 'ccdTemp': -40., 'cards': []}
+
+    def tearDown(self):
+        shutil.rmtree(self.dataRoot)
+
+    def test_write_off_reactor_thread(self):
+        # the test's thread stands in for the reactor's.
+        with mock.patch.object(threads, 'deferToThread', deferToOtherThread), \
+                mock.patch.object(self.camCmd, '_combineMaster', return_value=self.master), \
+                mock.patch.object(self.camCmd, 'writeFITS') as writeFITS, \
+                mock.patch.object(self.camCmd, 'appendManifest'):
+            self.camCmd.buildMaster(self.cmd)
+        writeFITS.assert_called_once_with(self.master, self.cmd)
+        self.assertTrue(self.camCmd.seqnoLock.threads)
+        self.assertNotIn(threading.current_thread(), self.camCmd.seqnoLock.threads)
+        self.assertFalse(self.cmd.fail.called)
+        self.assertEqual(self.camCmd.biasFile, self.master['filename'] + self.camCmd.ext)
+        self.assertEqual(self.camCmd.biasTemp, -40.)
+        self.assertTrue(self.cmd.finish.called)
+
+
+# run in a fresh interpreter, so nothing is already imported.
+startupScript = """
+import json, os, shutil, sys, tempfile, threading, time
+start = time.time()
+from gcameraICC.Commands import CameraCmd
+elapsed = time.time() - start
+heavy = ('multiprocessing', 'pyfits', 'RO.Astro', 'actorcore.utility.svn', 'actorcore.utility.fits',
+         'gcameraICC.masters')
+loaded = [name for name in sys.modules if sys.modules[name] is not None and name.startswith(heavy)]
+ours = lambda: sorted(name for name in sys.modules
+                      if sys.modules[name] is not None and name.startswith('gcameraICC'))
+imported = ours()
+
+# a cold start, with no state snapshot, in an empty dataRoot.
+import mock
+dataRoot = tempfile.mkdtemp()
+try:
+    actor = mock.Mock(location='LCO', cam=None, frameServer=None)
+    actor.name = 'gcamera'
+    actor.config.get.side_effect = lambda section, option: {'dataRoot': dataRoot, 'filePrefix': 'gimg'}[option]
+    actor.getCameraConfig.side_effect = lambda option, default, type=float: default
+    actor.stateFilePath.return_value = os.path.join(dataRoot, 'gcamera-state.json')
+    CameraCmd.CameraCmd(actor)
+finally:
+    shutil.rmtree(dataRoot)
+print(json.dumps({'elapsed': elapsed, 'loaded': loaded, 'imported': imported,
+                  'constructed': ours(), 'threads': threading.active_count()}))
+"""
+
+class TestStartupBenchmark(unittest.TestCase):
+    """Regression guard on what loading the command set imports and starts, and how long it takes."""
+    maxSeconds = 2.
+    # only what a warm start needs: the rest is imported when first used.
+    startupModules = ['gcameraICC', 'gcameraICC.Commands', 'gcameraICC.Commands.CameraCmd',
+                      'gcameraICC.durableWrite', 'gcameraICC.stateSnapshot']
+
+    @classmethod
+    def setUpClass(cls):
+        output = subprocess.check_output([sys.executable, '-c', startupScript], env=os.environ.copy())
+        cls.result = json.loads(output.splitlines()[-1])
+
+    def test_import_CameraCmd(self):
+        self.assertEqual(self.result['loaded'], [])
+        self.assertEqual(self.result['imported'], self.startupModules)
+        self.assertLess(self.result['elapsed'], self.maxSeconds)
+
+    def test_new_CameraCmd(self):
+        # a cold start rescans the night's manifest, but makes no rings, pools or threads.
+        self.assertEqual(self.result['constructed'], sorted(self.startupModules + ['gcameraICC.manifest']))
+        self.assertEqual(self.result['threads'], 1)
+
 
 if __name__ == '__main__':
     verbosity = 2
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""unittests for the per-frame image statistics."""
+
+import unittest
+import numpy as np
+
+from gcameraICC import imageStats
+
+class TestImageStats(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(11)
+        self.data = np.round(np.random.normal(1000, 20, size=(1024, 1024))).astype('u2')
+
+    def test_subsample(self):
+        sample = imageStats.subsample(self.data, 65536)
+        self.assertEqual(sample.shape, (256, 256))
+        small = np.zeros((10, 10), dtype='u2')
+        self.assertEqual(imageStats.subsample(small).shape, (10, 10))
+
+    def test_frame_stats(self):
+        self.data[100:103, 200] = 65535
+        stats = imageStats.frame_stats(self.data)
+        self.assertAlmostEqual(stats['median'], 1000, delta=1)
+        self.assertAlmostEqual(stats['sigma'], 20, delta=1)
+        self.assertAlmostEqual(stats['p999'], 1000 + 3.09*20, delta=5)
+        self.assertEqual(stats['nsat'], 3)
+        self.assertEqual(stats['max'], 65535)
+        self.assertEqual(stats['min'], self.data.min())
+
+    def test_frame_stats_saturation_level(self):
+        self.data[0, :10] = 40000
+        stats = imageStats.frame_stats(self.data, saturation=40000)
+        self.assertEqual(stats['nsat'], 10)
+
+    def test_format_stats(self):
+        stats = {'median': 1000., 'sigma': 20.123, 'p999': 1062., 'nsat': 3, 'min': 900, 'max': 65535}
+        self.assertEqual(imageStats.format_stats(stats), 'imageStats=1000.0,20.12,1062.0,3,900,65535')
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
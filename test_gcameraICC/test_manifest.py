@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""unittests for the per-night frame manifest."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcameraICC import durableWrite
+from gcameraICC import manifest
+
+def entry(seqno, type, **kwargs):
+    values = dict(seqno=seqno, type=type, exptime=1., stack=1, ccdTemp=-40., binx=2, biny=2,
+                  biasFile=None, darkFile=None, flatFile=None, flatCartridge=None,
+                  writeTime=1.5e9, size=1000, compression='gzip')
+    values.update(kwargs)
+    return manifest.format_entry(**values)
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tempdir, '57000')
+        os.mkdir(self.dirname)
+        self.path = manifest.manifest_path(self.dirname)
+        self.writer = durableWrite.DurableWriter()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def append(self, line):
+        self.writer.append_text(self.path, line, header=manifest.header_line())
+
+    def test_manifest_path(self):
+        self.assertEqual(self.path, os.path.join(self.dirname, 'manifest-57000.tsv'))
+        self.assertEqual(manifest.manifest_path(self.dirname + '/'), self.path)
+
+    def test_round_trip(self):
+        self.append(entry(1, 'bias', exptime=0))
+        self.append(entry(2, 'object', exptime=10.5, biasFile='gimg-0001.fits.gz', flatCartridge=7))
+        with open(self.path) as f:
+            self.assertEqual(f.readline(), manifest.header_line())
+        entries = manifest.read(self.path)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0].type, 'bias')
+        self.assertIsNone(entries[0].biasFile)
+        self.assertEqual(entries[1].exptime, 10.5)
+        self.assertEqual(entries[1].biasFile, 'gimg-0001.fits.gz')
+        self.assertEqual(entries[1].flatCartridge, 7)
+
+    def test_read_missing(self):
+        self.assertEqual(manifest.read(self.path), [])
+
+    def test_bad_line(self):
+        with self.assertRaises(ValueError):
+            manifest.parse_line('1\tbias\n')
+
+    def test_scan(self):
+        """the sort of query tools run: long darks tonight."""
+        for seqno, exptime in enumerate([5, 15, 30, 2]):
+            self.append(entry(seqno+1, 'dark', exptime=exptime))
+        self.append(entry(5, 'object', exptime=20))
+        longDarks = [e.seqno for e in manifest.read(self.path) if e.type == 'dark' and e.exptime > 10]
+        self.assertEqual(longDarks, [2, 3])
+
+    def test_latest_calibrations(self):
+        for seqno, type in enumerate(['bias', 'dark', 'flat', 'object', 'bias', 'flat']):
+            self.append(entry(seqno+1, type, flatCartridge=3 if type == 'flat' else None))
+        latest = manifest.latest_calibrations(manifest.read(self.path), 6)
+        self.assertEqual(latest['bias'].seqno, 5)
+        self.assertEqual(latest['dark'].seqno, 2)
+        self.assertEqual(latest['flat'].seqno, 3)
+        self.assertEqual(latest['flat'].flatCartridge, 3)
+        latest = manifest.latest_calibrations(manifest.read(self.path), 2)
+        self.assertIsNone(latest['dark'])
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""unittests for building master bias and dark frames."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+import pyfits
+
+from gcameraICC import masters
+
+class TestMasters(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_sigma_clip_mean(self):
+        np.random.seed(12)
+        cube = np.random.normal(100, 1, size=(20, 8, 8)).astype('f4')
+        cube[3, 2, 2] = 10000 # a cosmic ray
+        mean = masters.sigma_clip_mean(cube)
+        self.assertAlmostEqual(mean[2, 2], np.delete(cube[:, 2, 2], 3).mean(), places=3)
+        self.assertTrue(np.all(np.abs(mean - 100) < 1))
+
+    def test_sigma_clip_mean_constant(self):
+        """With no scatter nothing is rejected, even though std is 0."""
+        cube = np.full((5, 3, 3), 7, dtype='f4')
+        np.testing.assert_array_equal(masters.sigma_clip_mean(cube), 7)
+
+    def test_tile_rows(self):
+        self.assertEqual(masters.tile_rows(50, (1024, 1024), 64*1024**2), 327)
+        self.assertEqual(masters.tile_rows(50, (100, 1024), 64*1024**2), 100)
+        self.assertEqual(masters.tile_rows(50, (100, 1024), 10), 1)
+
+    def test_combine(self):
+        np.random.seed(3)
+        paths = []
+        frames = np.random.poisson(500, size=(9, 30, 20)).astype('u2')
+        frames[4, 10:12, 5] = 60000
+        for i, frame in enumerate(frames):
+            path = os.path.join(self.tempdir, 'gimg-%04d.fits.gz' % (i+1))
+            pyfits.PrimaryHDU(frame).writeto(path)
+            paths.append(path)
+        # tiny tiles, so we exercise several of them.
+        master = masters.combine(paths, processes=2, maxTileBytes=9*20*4*7)
+        self.assertEqual(master.shape, (30, 20))
+        np.testing.assert_allclose(master, masters.sigma_clip_mean(frames), rtol=1e-6)
+        self.assertLess(master[10, 5], 600)
+
+    def test_decompress(self):
+        frame = np.arange(12, dtype='u2').reshape(3, 4)
+        path = os.path.join(self.tempdir, 'gimg-0001.fits.gz')
+        pyfits.PrimaryHDU(frame).writeto(path)
+        scratch = tempfile.mkdtemp(dir=self.tempdir)
+        copy = masters.decompress(path, scratch)
+        self.assertEqual(copy, os.path.join(scratch, 'gimg-0001.fits'))
+        np.testing.assert_array_equal(masters.read_rows(copy, 1, 3), frame[1:3])
+        self.assertEqual(masters.decompress(copy, scratch), copy)
+
+    def test_combine_subprocess(self):
+        """From a thread, as the actor does: the pool is made in a new interpreter."""
+        np.random.seed(4)
+        frames = np.random.poisson(500, size=(5, 16, 12)).astype('u2')
+        paths = []
+        for i, frame in enumerate(frames):
+            path = os.path.join(self.tempdir, 'gimg-%04d.fits.gz' % (i+1))
+            pyfits.PrimaryHDU(frame).writeto(path)
+            paths.append(path)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            masters.combine_subprocess(paths, (16, 12), processes=2, maxTileBytes=5*12*4*3)))
+        thread.start()
+        thread.join(60)
+        self.assertEqual(len(result), 1)
+        np.testing.assert_allclose(result[0], masters.sigma_clip_mean(frames), rtol=1e-6)
+
+    def test_combine_subprocess_fails(self):
+        with self.assertRaises(RuntimeError) as cm:
+            masters.combine_subprocess([os.path.join(self.tempdir, 'missing.fits')], (4, 4))
+        self.assertIn('missing.fits', str(cm.exception))
+
+    def test_combine_shape_mismatch(self):
+        paths = []
+        for i, shape in enumerate([(10, 10), (10, 12)]):
+            path = os.path.join(self.tempdir, 'gimg-%04d.fits' % (i+1))
+            pyfits.PrimaryHDU(np.zeros(shape, dtype='u2')).writeto(path)
+            paths.append(path)
+        with self.assertRaises(ValueError):
+            masters.combine(paths)
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""unittests for the overscan bias level measurement."""
+
+import unittest
+import numpy as np
+
+from gcameraICC import overscan
+
+class TestOverscan(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(7)
+        self.nrows, self.ncols, self.nover = 50, 40, 12
+        # a bias that drifts down the frame, plus read noise.
+        self.levels = 1000 + 10*np.arange(self.nrows)
+        noise = np.random.normal(0, 2, size=(self.nrows, self.ncols))
+        self.data = np.round(self.levels[:, np.newaxis] + noise).astype('u2')
+        self.data[:, :-self.nover] += 500
+
+    def test_overscan_width(self):
+        self.assertEqual(overscan.overscan_width(524, 24, 2), 12)
+        self.assertEqual(overscan.overscan_width(1048, 24, 1), 24)
+        self.assertEqual(overscan.overscan_width(1024, 0, 2), 0)
+        self.assertEqual(overscan.overscan_width(10, 24, 1), 0)
+
+    def test_row_levels(self):
+        levels = overscan.row_levels(self.data, self.nover)
+        np.testing.assert_allclose(levels, self.levels, atol=2)
+
+    def test_row_levels_ignores_outliers(self):
+        self.data[10, -3] = 60000
+        levels = overscan.row_levels(self.data, self.nover)
+        self.assertLess(abs(levels[10] - self.levels[10]), 2)
+
+    def test_sections(self):
+        biassec, datasec = overscan.sections((512, 524), 12)
+        self.assertEqual(biassec, '[513:524,1:512]')
+        self.assertEqual(datasec, '[1:512,1:512]')
+
+    def test_correct_measure_only(self):
+        data, info = overscan.correct(self.data, self.nover)
+        self.assertIs(data, self.data)
+        self.assertAlmostEqual(info['level'], np.median(self.levels), delta=2)
+        self.assertGreater(info['sigma'], 100)
+
+    def test_correct_subtract_trim(self):
+        data, info = overscan.correct(self.data, self.nover, subtract=True, trim=True)
+        self.assertEqual(data.shape, (self.nrows, self.ncols - self.nover))
+        self.assertEqual(data.dtype, np.uint16)
+        # the row structure is gone, but the median level is kept.
+        rowMeans = data.mean(axis=1)
+        self.assertLess(rowMeans.std(), 1)
+        self.assertAlmostEqual(rowMeans.mean(), info['level'] + 500, delta=2)
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""unittests for the multi-process post-readout pipeline."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+
+from gcameraICC import frameRing
+from gcameraICC import pipeline
+
+from test_seeing import star_field
+
+shape = (256, 280)
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = frameRing.ring_path('gcamera', self.tempdir)
+        self.ring = frameRing.FrameRing(self.filename, nslots=3, dataBytes=shape[0]*shape[1]*2)
+        self.frame = star_field(shape, 10, 2., 2.)
+        self.frame[:, -24:] = 1000
+        self.meta = {'filename': os.path.join(self.tempdir, 'gimg-0007.fits.gz'), 'overscanCols': 24}
+        self.options = {'saturation': 60000, 'filePrefix': 'gimg', 'previewFormat': 'png', 'previewSize': 64}
+        self.informed = []
+        self.warned = []
+
+    def tearDown(self):
+        pipeline.stop_pool()
+        del pipeline._pipelines[:]
+        shutil.rmtree(self.tempdir)
+
+    def publish(self):
+        slot = self.ring.publish(self.frame, self.meta, seqno=7)
+        return slot, self.ring.written - 1
+
+    def test_run_stage(self):
+        slot, count = self.publish()
+        name, resultCount, keywords, error, elapsed = pipeline.run_stage(('imageStats', self.filename, slot,
+                                                                          count, self.options))
+        self.assertIsNone(error)
+        self.assertEqual((name, resultCount), ('imageStats', count))
+        self.assertEqual(len(keywords), 1)
+        self.assertTrue(keywords[0].startswith('imageStats='))
+        # the overscan isn't in the statistics.
+        self.assertNotEqual(keywords[0].split(',')[-1], '1000')
+
+    def test_overwritten(self):
+        slot, count = self.publish()
+        for i in range(self.ring.nslots):
+            self.publish()
+        name, resultCount, keywords, error, elapsed = pipeline.run_stage(('imageStats', self.filename, slot,
+                                                                          count, self.options))
+        self.assertEqual(keywords, [])
+        self.assertIn('overwritten', error)
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline(self.filename, ['imageStats', 'astrometry'], None, None)
+
+    def test_pipeline(self):
+        slot, count = self.publish()
+        pipe = pipeline.Pipeline(self.filename, ['imageStats', 'seeing', 'preview'], self.informed.append,
+                                 self.warned.append, processes=2, options=self.options)
+        self.assertIn('seeing', pipe)
+        pipeline.start_pool()
+        self.assertTrue(pipe.submit(slot, count))
+        pipe.close()
+        self.assertEqual(self.warned, [])
+        self.assertEqual(sorted(keyword.split('=')[0] for keyword in self.informed),
+                         ['imageStats', 'preview', 'seeing'])
+        self.assertTrue(os.path.exists(os.path.join(self.tempdir, 'gprev-0007.png')))
+        self.assertEqual(pipe.pending, 0)
+
+    def test_some_stages(self):
+        slot, count = self.publish()
+        pipe = pipeline.Pipeline(self.filename, ['imageStats', 'seeing'], self.informed.append,
+                                 self.warned.append, processes=1, options=self.options)
+        pipeline.start_pool()
+        pipe.submit(slot, count, names=['imageStats'])
+        pipe.close()
+        self.assertEqual([keyword.split('=')[0] for keyword in self.informed], ['imageStats'])
+
+    def test_behind(self):
+        slot, count = self.publish()
+        pipe = pipeline.Pipeline(self.filename, ['imageStats', 'seeing'], self.informed.append,
+                                 self.warned.append, processes=1, maxPending=3, options=self.options)
+        pipeline.start_pool()
+        self.assertTrue(pipe.submit(slot, count))
+        self.assertFalse(pipe.submit(slot, count))
+        self.assertEqual(pipe.dropped, 1)
+        pipe.close()
+
+    def test_not_started(self):
+        slot, count = self.publish()
+        pipe = pipeline.Pipeline(self.filename, ['imageStats'], self.informed.append, self.warned.append)
+        with self.assertRaises(RuntimeError):
+            pipe.submit(slot, count)
+
+    def test_start_off_main_thread(self):
+        # forking from a thread could deadlock the workers on a lock another thread holds.
+        pipe = pipeline.Pipeline(self.filename, ['imageStats'], self.informed.append,
+                                 self.warned.append, processes=1, options=self.options)
+        errors = []
+        def start():
+            try:
+                pipeline.start_pool()
+            except RuntimeError as e:
+                errors.append(e)
+        thread = threading.Thread(target=start)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(pipe.running)
+
+    def test_start_with_other_threads(self):
+        # e.g. another actor's pool handler threads, when several cameras share a process.
+        pipe = pipeline.Pipeline(self.filename, ['imageStats'], self.informed.append,
+                                 self.warned.append, processes=1, options=self.options)
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            with self.assertRaises(RuntimeError):
+                pipeline.start_pool()
+        finally:
+            stop.set()
+            thread.join()
+        self.assertFalse(pipe.running)
+
+    def test_submit_off_main_thread(self):
+        # started at startup, the workers take frames from the acquisition thread.
+        slot, count = self.publish()
+        pipe = pipeline.Pipeline(self.filename, ['imageStats'], self.informed.append,
+                                 self.warned.append, processes=1, options=self.options)
+        pipeline.start_pool()
+        submitted = []
+        thread = threading.Thread(target=lambda: submitted.append(pipe.submit(slot, count)))
+        thread.start()
+        thread.join()
+        pipe.close()
+        self.assertEqual(submitted, [True])
+        self.assertEqual([keyword.split('=')[0] for keyword in self.informed], ['imageStats'])
+
+    def test_shared_pool(self):
+        # two cameras' rings, served by one pool forked once.
+        slot, count = self.publish()
+        otherFile = frameRing.ring_path('ecamera', self.tempdir)
+        other = frameRing.FrameRing(otherFile, nslots=2, dataBytes=shape[0]*shape[1]*2)
+        otherSlot = other.publish(self.frame, dict(self.meta, filename=os.path.join(self.tempdir, 'gimg-0001.fits')),
+                                  seqno=1)
+        otherInformed = []
+        pipe = pipeline.Pipeline(self.filename, ['imageStats'], self.informed.append,
+                                 self.warned.append, processes=1, options=self.options)
+        otherPipe = pipeline.Pipeline(otherFile, ['imageStats'], otherInformed.append,
+                                      self.warned.append, processes=2, options=self.options)
+        self.assertEqual(pipeline.start_pool(), 2)
+        self.assertEqual(pipeline._pool._processes, 2)
+        self.assertTrue(pipe.submit(slot, count))
+        self.assertTrue(otherPipe.submit(otherSlot, other.written - 1))
+        pipe.close()
+        otherPipe.close()
+        self.assertEqual(self.warned, [])
+        self.assertEqual(len(self.informed), 1)
+        self.assertEqual(len(otherInformed), 1)
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+    """The stages run in other processes, so a busy actor thread doesn't slow them down."""
+    def test_actor_thread_busy(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            frame = star_field((2048, 2048), 150, 2.5, 2.5)
+            filename = frameRing.ring_path('gcamera', tempdir)
+            ring = frameRing.FrameRing(filename, nslots=4, dataBytes=frame.nbytes)
+            informed = []
+            pipe = pipeline.Pipeline(filename, ['imageStats', 'seeing', 'preview'], informed.append,
+                                     informed.append, processes=3, maxPending=100,
+                                     options={'previewFormat': 'png'})
+            pipeline.start_pool()
+
+            start = time.time()
+            nframes = 4
+            for i in range(nframes):
+                slot = ring.publish(frame, {'filename': os.path.join(tempdir, 'gimg-%04d.fits.gz' % (i))})
+                self.assertTrue(pipe.submit(slot, ring.written - 1))
+                # meanwhile, this process keeps its GIL busy, as the actor and acquisition threads would.
+                busyUntil = time.time() + 0.2
+                while time.time() < busyUntil:
+                    sum(range(1000))
+            pipe.close()
+            elapsed = time.time() - start
+            self.assertEqual(len(informed), 3*nframes,
+                             '%d 2048x2048 frames, 3 stages each, while busy: %0.2f s' % (nframes, elapsed))
+            self.assertFalse([msg for msg in informed if 'failed' in msg])
+        finally:
+            pipeline.stop_pool()
+            del pipeline._pipelines[:]
+            shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
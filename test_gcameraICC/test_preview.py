@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""unittests for the quick-look previews."""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+import numpy as np
+
+import pyfits
+
+from gcameraICC import preview
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(5)
+        self.data = np.random.poisson(1000, size=(512, 520)).astype('u2')
+        self.data[100:104, 100:104] = 40000
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_bin_down(self):
+        binned = preview.bin_down(self.data, 256)
+        self.assertEqual(binned.shape, (170, 173))
+        self.assertAlmostEqual(binned[0, 0], self.data[:3, :3].mean(), places=3)
+        self.assertEqual(preview.bin_down(self.data, 1024).shape, self.data.shape)
+
+    def test_stretch(self):
+        image = preview.stretch(preview.bin_down(self.data, 256))
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertEqual(image.max(), 255)
+        self.assertEqual(image[34, 34], 255)
+
+    def test_stretch_flat(self):
+        image = preview.stretch(np.ones((10, 10), dtype=np.float32))
+        self.assertTrue(np.all(image == 0))
+
+    def test_png_bytes(self):
+        image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        png = preview.png_bytes(image)
+        self.assertEqual(png[:8], preview.PNG_SIGNATURE)
+        width, height = struct.unpack('>II', png[16:24])
+        self.assertEqual((width, height), (4, 3))
+        idatLen = struct.unpack('>I', png[33:37])[0]
+        raw = np.frombuffer(zlib.decompress(png[41:41+idatLen]), dtype=np.uint8).reshape(3, 5)
+        np.testing.assert_array_equal(raw[:, 0], 0)
+        np.testing.assert_array_equal(raw[:, 1:], image)
+
+    def test_write_preview_fits(self):
+        filename = preview.write_preview(self.data, os.path.join(self.tempdir, 'gprev-0001'), 'fits', 128)
+        self.assertEqual(filename, os.path.join(self.tempdir, 'gprev-0001.fits'))
+        self.assertEqual(pyfits.getdata(filename).shape, (102, 104))
+        self.assertEqual(os.listdir(self.tempdir), ['gprev-0001.fits'])
+
+    def test_writer(self):
+        announced = []
+        writer = preview.PreviewWriter(announced.append)
+        self.assertTrue(writer.submit(self.data, os.path.join(self.tempdir, 'gprev-0002')))
+        writer.join()
+        filename = os.path.join(self.tempdir, 'gprev-0002.png')
+        self.assertEqual(announced, ['preview=%s' % filename])
+        self.assertTrue(os.path.isfile(filename))
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""unittests for the photon transfer curve gain measurement."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from gcameraICC import ptc
+
+class FakeDetector(object):
+    """Frames with a known gain, read noise and full well."""
+    gain = 1.5        # e-/ADU
+    readNoise = 4.    # ADU
+    biasLevel = 1000.
+    fullWell = 40000. # ADU, above the bias
+    fluxPerSec = 5000. # ADU/s
+
+    def __init__(self, shape=(256, 256)):
+        self.shape = shape
+        # a fixed flat field pattern, which the pair differences must cancel.
+        self.flat = 1 + 0.05*np.random.standard_normal(shape)
+
+    def frame(self, exptime):
+        electrons = np.random.poisson(self.fluxPerSec*exptime*self.flat*self.gain)
+        signal = np.minimum(electrons/self.gain, self.fullWell)
+        data = self.biasLevel + signal + self.readNoise*np.random.standard_normal(self.shape)
+        return np.clip(np.round(data), 0, 65535).astype('u2')
+
+
+class TestPTC(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(45)
+        self.detector = FakeDetector()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def measure(self, times):
+        bias1, bias2 = self.detector.frame(0), self.detector.frame(0)
+        readNoise = ptc.read_noise(bias1, bias2)
+        bias = (bias1 + bias2.astype(np.float64))/2
+        levels = [ptc.pair_level(t, self.detector.frame(t), self.detector.frame(t), bias) for t in times]
+        return ptc.fit(levels, readNoise)
+
+    def test_regions(self):
+        data = np.arange(6*10).reshape(6, 10)
+        blocks = ptc.regions(data, 3)
+        self.assertEqual(blocks.shape, (2*3, 9))
+        np.testing.assert_array_equal(blocks[1], [3, 4, 5, 13, 14, 15, 23, 24, 25])
+        with self.assertRaises(ValueError):
+            ptc.regions(data, 7)
+
+    def test_read_noise(self):
+        bias1, bias2 = self.detector.frame(0), self.detector.frame(0)
+        self.assertAlmostEqual(ptc.read_noise(bias1, bias2), self.detector.readNoise, delta=0.1)
+
+    def test_gain_and_full_well(self):
+        result = self.measure([0.5, 1, 2, 3, 4, 6, 8, 10])
+        self.assertAlmostEqual(result.gain, self.detector.gain, delta=0.05)
+        self.assertAlmostEqual(result.readNoise, self.detector.readNoise, delta=0.1)
+        self.assertAlmostEqual(result.readNoiseElectrons, self.detector.readNoise*self.detector.gain, delta=0.3)
+        self.assertTrue(result.fullWellReached)
+        # the last level before the variance turns over.
+        self.assertTrue(0.7*self.detector.fullWell < result.fullWell <= self.detector.fullWell)
+        self.assertLess(result.nonlinearity, 0.01)
+
+    def test_full_well_not_reached(self):
+        result = self.measure([0.5, 1, 2, 3])
+        self.assertFalse(result.fullWellReached)
+        self.assertAlmostEqual(result.gain, self.detector.gain, delta=0.05)
+
+    def test_too_few_levels(self):
+        with self.assertRaises(ValueError):
+            self.measure([7, 8, 10])
+
+    def test_format_result(self):
+        result = ptc.Result(1.5, 4., 6., 40000., True, 0.002, [])
+        self.assertEqual(ptc.format_result(result), 'detector=1.500,4.00,6.00,40000,True,0.0020')
+
+    def test_detector_file(self):
+        path = ptc.detector_path(self.tempdir, 'gcamera')
+        self.assertEqual(os.path.basename(path), 'gcamera-detector.json')
+        self.assertIsNone(ptc.load(path))
+        open(path, 'w').write(ptc.dumps(ptc.Result(1.5, 4., 6., 40000., True, 0.002, []), 1234.))
+        detector = ptc.load(path)
+        self.assertEqual((detector['gain'], detector['readNoise'], detector['measured']), (1.5, 4., 1234.))
+        open(path, 'w').write('{}')
+        self.assertIsNone(ptc.load(path))
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
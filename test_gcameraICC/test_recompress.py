@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""unittests for recompressing past nights as tile-compressed FITS."""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import mock
+
+import pyfits
+
+from gcameraICC import catalog
+from gcameraICC import durableWrite
+from gcameraICC import manifest
+from gcameraICC import recompress
+
+class TestRecompress(unittest.TestCase):
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.dataRoot, '57000')
+        os.mkdir(self.dirname)
+        self.writer = durableWrite.DurableWriter('none')
+        self.pool = multiprocessing.Pool(2)
+        np.random.seed(41)
+        self.pixels = {}
+        self.write(1, 'bias')
+        self.write(2, 'object', biasFile=self.path(1), calibrated=True)
+        open(os.path.join(self.dirname, 'bias-0001.dat'), 'w').write('filename=%s\n' % (self.path(1)))
+        open(manifest.manifest_path(self.dirname), 'w').write(
+            manifest.header_line() +
+            manifest.format_entry(seqno=1, type='bias', exptime=0, stack=1, ccdTemp=-40, binx=2, biny=2,
+                                  biasFile=None, darkFile=None, flatFile=None, flatCartridge=None,
+                                  writeTime=1., size=os.path.getsize(self.path(1)), compression='gzip') +
+            manifest.format_entry(seqno=2, type='object', exptime=5, stack=1, ccdTemp=-40, binx=2, biny=2,
+                                  biasFile='gimg-0001.fits.gz', darkFile=None, flatFile=None, flatCartridge=None,
+                                  writeTime=2., size=os.path.getsize(self.path(2)), compression='gzip'))
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.dataRoot)
+
+    def path(self, seqno, ext=recompress.OLD_EXT):
+        return os.path.join(self.dirname, 'gimg-%04d%s' % (seqno, ext))
+
+    def write(self, seqno, imagetyp, biasFile=None, calibrated=False):
+        data = np.random.randint(0, 65536, (64, 48)).astype('u2')
+        self.pixels[seqno] = data
+        hdu = pyfits.PrimaryHDU(data)
+        hdu.header['IMAGETYP'] = imagetyp
+        if biasFile:
+            hdu.header['BIASFILE'] = biasFile
+        hdus = pyfits.HDUList([hdu])
+        if calibrated:
+            hdus.append(pyfits.ImageHDU(data.astype('f4')/3., name='CALIBRATED'))
+        hdus.writeto(self.path(seqno))
+
+    def test_recompress_directory(self):
+        converted, failures = recompress.recompress_directory(self.dirname, self.pool, self.writer)
+        self.assertEqual((converted, failures), (2, []))
+        self.assertEqual(sorted(os.listdir(self.dirname)),
+                         ['bias-0001.dat', 'gimg-0001.fits.fz', 'gimg-0002.fits.fz', 'manifest-57000.tsv'])
+
+        hdus = pyfits.open(self.path(2, recompress.NEW_EXT))
+        self.assertIsInstance(hdus[1], pyfits.CompImageHDU)
+        np.testing.assert_array_equal(hdus[1].data, self.pixels[2])
+        self.assertEqual(hdus[1].header['BIASFILE'], self.path(1, recompress.NEW_EXT))
+        # the float extension is kept as it was.
+        self.assertNotIsInstance(hdus[2], pyfits.CompImageHDU)
+        np.testing.assert_array_equal(hdus[2].data, self.pixels[2].astype('f4')/3.)
+        hdus.close()
+
+        note = open(os.path.join(self.dirname, 'bias-0001.dat')).read()
+        self.assertEqual(note, 'filename=%s\n' % (self.path(1, recompress.NEW_EXT)))
+        entries = manifest.read(manifest.manifest_path(self.dirname))
+        self.assertEqual([entry.compression for entry in entries], ['rice', 'rice'])
+        self.assertEqual(entries[1].biasFile, 'gimg-0001.fits.fz')
+        self.assertEqual(entries[1].size, os.path.getsize(self.path(2, recompress.NEW_EXT)))
+
+    def test_references_from_another_root(self):
+        """A reference written under another dataRoot still points at the same night's file."""
+        header = pyfits.Header()
+        header['BIASFILE'] = '/data/gcam/57000/gimg-0001.fits.gz'
+        header['DARKFILE'] = '/data/gcam/56999/gimg-0001.fits.gz'
+        recompress.rename_references(header, set(['57000/gimg-0001.fits.gz']))
+        self.assertEqual(header['BIASFILE'], '/data/gcam/57000/gimg-0001.fits.fz')
+        self.assertEqual(header['DARKFILE'], '/data/gcam/56999/gimg-0001.fits.gz')
+
+    def test_failure_changes_nothing(self):
+        open(self.path(3), 'w').write('not a FITS file')
+        before = dict((name, open(os.path.join(self.dirname, name)).read()) for name in os.listdir(self.dirname))
+        converted, failures = recompress.recompress_directory(self.dirname, self.pool, self.writer)
+        self.assertEqual(converted, 0)
+        self.assertEqual([path for path, error in failures], [self.path(3)])
+        after = dict((name, open(os.path.join(self.dirname, name)).read()) for name in os.listdir(self.dirname))
+        self.assertEqual(after, before)
+
+    def test_dry_run(self):
+        before = sorted(os.listdir(self.dirname))
+        converted, failures = recompress.recompress_directory(self.dirname, self.pool, self.writer, dryRun=True)
+        self.assertEqual((converted, failures), (2, []))
+        self.assertEqual(sorted(os.listdir(self.dirname)), before)
+
+    def test_catalog_reads_fz(self):
+        recompress.recompress_directory(self.dirname, self.pool, self.writer)
+        header = catalog.read_primary_header(self.path(2, recompress.NEW_EXT))
+        self.assertEqual(header['IMAGETYP'], 'object')
+        self.assertEqual((header['NAXIS1'], header['NAXIS2']), (48, 64))
+
+
+class TestThrottle(unittest.TestCase):
+    def test_unlimited(self):
+        throttle = recompress.Throttle()
+        throttle(10**9)
+        self.assertEqual(throttle.moved, 10**9)
+
+    @mock.patch('gcameraICC.recompress.time.sleep')
+    def test_sleeps(self, sleep):
+        throttle = recompress.Throttle(1e6)
+        throttle.start -= 1.
+        # 0.9MB in the 1s already spent: no need to wait.
+        throttle(9*10**5)
+        self.assertFalse(sleep.called)
+        # 3MB at 1MB/s: wait about 2s more.
+        throttle(21*10**5)
+        self.assertAlmostEqual(sleep.call_args[0][0], 2., places=1)
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""unittests for whole-frame seeing metrics."""
+
+import time
+import unittest
+import numpy as np
+
+from gcameraICC import seeing
+
+def star_field(shape, nstars, sigmaX, sigmaY, seed=2):
+    """Return a uint16 frame of nstars elliptical Gaussian stars on a noisy sky."""
+    np.random.seed(seed)
+    data = np.random.normal(1000, 10, shape).astype(np.float32)
+    for i in range(nstars):
+        x, y = np.random.uniform(30, shape[1]-30), np.random.uniform(30, shape[0]-30)
+        peak = np.random.uniform(500, 20000)
+        y0, x0 = int(y) - 15, int(x) - 15
+        gy, gx = np.mgrid[y0:y0+31, x0:x0+31]
+        data[y0:y0+31, x0:x0+31] += peak*np.exp(-(gx - x)**2/(2*sigmaX**2) - (gy - y)**2/(2*sigmaY**2))
+    return np.clip(data, 0, 65535).astype('u2')
+
+class TestSeeing(unittest.TestCase):
+    def test_block_sum(self):
+        data = np.arange(20).reshape(4, 5)
+        np.testing.assert_array_equal(seeing.block_sum(data, 2), [[12, 20], [52, 60]])
+
+    def test_round_stars(self):
+        data = star_field((512, 512), 30, 2., 2.)
+        result = seeing.frame_seeing(data)
+        self.assertGreaterEqual(result.nsources, 25)
+        self.assertAlmostEqual(result.fwhm, 2.3548*2, delta=0.3)
+        self.assertLess(result.ellipticity, 0.05)
+
+    def test_elongated_stars(self):
+        data = star_field((512, 512), 30, 3., 2.)
+        result = seeing.frame_seeing(data)
+        self.assertAlmostEqual(result.ellipticity, 1/3., delta=0.05)
+
+    def test_hot_pixels_and_saturation(self):
+        data = star_field((512, 512), 0, 2., 2.)
+        data[100, 100] = data[200, 300] = 30000
+        data[300:305, 300:305] = 65535
+        result = seeing.frame_seeing(data)
+        self.assertEqual(result.nsources, 0)
+        self.assertTrue(np.isnan(result.fwhm))
+        self.assertEqual(seeing.seeing_cards(result), [('SEENSRC', 0, 'number of sources measured for SEEFWHM')])
+
+    def test_meter(self):
+        messages = []
+        meter = seeing.SeeingMeter(messages.append, workers=2)
+        data = star_field((512, 512), 20, 2., 2.)
+        results = [meter.submit(data) for i in range(3)]
+        self.assertEqual([r.get(5).nsources for r in results], [results[0].get().nsources]*3)
+        meter.close()
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[0].startswith('seeing=%d,' % (results[0].get().nsources)))
+        self.assertEqual(meter.pending, 0)
+
+    def test_meter_behind(self):
+        meter = seeing.SeeingMeter(lambda msg: time.sleep(0.2), workers=1, maxPending=1)
+        data = star_field((256, 256), 5, 2., 2.)
+        self.assertIsNotNone(meter.submit(data))
+        self.assertIsNone(meter.submit(data))
+        self.assertEqual(meter.dropped, 1)
+        meter.close()
+
+
+class TestSeeingBenchmark(unittest.TestCase):
+    """The seeing has to keep up with unbinned 2048x2048 frames."""
+    def test_frame_rate(self):
+        data = star_field((2048, 2048), 150, 2.5, 2.5)
+        seeing.frame_seeing(data)
+        times = []
+        for i in range(5):
+            start = time.time()
+            result = seeing.frame_seeing(data)
+            times.append(time.time() - start)
+        self.assertEqual(result.nsources, 100)
+        # the fastest ecamera frames are a second apart.
+        self.assertLess(np.median(times), 0.25, '2048x2048, %d sources: %0.1f ms per frame' %
+                        (result.nsources, np.median(times)*1000))
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
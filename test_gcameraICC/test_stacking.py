@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""unittests for combining stacked exposures as they arrive."""
+
+import time
+import unittest
+import numpy as np
+
+from gcameraICC import masters
+from gcameraICC import stacking
+
+class TestStackAccumulator(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(44)
+        self.frames = [np.random.poisson(1000, (40, 30)).astype('u2') for i in range(5)]
+        # one cosmic ray, for the clipped mean to reject.
+        self.frames[2][10, 10] = 60000
+
+    def combine(self, method, nsigma=3.):
+        accumulator = stacking.StackAccumulator(len(self.frames), method=method, nsigma=nsigma)
+        for frame in self.frames:
+            accumulator.add(frame)
+        return accumulator.finish()
+
+    def test_median(self):
+        """Exactly what the unpipelined stack has always written."""
+        np.testing.assert_array_equal(self.combine('median'),
+                                      np.median(self.frames, axis=0).astype('u2'))
+
+    def test_mean(self):
+        expected = np.round(np.mean(np.array(self.frames, dtype=float), axis=0)).astype('u2')
+        np.testing.assert_array_equal(self.combine('mean'), expected)
+
+    def test_clip(self):
+        # with 5 frames, no value can be more than 1.8 sigma out.
+        combined = self.combine('clip', nsigma=1.5)
+        expected = np.round(masters.sigma_clip_mean(self.frames, nsigma=1.5)).astype('u2')
+        np.testing.assert_array_equal(combined, expected)
+        self.assertLess(combined[10, 10], 2000)
+
+    def test_bad_method(self):
+        with self.assertRaises(ValueError):
+            stacking.StackAccumulator(3, method='sum')
+
+    def test_too_few(self):
+        accumulator = stacking.StackAccumulator(3)
+        accumulator.add(self.frames[0])
+        with self.assertRaises(ValueError):
+            accumulator.finish()
+
+    def test_too_many(self):
+        accumulator = stacking.StackAccumulator(1)
+        accumulator.add(self.frames[0])
+        with self.assertRaises(ValueError):
+            accumulator.add(self.frames[1])
+        accumulator.close()
+
+    def test_fold_error(self):
+        accumulator = stacking.StackAccumulator(2, method='mean')
+        accumulator.add(self.frames[0])
+        accumulator.add(np.zeros((3, 3), dtype='u2'))
+        with self.assertRaises(ValueError):
+            accumulator.finish()
+
+    def test_close_abandons(self):
+        accumulator = stacking.StackAccumulator(3)
+        accumulator.add(self.frames[0])
+        accumulator.close()
+        self.assertFalse(accumulator._thread.is_alive())
+
+
+class FakeCamera(object):
+    """Integrates by sleeping, then 'reads out' a new frame."""
+    readout = 0.05
+
+    def __init__(self, shape):
+        self.shape = shape
+
+    def expose(self, itime):
+        time.sleep(itime + self.readout)
+        return np.random.randint(900, 1100, self.shape).astype('u2')
+
+
+class TestStackTiming(unittest.TestCase):
+    """How long a stack takes, against N x (itime + readout)."""
+    nframes = 5
+    itime = 0.1
+
+    def time_stack(self, method):
+        camera = FakeCamera((1024, 1024))
+        start = time.time()
+        accumulator = stacking.StackAccumulator(self.nframes, method=method)
+        for i in range(self.nframes):
+            accumulator.add(camera.expose(self.itime))
+        lastReadout = time.time()
+        accumulator.finish()
+        end = time.time()
+        return end - start, end - lastReadout
+
+    def test_stack_time(self):
+        floor = self.nframes*(self.itime + FakeCamera.readout)
+        for method in stacking.methods:
+            total, tail = self.time_stack(method)
+            # folding in overlaps the exposures; only the final combine is left at the end.
+            self.assertLess(total - floor, 0.1 + tail,
+                            '%s: %d x %gs: %0.3fs total, %0.3fs floor, %0.3fs after the last readout' %
+                            (method, self.nframes, self.itime, total, floor, tail))
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
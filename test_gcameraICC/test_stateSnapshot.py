@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""unittests for the ICC state snapshot."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcameraICC import stateSnapshot
+
+class TestStateSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dataRoot = tempfile.mkdtemp()
+        self.dataDir = os.path.join(self.dataRoot, '57000')
+        os.mkdir(self.dataDir)
+        for seqno in (1, 2, 3):
+            open(self.frame(seqno), 'w').write('x')
+        self.path = stateSnapshot.snapshot_path(self.dataRoot, 'gcamera')
+        self.state = {'dataDir': self.dataDir, 'seqno': 4,
+                      'biasFile': self.frame(1), 'biasTemp': -40.1,
+                      'darkFile': self.frame(2), 'darkTemp': -40.2,
+                      'flatFile': None, 'flatCartridge': -1,
+                      'cameraFormat': 'BOSS', 'coolerSetpoint': -40., 'readTime': 0.61}
+
+    def tearDown(self):
+        shutil.rmtree(self.dataRoot)
+
+    def frame(self, seqno):
+        return os.path.join(self.dataDir, 'gimg-%04d.fits.gz' % (seqno))
+
+    def write(self, text):
+        open(self.path, 'w').write(text)
+
+    def test_snapshot_path(self):
+        self.assertEqual(self.path, os.path.join(self.dataRoot, 'gcamera-state.json'))
+
+    def test_round_trip(self):
+        self.write(stateSnapshot.dumps(self.state, 1234.5))
+        state = stateSnapshot.read(self.path)
+        self.assertEqual(state['time'], 1234.5)
+        self.assertEqual(dict((field, state[field]) for field in stateSnapshot.fields), self.state)
+        self.assertIsInstance(state['dataDir'], str)
+        self.assertIsNone(stateSnapshot.check_frames(state, self.dataDir))
+
+    def test_read_bad(self):
+        self.assertIsNone(stateSnapshot.read(self.path))
+        self.write('{"dataDir": ')
+        self.assertIsNone(stateSnapshot.read(self.path))
+        old = json.loads(stateSnapshot.dumps(self.state, 0))
+        old['version'] = stateSnapshot.VERSION - 1
+        self.write(json.dumps(old))
+        self.assertIsNone(stateSnapshot.read(self.path))
+        del old['readTime']
+        old['version'] = stateSnapshot.VERSION
+        self.write(json.dumps(old))
+        self.assertIsNone(stateSnapshot.read(self.path))
+
+    def test_another_night(self):
+        self.assertIn('not', stateSnapshot.check_frames(self.state, os.path.join(self.dataRoot, '57001')))
+
+    def test_frame_written_since(self):
+        open(self.frame(4), 'w').write('x')
+        self.assertIn('frame 4', stateSnapshot.check_frames(self.state, self.dataDir))
+
+    def test_frame_missing(self):
+        self.state['seqno'] = 5
+        self.assertIn('frame 4 is missing', stateSnapshot.check_frames(self.state, self.dataDir))
+
+    def test_calibration_missing(self):
+        os.remove(self.frame(2))
+        self.state['seqno'] = 2
+        self.assertIn('darkFile', stateSnapshot.check_frames(self.state, self.dataDir))
+
+    def test_first_frame(self):
+        dataDir = os.path.join(self.dataRoot, '57001')
+        os.mkdir(dataDir)
+        state = dict(self.state, dataDir=dataDir, seqno=1, biasFile=None, darkFile=None)
+        self.assertIsNone(stateSnapshot.check_frames(state, dataDir))
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""unittests for the cooler telemetry monitor."""
+
+import unittest
+import numpy as np
+
+from gcameraICC import telemetry
+from gcameraICC.Controllers.BaseCam import CoolerSample
+
+def sample(t, ccdTemp=-40., setpoint=-40, drive=np.nan, statusText='Stabilized'):
+    return CoolerSample(t, setpoint, ccdTemp, np.nan, drive, np.nan, statusText)
+
+class TestCoolerMonitor(unittest.TestCase):
+    def setUp(self):
+        self.monitor = telemetry.CoolerMonitor(deadband=0.2, driveDeadband=1, heartbeat=60)
+
+    def test_first_sample_reported(self):
+        self.assertTrue(self.monitor.update(sample(0)))
+
+    def test_nan_unchanged(self):
+        """NaN fields (e.g. the Andor heatsink and fan) must not count as a change."""
+        self.monitor.update(sample(0))
+        self.assertFalse(self.monitor.update(sample(1)))
+
+    def test_within_deadband(self):
+        self.monitor.update(sample(0))
+        self.assertFalse(self.monitor.update(sample(1, ccdTemp=-40.1)))
+        self.assertFalse(self.monitor.update(sample(2, ccdTemp=-39.9)))
+
+    def test_beyond_deadband(self):
+        """The deadband is measured from the last reported value, so slow drifts are caught."""
+        self.monitor.update(sample(0))
+        self.assertFalse(self.monitor.update(sample(1, ccdTemp=-39.85)))
+        self.assertTrue(self.monitor.update(sample(2, ccdTemp=-39.7)))
+
+    def test_drive_deadband(self):
+        self.monitor.update(sample(0, drive=50))
+        self.assertFalse(self.monitor.update(sample(1, drive=50.5)))
+        self.assertTrue(self.monitor.update(sample(2, drive=52)))
+
+    def test_status_and_setpoint_changes(self):
+        self.monitor.update(sample(0))
+        self.assertTrue(self.monitor.update(sample(1, statusText='NotStabilized')))
+        self.assertTrue(self.monitor.update(sample(2, setpoint=None, statusText='NotStabilized')))
+        self.assertFalse(self.monitor.update(sample(3, setpoint=None, statusText='NotStabilized')))
+
+    def test_heartbeat(self):
+        self.monitor.update(sample(0))
+        self.assertFalse(self.monitor.update(sample(59)))
+        self.assertTrue(self.monitor.update(sample(60)))
+
+    def test_reset(self):
+        self.monitor.update(sample(0))
+        self.monitor.reset()
+        self.assertTrue(self.monitor.update(sample(1)))
+
+
+if __name__ == '__main__':
+    verbosity = 2
+
+    unittest.main(verbosity=verbosity)